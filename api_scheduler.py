@@ -0,0 +1,243 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+from config import (
+    GOOGLE_SHEETS_READS_PER_MINUTE, GOOGLE_SHEETS_WRITES_PER_MINUTE, GOOGLE_DRIVE_REQUESTS_PER_MINUTE,
+    GOOGLE_API_BURST_SECONDS, GOOGLE_API_MAX_CONCURRENCY, GOOGLE_API_BATCH_SHARE,
+    GOOGLE_API_MAX_RETRIES, GOOGLE_API_BACKOFF_SECONDS, GOOGLE_API_MAX_BACKOFF_SECONDS,
+)
+from metrics import observe, increment, RETRYABLE_STATUSES
+
+# Todas las peticiones HTTP a Sheets y Drive pasan por aquí (google_clients.py envuelve cada transporte):
+# se respeta la cuota por minuto de cada API, se limita cuántas van a la vez y se reintentan los 429/5xx
+# con espera exponencial con jitter, o la que indique Google en Retry-After.
+
+# Prioridades: la ingesta (alguien espera la respuesta) va antes que el trabajo por lotes del generador.
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+_default_priority = INTERACTIVE
+_thread_state = threading.local()
+
+def set_thread_priority(level):
+    """Fija la prioridad de las peticiones del hilo actual (por ejemplo, como initializer de un grupo de hilos)."""
+    _thread_state.priority = level
+
+@contextmanager
+def process_priority(level):
+    """
+    Cambia la prioridad por defecto del proceso mientras dura el bloque. Alcanza también a los hilos
+    que se creen dentro, salvo los que fijaron la suya con set_thread_priority.
+    """
+    global _default_priority
+    previous, _default_priority = _default_priority, level
+    try:
+        yield
+    finally:
+        _default_priority = previous
+
+def current_priority():
+    return getattr(_thread_state, 'priority', None) or _default_priority
+
+class _TokenBucket:
+    """Cubeta de fichas que se recarga a 'per_minute' por minuto y acumula hasta GOOGLE_API_BURST_SECONDS de cuota."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * GOOGLE_API_BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """Segundos que faltan para que haya una ficha (0 si ya la hay)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+class _ApiLimiter:
+    """
+    Cuotas, concurrencia y pausas de una API. Las peticiones interactivas en espera pasan antes que las de lotes,
+    y las de lotes además solo usan GOOGLE_API_BATCH_SHARE de la cuota, para dejar margen a la ingesta
+    aunque el generador corra en otro proceso.
+    """
+
+    def __init__(self, api, quotas):
+        self.api = api
+        # Una cubeta por tipo de petición ('read', 'write' o 'all'); cuota 0 = sin límite.
+        self.buckets = {kind: _TokenBucket(per_minute) for kind, per_minute in quotas.items() if per_minute > 0}
+        self.batch_buckets = {
+            kind: _TokenBucket(per_minute * GOOGLE_API_BATCH_SHARE)
+            for kind, per_minute in quotas.items() if per_minute > 0 and 0 < GOOGLE_API_BATCH_SHARE < 1
+        }
+        self.in_flight = 0
+        self.waiting_interactive = 0
+        # Tras un 429 nadie envía peticiones a esta API hasta este instante (time.monotonic).
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, kind, level):
+        """Espera turno para una petición de tipo 'kind'. Devuelve (segundos de espera, motivo de la primera espera)."""
+        start = time.monotonic()
+        reason = None
+        with self._cond:
+            if level == INTERACTIVE:
+                self.waiting_interactive += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now < self.paused_until:
+                        reason = reason or 'retry_after'
+                        self._cond.wait(self.paused_until - now)
+                        continue
+                    if level != INTERACTIVE and self.waiting_interactive:
+                        reason = reason or 'priority'
+                        self._cond.wait()
+                        continue
+                    if GOOGLE_API_MAX_CONCURRENCY > 0 and self.in_flight >= GOOGLE_API_MAX_CONCURRENCY:
+                        reason = reason or 'concurrency'
+                        self._cond.wait()
+                        continue
+                    buckets = [b for b in (self.buckets.get(kind), level != INTERACTIVE and self.batch_buckets.get(kind)) if b]
+                    delay = max([bucket.delay(now) for bucket in buckets] or [0.0])
+                    if delay > 0:
+                        reason = reason or 'quota'
+                        self._cond.wait(delay)
+                        continue
+                    for bucket in buckets:
+                        bucket.take()
+                    self.in_flight += 1
+                    return time.monotonic() - start, reason
+            finally:
+                if level == INTERACTIVE:
+                    self.waiting_interactive -= 1
+                    self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Detiene las peticiones a esta API durante 'seconds' (lo que pidió Google en un 429)."""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_limiters = {
+    'sheets': _ApiLimiter('sheets', {'read': GOOGLE_SHEETS_READS_PER_MINUTE, 'write': GOOGLE_SHEETS_WRITES_PER_MINUTE}),
+    'drive': _ApiLimiter('drive', {'all': GOOGLE_DRIVE_REQUESTS_PER_MINUTE}),
+}
+
+def _request_kind(api, method):
+    if api != 'sheets':
+        return 'all'
+    return 'read' if method in ('GET', 'HEAD') else 'write'
+
+def _is_idempotent(method, url):
+    """
+    Peticiones que se pueden repetir tras un 5xx o un corte de red sin duplicar datos. Un POST como
+    values.append o files.create pudo haberse aplicado aunque la respuesta fallara, así que solo se
+    repite ante un 429 (Google lo rechazó sin procesarlo). values:batchUpdate escribe celdas fijas.
+    """
+    return method != 'POST' or '/values:batchUpdate' in url
+
+def _request_target(args, kwargs):
+    """Devuelve (método, url) de una llamada a request de httplib2 (uri, method) o de requests (method, url)."""
+    if 'url' in kwargs or (args and not str(args[0]).startswith(('http://', 'https://'))):
+        method = kwargs.get('method') or (args[0] if args else 'GET')
+        url = kwargs.get('url') or (args[1] if len(args) > 1 else '')
+    else:
+        url = kwargs.get('uri') or (args[0] if args else '')
+        method = kwargs.get('method') or (args[1] if len(args) > 1 else 'GET')
+    return str(method).upper(), str(url)
+
+def _response_status(response):
+    """Devuelve (código, Retry-After en segundos o None) de una respuesta de httplib2 o de requests."""
+    # httplib2 devuelve (respuesta, contenido) y la respuesta es el diccionario de cabeceras.
+    resp = response[0] if isinstance(response, tuple) else response
+    status = int(getattr(resp, 'status', None) or getattr(resp, 'status_code', 0))
+    headers = getattr(resp, 'headers', resp)
+    return status, _parse_retry_after(headers.get('retry-after') if headers is not None else None)
+
+def _parse_retry_after(value):
+    """Retry-After puede venir en segundos o como fecha HTTP."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, retry_after=None):
+    """Espera antes del reintento 'attempt' (desde 1): la de Retry-After si la hay, o exponencial con jitter completo."""
+    if retry_after is not None:
+        return min(retry_after, GOOGLE_API_MAX_BACKOFF_SECONDS) + random.uniform(0, GOOGLE_API_BACKOFF_SECONDS)
+    return random.uniform(0, min(GOOGLE_API_MAX_BACKOFF_SECONDS, GOOGLE_API_BACKOFF_SECONDS * 2 ** (attempt - 1)))
+
+def schedule_transport(transport, api):
+    """
+    Envuelve el método request de un transporte HTTP (httplib2 para googleapiclient o una sesión de requests
+    para gspread) para que cada petición a la API 'api' espere su turno y se reintente ante 429/5xx.
+    Se aplica después de metrics.instrument_transport, así que cada intento queda medido por separado.
+    """
+    request = transport.request
+    limiter = _limiters[api]
+
+    def scheduled_request(*args, **kwargs):
+        # AuthorizedHttp se llama a sí mismo tras refrescar el token: esa petición ya tiene su turno.
+        if getattr(_thread_state, 'active', False):
+            return request(*args, **kwargs)
+        method, url = _request_target(args, kwargs)
+        kind = _request_kind(api, method)
+        level = current_priority()
+        attempt = 0
+        _thread_state.active = True
+        try:
+            while True:
+                attempt += 1
+                waited, reason = limiter.acquire(kind, level)
+                if reason:
+                    increment('google_api_throttled_total', api=api, reason=reason)
+                    observe('google_api_wait_seconds', waited, api=api, priority=level)
+                try:
+                    response = request(*args, **kwargs)
+                except OSError as e:
+                    if attempt > GOOGLE_API_MAX_RETRIES or not _is_idempotent(method, url):
+                        raise
+                    delay = backoff_delay(attempt)
+                    increment('google_api_retries_total', api=api, reason='network')
+                    print(f"  - {api}: error de red ({e}); reintento {attempt}/{GOOGLE_API_MAX_RETRIES} en {delay:.1f} s.")
+                    time.sleep(delay)
+                    continue
+                finally:
+                    limiter.release()
+
+                status, retry_after = _response_status(response)
+                if status == 429:
+                    increment('google_api_throttled_total', api=api, reason='429')
+                if status not in RETRYABLE_STATUSES or attempt > GOOGLE_API_MAX_RETRIES:
+                    return response
+                if status != 429 and not _is_idempotent(method, url):
+                    return response
+                delay = backoff_delay(attempt, retry_after)
+                if status == 429:
+                    # La cuota es de todo el proyecto: las demás peticiones a esta API también esperan.
+                    limiter.pause(delay)
+                increment('google_api_retries_total', api=api, reason=str(status))
+                print(f"  - {api}: respuesta {status}; reintento {attempt}/{GOOGLE_API_MAX_RETRIES} en {delay:.1f} s.")
+                time.sleep(delay)
+        finally:
+            _thread_state.active = False
+
+    transport.request = scheduled_request
+    return transport
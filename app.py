@@ -1,10 +1,13 @@
 import os
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1' # Permite OAuth sobre HTTP para desarrollo.
-from flask import Flask, request, jsonify, redirect, url_for, session
+from flask import Flask, Response, request, jsonify, redirect, url_for, session
 from flask_cors import CORS
 
-from data_ingestion.ingestion_service import ingest_survey
-from google_clients import get_auth_flow, save_credentials, get_credentials
+from config import INGESTION_MODE, BULK_MAX_SURVEYS
+from data_ingestion.ingestion_service import ingest_survey, ingest_batch, IncompleteIngestionError
+from data_ingestion.spool_service import enqueue_survey, get_ticket_status, start_workers
+from google_clients import get_auth_flow, save_credentials, get_credentials, get_credentials_status
+from metrics import timed, render_prometheus
 
 app = Flask(__name__)
 CORS(app) # Habilita CORS para todas las rutas
@@ -15,6 +18,10 @@ app.secret_key = os.urandom(24)
 # La URL donde corre tu PWA. El usuario será redirigido aquí después de la autenticación.
 PWA_URL = os.environ.get("PWA_URL", "http://localhost:8080")
 
+# En modo 'spool' las encuestas se procesan en segundo plano desde la cola local.
+if INGESTION_MODE == 'spool':
+    start_workers()
+
 # --- Rutas de Autenticación ---
 @app.route('/login')
 def login():
@@ -52,22 +59,31 @@ def oauth2callback():
 
 @app.route('/auth/status')
 def auth_status():
-    """Verifica si el usuario está autenticado (si existe token.json)."""
+    """
+    Verifica si el usuario está autenticado (si existe token.json). En 'token' incluye el vencimiento,
+    los refrescos hechos y el último error de refresco, para diagnosticar un token que dejó de renovarse.
+    """
     if get_credentials():
-        return jsonify({'status': 'authenticated'}), 200
+        return jsonify({'status': 'authenticated', 'token': get_credentials_status()}), 200
     else:
-        return jsonify({'status': 'unauthenticated'}), 401
+        return jsonify({'status': 'unauthenticated', 'token': get_credentials_status()}), 401
 
 # --- Rutas de la API ---
 @app.route('/')
 def home():
     return "Servidor de Encuestas para Acueducto (Modular): Activo y listo para recibir datos."
 
+def _spool_incomplete(datos_json_str, fotos, progreso):
+    """Pasa a la cola local una encuesta que falló a medias en modo 'sync', con su progreso. Devuelve el ticket."""
+    start_workers()
+    return enqueue_survey(datos_json_str, fotos, progress=progreso)
+
 @app.route('/ingestar-encuesta', methods=['POST'])
 def ingestar_encuesta_route():
     """Recibe y procesa una encuesta, requiere autenticación previa."""
     # Paso 1: Verificar si el usuario está autenticado.
-    credentials = get_credentials()
+    with timed('ingest.credentials'):
+        credentials = get_credentials()
     if not credentials:
         print("Bloqueando solicitud: Se requiere autenticación.")
         return jsonify({'mensaje': 'Error: Se requiere autenticación. Por favor, inicie sesión.'}), 401
@@ -79,13 +95,102 @@ def ingestar_encuesta_route():
         datos_json_str = request.form['data']
         fotos = request.files.getlist('fotos')
 
+        if INGESTION_MODE == 'spool':
+            # Guardamos la encuesta en la cola local y respondemos sin esperar a Google.
+            ticket = enqueue_survey(datos_json_str, fotos)
+            return jsonify({'mensaje': 'Encuesta recibida y encolada para su procesamiento.', 'ticket': ticket}), 202
+
         # Llamamos al servicio de ingesta
-        ingest_survey(datos_json_str, fotos)
+        fila = ingest_survey(datos_json_str, fotos)
+
+        return jsonify({'mensaje': 'Encuesta recibida y procesada correctamente.', 'fila': fila}), 200
 
-        return jsonify({'mensaje': 'Encuesta recibida y procesada correctamente.'}), 200
+    except IncompleteIngestionError as e:
+        # La fila (si se escribió) queda 'Incompleto' hasta que la cola termine la encuesta desde donde quedó.
+        # El cliente no debe reenviarla: eso agregaría otra fila y volvería a subir las fotos.
+        print(f"Encuesta incompleta en /ingestar-encuesta: {e}")
+        ticket = _spool_incomplete(datos_json_str, fotos, e.progress())
+        return jsonify({
+            'mensaje': f'Encuesta incompleta ({e}); se completará en segundo plano.',
+            'ticket': ticket, 'fila': e.fila, 'fotos_subidas': e.uploaded
+        }), 202
 
     except Exception as e:
         print(f"Error inesperado en /ingestar-encuesta: {e}")
         return jsonify({'mensaje': f'Error interno del servidor: {e}'}), 500
 
+@app.route('/ingestar-encuestas', methods=['POST'])
+def ingestar_encuestas_route():
+    """
+    Recibe un lote de encuestas sincronizadas desde la PWA, una encuesta JSON por línea (NDJSON).
+    Acepta el NDJSON como cuerpo de la solicitud (application/x-ndjson) o en un formulario
+    multipart, en el campo 'data', con las fotos de la encuesta n (desde 0) en el campo 'fotos_<n>'.
+    Responde con el resultado de cada encuesta.
+    """
+    with timed('ingest.credentials'):
+        credentials = get_credentials()
+    if not credentials:
+        print("Bloqueando solicitud: Se requiere autenticación.")
+        return jsonify({'mensaje': 'Error: Se requiere autenticación. Por favor, inicie sesión.'}), 401
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            ndjson = request.form.get('data', '')
+            fotos = {}
+            for field in request.files:
+                prefix, _, index = field.partition('_')
+                if prefix == 'fotos' and index.isdigit():
+                    fotos[int(index)] = request.files.getlist(field)
+        else:
+            ndjson = request.get_data(as_text=True)
+            fotos = {}
+        # Las líneas vacías no cuentan: la encuesta n es la n-ésima línea con contenido.
+        lineas = [linea for linea in ndjson.splitlines() if linea.strip()]
+
+        if not lineas:
+            return jsonify({'mensaje': 'Error: El lote no contiene encuestas.'}), 400
+        if len(lineas) > BULK_MAX_SURVEYS:
+            return jsonify({'mensaje': f'Error: El lote supera el máximo de {BULK_MAX_SURVEYS} encuestas.'}), 413
+        print(f"Paso 1: Lote de {len(lineas)} encuestas recibido (usuario autenticado).")
+
+        if INGESTION_MODE == 'spool':
+            tickets = [
+                {'indice': i, 'ticket': enqueue_survey(linea, fotos.get(i, []))}
+                for i, linea in enumerate(lineas)
+            ]
+            return jsonify({'mensaje': 'Lote recibido y encolado para su procesamiento.', 'resultados': tickets}), 202
+
+        resultados = ingest_batch(lineas, fotos)
+        for resultado in resultados:
+            # Las encuestas válidas que quedaron a medias se terminan desde la cola, sin duplicar filas ni fotos.
+            if resultado['estado'] != 'ok' and 'fotos_subidas' in resultado:
+                i = resultado['indice']
+                resultado['ticket'] = _spool_incomplete(
+                    lineas[i], fotos.get(i, []), {'fila': resultado['fila'], 'fotos_subidas': resultado['fotos_subidas']}
+                )
+                resultado['estado'] = 'en_cola'
+        errores = sum(1 for r in resultados if r['estado'] == 'error')
+        en_cola = sum(1 for r in resultados if r['estado'] == 'en_cola')
+        mensaje = (f'Lote procesado: {len(resultados) - errores - en_cola} encuestas correctas,'
+                   f' {en_cola} en cola para completarse y {errores} con error.')
+        # 207 (Multi-Status) indica que hay que revisar el resultado de cada encuesta.
+        return jsonify({'mensaje': mensaje, 'resultados': resultados}), 207 if errores or en_cola else 200
+
+    except Exception as e:
+        print(f"Error inesperado en /ingestar-encuestas: {e}")
+        return jsonify({'mensaje': f'Error interno del servidor: {e}'}), 500
+
+@app.route('/ingestar-encuesta/<ticket>', methods=['GET'])
+def estado_encuesta_route(ticket):
+    """Consulta el estado de una encuesta encolada a partir de su ticket."""
+    estado = get_ticket_status(ticket)
+    if estado is None:
+        return jsonify({'mensaje': f'No existe el ticket {ticket}.'}), 404
+    return jsonify(estado), 200
+
+@app.route('/metrics')
+def metrics_route():
+    """Expone los tiempos por etapa y los contadores de llamadas a Google en formato Prometheus."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 # Para pruebas locales: flask --app app run
\ No newline at end of file
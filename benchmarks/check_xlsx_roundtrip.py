@@ -0,0 +1,136 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+import zipfile
+
+# Comprobación sin red del motor zip (report_generation/xlsx_appender.py): agrega hojas a la plantilla
+# ejemplo.xltx y a una variante con los atributos entre comillas simples (XML igual de válido, como lo
+# escriben otras herramientas), y revisa con openpyxl que ambos libros se leen y tienen el mismo contenido.
+#
+#   python -m benchmarks.check_xlsx_roundtrip
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILE = os.path.join(ROOT, 'ejemplo.xltx')
+
+sys.path.insert(0, ROOT)
+os.environ.setdefault('GOOGLE_CREDENTIALS_JSON', '{"web": {}}')
+
+_OPENING_TAG_RE = re.compile(r'<[\w:]+\b[^>]*>')
+_DOUBLE_QUOTED_ATTR_RE = re.compile(r'(\s[\w:]+)="([^"]*)"')
+
+def _single_quoted(xml):
+    """Reescribe los atributos de cada etiqueta como nombre = 'valor'."""
+    def requote(match):
+        name, value = match.groups()
+        return f"{name} = '" + value.replace("'", '&apos;') + "'"
+    return _OPENING_TAG_RE.sub(lambda tag: _DOUBLE_QUOTED_ATTR_RE.sub(requote, tag.group(0)), xml)
+
+def _write_variant(src_path, dst_path):
+    """Copia el libro con todas sus partes XML reescritas con comillas simples."""
+    with zipfile.ZipFile(src_path) as src, zipfile.ZipFile(dst_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename.endswith(('.xml', '.rels')):
+                data = _single_quoted(data.decode('utf-8')).encode('utf-8')
+            dst.writestr(info.filename, data)
+
+def _media_parts(path):
+    with zipfile.ZipFile(path) as zf:
+        return {name for name in zf.namelist() if name.startswith('xl/media/')}
+
+def _normalize(value):
+    return None if value == '' else value
+
+def _check_workbook(path, source_path, sheets, template_images):
+    """Devuelve los errores encontrados al comparar el libro generado con lo que se le pidió escribir."""
+    import openpyxl
+
+    errors = []
+    workbook = openpyxl.load_workbook(path)
+    source = openpyxl.load_workbook(source_path)
+    template, original = workbook.worksheets[0], source.worksheets[0]
+    changed = [coord for coord, cell in original._cells.items()
+               if _normalize(template._cells[coord].value if coord in template._cells else None) != _normalize(cell.value)]
+    if changed:
+        errors.append(f"la plantilla cambió en {len(changed)} celdas")
+    for title, payload in sheets:
+        if title not in workbook.sheetnames:
+            errors.append(f"falta la hoja '{title}'")
+            continue
+        sheet = workbook[title]
+        wrong = [coord for coord, value in payload['values'].items() if _normalize(sheet[coord].value) != _normalize(value)]
+        if wrong:
+            errors.append(f"'{title}': {len(wrong)} celdas con otro valor (por ejemplo {wrong[0]})")
+        expected_images = template_images + len(payload['images'])
+        if len(sheet._images) != expected_images:
+            errors.append(f"'{title}': {len(sheet._images)} imágenes en vez de {expected_images}")
+    return errors
+
+def check(source_path, sheets, work_dir, label):
+    """Agrega las hojas dos veces seguidas (la segunda sobre el libro ya ampliado) y revisa cada resultado."""
+    import openpyxl
+    from report_generation.xlsx_appender import append_sheets, dedupe_media, verify_workbook
+
+    template_images = len(openpyxl.load_workbook(source_path).worksheets[0]._images)
+    first_path = os.path.join(work_dir, f'{label}_1.xlsx')
+    second_path = os.path.join(work_dir, f'{label}_2.xlsx')
+    errors = []
+
+    titles = append_sheets(source_path, first_path, [(f'{title}_a', payload) for title, payload in sheets])
+    verify_workbook(first_path, titles)
+    errors += _check_workbook(first_path, source_path, [(f'{t}_a', p) for t, p in sheets], template_images)
+
+    # Las mismas imágenes otra vez: deben reutilizar las que el libro ya tiene.
+    titles = append_sheets(first_path, second_path, [(f'{title}_b', payload) for title, payload in sheets])
+    verify_workbook(second_path, titles)
+    errors += _check_workbook(second_path, source_path, [(f'{t}_b', p) for t, p in sheets], template_images)
+    added_media = _media_parts(second_path) - _media_parts(first_path)
+    if added_media:
+        errors.append(f"la segunda pasada guardó de nuevo {len(added_media)} imágenes")
+
+    with open(second_path, 'rb') as src_file, tempfile.TemporaryFile() as dst_file:
+        removed, _ = dedupe_media(src_file, dst_file)
+    if removed:
+        errors.append(f"dedupe_media encontró {removed} imágenes repetidas en un libro del motor zip")
+
+    for error in errors:
+        print(f"  - {label}: {error}")
+    print(f"{label}: {'OK' if not errors else f'{len(errors)} errores'} ({len(sheets)} hojas por pasada).")
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprueba el motor zip con comillas dobles y simples en el XML.")
+    parser.add_argument('--records', type=int, default=3, help="Hojas que se agregan en cada pasada.")
+    parser.add_argument('--seed', type=int, default=1234, help="Semilla de los datos sintéticos.")
+    args = parser.parse_args()
+
+    import openpyxl
+    from config import SHEET_HEADERS, PENDING_STATUS
+    from benchmarks.synthetic import make_rng, make_survey, make_photo, survey_to_sheet_row
+    from report_generation.excel_handler import build_sheet_payload
+
+    rng = make_rng(args.seed)
+    header = list(SHEET_HEADERS)
+    sheets = []
+    for i in range(args.records):
+        record = dict(zip(header, survey_to_sheet_row(make_survey(rng, i), header, PENDING_STATUS)))
+        # Una foto repetida entre hojas, para comprobar que se guarda una sola vez.
+        photo = make_photo(rng, 160, 120) if i < 2 else sheets[0][1]['images'][-1][0]
+        sheets.append((str(record['pozo_numero']), build_sheet_payload(record, photo)))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        double_path = os.path.join(work_dir, 'comillas_dobles.xlsx')
+        workbook = openpyxl.load_workbook(TEMPLATE_FILE)
+        workbook.template = False
+        workbook.save(double_path)
+        single_path = os.path.join(work_dir, 'comillas_simples.xlsx')
+        _write_variant(double_path, single_path)
+
+        errors = check(double_path, sheets, work_dir, 'comillas_dobles')
+        errors += check(single_path, sheets, work_dir, 'comillas_simples')
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
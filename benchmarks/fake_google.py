@@ -0,0 +1,468 @@
+import re
+import json
+import uuid
+import time
+import hashlib
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from email import policy
+from email.parser import BytesParser
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import httplib2
+import requests
+from google.oauth2.credentials import Credentials
+
+SHEETS_URL = 'https://sheets.googleapis.com/v4/spreadsheets/'
+DRIVE_URL = 'https://www.googleapis.com/drive/v3/files'
+DRIVE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'
+DRIVE_CHANGES_URL = 'https://www.googleapis.com/drive/v3/changes'
+
+_CELL_REF_RE = re.compile(r'^([A-Z]*)(\d*)$')
+
+# --- Notación A1 ---
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index
+
+def _column_letters(index):
+    letters = ''
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(ord('A') + rest) + letters
+    return letters
+
+def _split_range(range_name):
+    """Separa "'Hoja'!A1:B2" en ('Hoja', 'A1:B2'). Un nombre sin celdas es la hoja completa."""
+    if '!' in range_name:
+        sheet, cells = range_name.rsplit('!', 1)
+    elif re.fullmatch(r'[A-Z]*\d*(:[A-Z]*\d*)?', range_name):
+        sheet, cells = None, range_name
+    else:
+        sheet, cells = range_name, ''
+    if sheet is not None and sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, cells
+
+def _parse_cells(cells):
+    """Convierte 'A2:C' en (fila1, col1, fila2, col2), con None en los extremos abiertos."""
+    if not cells:
+        return 1, 1, None, None
+    start, _, end = cells.partition(':')
+    start_col, start_row = _CELL_REF_RE.match(start).groups()
+    end_col, end_row = _CELL_REF_RE.match(end or start).groups()
+    return (int(start_row) if start_row else 1, _column_index(start_col) if start_col else 1,
+            int(end_row) if end_row else None, _column_index(end_col) if end_col else None)
+
+# --- Estado simulado ---
+
+class FakeSpreadsheet:
+    """Libro de Google Sheets en memoria: una lista de filas de texto por hoja."""
+
+    def __init__(self, spreadsheet_id, sheets):
+        self.id = spreadsheet_id
+        self.sheets = {title: [list(map(_cell_text, row)) for row in rows] for title, rows in sheets.items()}
+
+    def _rows(self, sheet):
+        return self.sheets[sheet or next(iter(self.sheets))]
+
+    def metadata(self):
+        return {
+            'spreadsheetId': self.id,
+            'properties': {'title': 'Benchmark', 'locale': 'es_CO', 'timeZone': 'America/Bogota'},
+            'sheets': [
+                {'properties': {'sheetId': i, 'title': title, 'index': i, 'sheetType': 'GRID',
+                                'gridProperties': {'rowCount': max(1000, len(rows)), 'columnCount': 40}}}
+                for i, (title, rows) in enumerate(self.sheets.items())
+            ],
+        }
+
+    def get(self, range_name):
+        sheet, cells = _split_range(range_name)
+        rows = self._rows(sheet)
+        row1, col1, row2, col2 = _parse_cells(cells)
+        values = []
+        for row in rows[row1 - 1:row2 if row2 is not None else len(rows)]:
+            selected = row[col1 - 1:col2 if col2 is not None else len(row)]
+            while selected and selected[-1] == '':
+                selected.pop()
+            values.append(selected)
+        while values and not values[-1]:
+            values.pop()
+        result = {'range': range_name, 'majorDimension': 'ROWS'}
+        if values:
+            result['values'] = values
+        return result
+
+    def update(self, range_name, values):
+        sheet, cells = _split_range(range_name)
+        rows = self._rows(sheet)
+        row1, col1, _, _ = _parse_cells(cells)
+        for r, row_values in enumerate(values):
+            while len(rows) < row1 + r:
+                rows.append([])
+            row = rows[row1 + r - 1]
+            for c, value in enumerate(row_values):
+                while len(row) < col1 + c:
+                    row.append('')
+                row[col1 + c - 1] = _cell_text(value)
+        return {'updatedRange': range_name, 'updatedRows': len(values),
+                'updatedCells': sum(len(v) for v in values)}
+
+    def append(self, range_name, values):
+        sheet, _ = _split_range(range_name)
+        rows = self._rows(sheet)
+        while rows and not any(rows[-1]):
+            rows.pop()
+        first_row = len(rows) + 1
+        rows.extend([_cell_text(v) for v in row] for row in values)
+        last_col = _column_letters(max((len(row) for row in values), default=1))
+        title = sheet or next(iter(self.sheets))
+        return {'spreadsheetId': self.id, 'updates': {
+            'updatedRange': f"'{title}'!A{first_row}:{last_col}{first_row + len(values) - 1}",
+            'updatedRows': len(values),
+        }}
+
+def _cell_text(value):
+    return '' if value is None else str(value)
+
+class FakeDrive:
+    """Archivos de Google Drive en memoria, con revisiones y sumas md5 como las de la API."""
+
+    def __init__(self):
+        self.files = {}
+        self._revision = 0
+        # Registro de cambios: ids de archivo en orden; el token de página es una posición en esta lista.
+        self.changes = []
+
+    def put(self, file_id=None, name='', parents=None, content=b'', mime_type='application/octet-stream'):
+        file_id = file_id or uuid.uuid4().hex
+        entry = self.files.setdefault(file_id, {'id': file_id, 'trashed': False})
+        entry.update({'name': name or entry.get('name', ''), 'parents': parents or entry.get('parents', []),
+                      'mimeType': mime_type})
+        self.set_content(file_id, content)
+        return entry
+
+    def trash(self, file_id):
+        self.files[file_id]['trashed'] = True
+        self.changes.append(file_id)
+
+    def set_content(self, file_id, content):
+        self.changes.append(file_id)
+        self._revision += 1
+        self.files[file_id].update({
+            'content': bytes(content), 'size': str(len(content)), 'md5Checksum': hashlib.md5(content).hexdigest(),
+            'headRevisionId': f"rev{self._revision}",
+            'modifiedTime': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        })
+
+    def metadata(self, file_id):
+        return {k: v for k, v in self.files[file_id].items() if k != 'content'}
+
+    def search(self, query):
+        """Evalúa las consultas 'q' que usa el proyecto: in parents, name =, name starts with y trashed."""
+        matches = []
+        for entry in self.files.values():
+            ok = True
+            for clause in re.split(r'\s+and\s+', query.strip()):
+                if m := re.fullmatch(r"'(.*)' in parents", clause):
+                    ok = m.group(1) in entry['parents']
+                elif m := re.fullmatch(r"name = '(.*)'", clause):
+                    ok = entry['name'] == m.group(1)
+                elif m := re.fullmatch(r"name starts with '(.*)'", clause):
+                    ok = entry['name'].startswith(m.group(1))
+                elif m := re.fullmatch(r"trashed = (true|false)", clause):
+                    ok = entry['trashed'] == (m.group(1) == 'true')
+                else:
+                    raise ValueError(f"Consulta no soportada por el Drive simulado: {clause}")
+                if not ok:
+                    break
+            if ok:
+                matches.append(self.metadata(entry['id']))
+        return matches
+
+# --- Backend ---
+
+class FakeGoogleBackend:
+    """
+    Sheets y Drive simulados en el mismo proceso. Se conecta con google_clients.set_client_backend:
+    los clientes reales (googleapiclient y gspread) hablan con este backend en lugar de con Google,
+    y cada llamada queda contada en 'calls'.
+    """
+
+    def __init__(self, latency=0.0, throttle_every=0):
+        self.credentials = Credentials(token='benchmark')
+        # Demora simulada de cada petición (segundos), para medir cuánto se solapan las llamadas.
+        self.latency = latency
+        # Con N > 0, una de cada N peticiones se rechaza con 429, como al agotar la cuota de Google.
+        self.throttle_every = throttle_every
+        self._requests = 0
+        self.spreadsheets = {}
+        self.drive = FakeDrive()
+        self.calls = Counter()
+        self.bytes_uploaded = 0
+        self.bytes_downloaded = 0
+        self._uploads = {}
+        self._lock = threading.RLock()
+
+    def add_spreadsheet(self, spreadsheet_id, sheets):
+        self.spreadsheets[spreadsheet_id] = FakeSpreadsheet(spreadsheet_id, sheets)
+        return self.spreadsheets[spreadsheet_id]
+
+    def http(self):
+        return FakeHttp(self)
+
+    def session(self):
+        return FakeSession(self)
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()),
+                    'bytes_uploaded': self.bytes_uploaded, 'bytes_downloaded': self.bytes_downloaded}
+
+    def handle(self, method, url, params, headers, body):
+        """Atiende una petición HTTP. Devuelve (estado, cabeceras, contenido en bytes)."""
+        if self.latency:
+            # La demora ocurre fuera del lock, como la red: las peticiones concurrentes se solapan.
+            time.sleep(self.latency)
+        with self._lock:
+            self._requests += 1
+            if self.throttle_every and self._requests % self.throttle_every == 0:
+                self._count('throttled')
+                return 429, {'content-type': 'application/json', 'retry-after': '0'}, json.dumps(
+                    {'error': {'code': 429, 'message': 'Quota exceeded', 'status': 'RESOURCE_EXHAUSTED'}}
+                ).encode('utf-8')
+            if url.startswith(SHEETS_URL):
+                return self._sheets(method, url[len(SHEETS_URL):], params, body)
+            if url.startswith(DRIVE_UPLOAD_URL):
+                return self._drive_upload(method, url[len(DRIVE_UPLOAD_URL):], params, headers, body)
+            if url.startswith(DRIVE_CHANGES_URL):
+                return self._drive_changes(method, url[len(DRIVE_CHANGES_URL):], params)
+            if url.startswith(DRIVE_URL):
+                return self._drive(method, url[len(DRIVE_URL):], params, headers, body)
+        raise ValueError(f"URL no soportada por el backend simulado: {method} {url}")
+
+    def _count(self, name):
+        self.calls[name] += 1
+
+    # --- Sheets ---
+
+    def _sheets(self, method, path, params, body):
+        spreadsheet_id, _, rest = path.partition('/')
+        if ':' in spreadsheet_id:
+            spreadsheet_id, _, action = spreadsheet_id.partition(':')
+            rest = ':' + action
+        spreadsheet = self.spreadsheets[spreadsheet_id]
+        payload = json.loads(body) if body else {}
+
+        if not rest:
+            self._count('sheets.spreadsheets.get')
+            return _json_response(spreadsheet.metadata())
+        if rest == 'values:batchGet':
+            self._count('sheets.values.batchGet')
+            ranges = params.get('ranges', [])
+            ranges = [ranges] if isinstance(ranges, str) else ranges
+            return _json_response({'spreadsheetId': spreadsheet_id,
+                                   'valueRanges': [spreadsheet.get(r) for r in ranges]})
+        if rest == 'values:batchUpdate':
+            self._count('sheets.values.batchUpdate')
+            responses = [spreadsheet.update(d['range'], d['values']) for d in payload.get('data', [])]
+            return _json_response({'spreadsheetId': spreadsheet_id, 'responses': responses,
+                                   'totalUpdatedCells': sum(r['updatedCells'] for r in responses)})
+        if rest.startswith('values/'):
+            range_name = unquote(rest[len('values/'):])
+            if range_name.endswith(':append'):
+                self._count('sheets.values.append')
+                return _json_response(spreadsheet.append(range_name[:-len(':append')], payload.get('values', [])))
+            if method == 'PUT':
+                self._count('sheets.values.update')
+                return _json_response(spreadsheet.update(range_name, payload.get('values', [])))
+            self._count('sheets.values.get')
+            return _json_response(spreadsheet.get(range_name))
+        raise ValueError(f"Operación de Sheets no soportada: {method} {path}")
+
+    # --- Drive ---
+
+    def _drive_changes(self, method, path, params):
+        if path.strip('/') == 'startPageToken':
+            self._count('drive.changes.getStartPageToken')
+            return _json_response({'startPageToken': str(len(self.drive.changes))})
+        self._count('drive.changes.list')
+        start = int(params['pageToken'])
+        page_size = int(params.get('pageSize') or 100)
+        changes = [
+            {'fileId': file_id, 'removed': False, 'file': self.drive.metadata(file_id)}
+            for file_id in self.drive.changes[start:start + page_size]
+        ]
+        response = {'changes': changes}
+        if start + page_size < len(self.drive.changes):
+            response['nextPageToken'] = str(start + page_size)
+        else:
+            response['newStartPageToken'] = str(len(self.drive.changes))
+        return _json_response(response)
+
+    def _drive(self, method, path, params, headers, body):
+        parts = [p for p in path.split('/') if p]
+        if not parts:
+            if method == 'GET':
+                self._count('drive.files.list')
+                matches = self.drive.search(params.get('q', ''))
+                start = int(params.get('pageToken') or 0)
+                page_size = int(params.get('pageSize') or 100)
+                response = {'files': matches[start:start + page_size]}
+                if start + page_size < len(matches):
+                    response['nextPageToken'] = str(start + page_size)
+                return _json_response(response)
+            self._count('drive.files.create')
+            metadata = json.loads(body) if body else {}
+            entry = self.drive.put(name=metadata.get('name', ''), parents=metadata.get('parents'))
+            return _json_response(self.drive.metadata(entry['id']))
+
+        file_id = parts[0]
+        if file_id not in self.drive.files:
+            return 404, {}, json.dumps({'error': {'code': 404, 'message': f'File not found: {file_id}'}}).encode()
+        if len(parts) == 2 and parts[1] == 'copy':
+            self._count('drive.files.copy')
+            metadata = json.loads(body) if body else {}
+            source = self.drive.files[file_id]
+            entry = self.drive.put(name=metadata.get('name', source['name']), parents=metadata.get('parents'),
+                                   content=source['content'], mime_type=source['mimeType'])
+            return _json_response(self.drive.metadata(entry['id']))
+        if params.get('alt') == 'media':
+            self._count('drive.files.get_media')
+            content = self.drive.files[file_id]['content']
+            return self._media_response(content, headers)
+        self._count('drive.files.get')
+        return _json_response(self.drive.metadata(file_id))
+
+    def _media_response(self, content, headers):
+        byte_range = {k.lower(): v for k, v in (headers or {}).items()}.get('range')
+        if byte_range:
+            start, _, end = byte_range[len('bytes='):].partition('-')
+            start, end = int(start), min(int(end or len(content) - 1), len(content) - 1)
+            chunk = content[start:end + 1]
+            self.bytes_downloaded += len(chunk)
+            return 206, {'content-range': f"bytes {start}-{end}/{len(content)}"}, chunk
+        self.bytes_downloaded += len(content)
+        return 200, {'content-length': str(len(content))}, content
+
+    def _drive_upload(self, method, path, params, headers, body):
+        file_id = path.strip('/') or None
+        upload_type = params.get('uploadType')
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+
+        # Fragmentos de una subida reanudable.
+        if 'upload_id' in params:
+            return self._upload_chunk(params['upload_id'], headers, body)
+
+        if upload_type == 'resumable':
+            self._count('drive.files.update' if file_id else 'drive.files.create')
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = {'file_id': file_id, 'metadata': json.loads(body) if body else {},
+                                        'data': bytearray(), 'mimetype': headers.get('x-upload-content-type')}
+            return 200, {'location': f"{DRIVE_UPLOAD_URL}?upload_id={upload_id}"}, b''
+
+        if upload_type == 'multipart':
+            metadata, content, mimetype = _parse_multipart(headers.get('content-type', ''), body)
+        else:
+            metadata, content, mimetype = {}, body or b'', headers.get('content-type')
+        self.bytes_uploaded += len(content)
+        self._count('drive.files.update' if file_id else 'drive.files.create')
+        return _json_response(self._store_upload(file_id, metadata, content, mimetype))
+
+    def _upload_chunk(self, upload_id, headers, body):
+        self._count('drive.upload.chunk')
+        upload = self._uploads[upload_id]
+        content_range = headers.get('content-range', '')
+        if body:
+            upload['data'].extend(body)
+            self.bytes_uploaded += len(body)
+        total = content_range.rsplit('/', 1)[-1]
+        if total != '*' and total and len(upload['data']) >= int(total):
+            del self._uploads[upload_id]
+            return _json_response(self._store_upload(upload['file_id'], upload['metadata'],
+                                                     bytes(upload['data']), upload['mimetype']))
+        if upload['data']:
+            return 308, {'range': f"bytes=0-{len(upload['data']) - 1}"}, b''
+        return 308, {}, b''
+
+    def _store_upload(self, file_id, metadata, content, mimetype):
+        if file_id:
+            self.drive.set_content(file_id, content)
+            if metadata.get('name'):
+                self.drive.files[file_id]['name'] = metadata['name']
+        else:
+            file_id = self.drive.put(name=metadata.get('name', ''), parents=metadata.get('parents'),
+                                     content=content, mime_type=mimetype or 'application/octet-stream')['id']
+        return self.drive.metadata(file_id)
+
+def _json_response(data):
+    return 200, {'content-type': 'application/json; charset=UTF-8'}, json.dumps(data).encode('utf-8')
+
+def _parse_multipart(content_type, body):
+    """Separa una subida multipart/related en (metadatos, contenido, tipo del contenido)."""
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body
+    )
+    parts = list(message.iter_parts())
+    metadata = json.loads(parts[0].get_payload(decode=True) or b'{}')
+    media = parts[1] if len(parts) > 1 else None
+    if media is None:
+        return metadata, b'', None
+    return metadata, media.get_payload(decode=True) or b'', media.get_content_type()
+
+def _read_body(body):
+    if body is None:
+        return b''
+    if hasattr(body, 'read'):
+        return body.read()
+    return body.encode('utf-8') if isinstance(body, str) else bytes(body)
+
+# --- Transportes ---
+
+class FakeHttp(httplib2.Http):
+    """Transporte compatible con httplib2 para googleapiclient."""
+
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None, **kwargs):
+        parts = urlsplit(uri)
+        params = {k: v[0] if len(v) == 1 else v for k, v in parse_qs(parts.query).items()}
+        url = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        status, response_headers, content = self.backend.handle(method, url, params, headers, _read_body(body))
+        return httplib2.Response(dict(response_headers, status=str(status))), content
+
+class FakeSession:
+    """Sesión compatible con requests para gspread."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, **kwargs):
+        # gspread envía el cuerpo JSON en el argumento 'json', como requests.
+        if data is not None:
+            body = _read_body(data)
+        else:
+            body = json.dumps(kwargs['json']).encode('utf-8') if kwargs.get('json') is not None else b''
+        parts = urlsplit(url)
+        query = {k: v[0] if len(v) == 1 else v for k, v in parse_qs(parts.query).items()}
+        query.update(params or {})
+        status, response_headers, content = self.backend.handle(
+            method.upper(), f"{parts.scheme}://{parts.netloc}{parts.path}", query, headers, body
+        )
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(response_headers)
+        response._content = content
+        response.url = url
+        response.encoding = 'utf-8'
+        return response
+
+    def close(self):
+        pass
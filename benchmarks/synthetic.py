@@ -0,0 +1,94 @@
+import io
+import json
+import random
+from datetime import date, timedelta
+
+from PIL import Image
+
+# Opciones válidas de cada campo, tomadas de CELL_MAPPING para que el reporte marque casillas reales.
+OPTIONS = {
+    'tipo_sistema': ['Aguas Lluvia', 'Aguas Residuales', 'Combinado'],
+    'tipo_pozo': ['Pozo', 'Camara', 'Alivio'],
+    'existe': ['Si', 'No'],
+    'tapa_tipo': ['Ferroconcreto', 'Concreto', 'Hierro sin Bisagra', 'Hierro con bisagra', 'Tapa Seguridad', 'Tapa en fibra'],
+    'estado': ['Bueno', 'Regular', 'Malo'],
+    'diagnostico': ['Cambiar', 'Reparar', 'No Requiere'],
+    'cilindro_material': ['Mamposteria', 'Concreto', 'GRP'],
+    'escalones_tipo': ['Escalones', 'Ladrillos'],
+    'estado_general_pozo': ['Infiltracion', 'Represado', 'Con basura', 'Raices', 'Fuera de Servicio', 'Lleno de tierra'],
+    'material': ['PVC', 'Concreto', 'Gres', 'Novafort', 'Hierro fundido'],
+}
+
+def make_connections(rng, count=None):
+    """Genera la lista de conexiones de un pozo."""
+    count = rng.randint(1, 5) if count is None else count
+    connections = []
+    for _ in range(count):
+        cota_razante = round(rng.uniform(1.5, 6.0), 2)
+        connections.append({
+            'diametro_pulgadas': rng.choice([6, 8, 10, 12, 16, 24]),
+            'cota_razante': cota_razante,
+            'cota_clave': round(cota_razante - rng.uniform(0.5, 1.5), 2),
+            'material': rng.choice(OPTIONS['material']),
+        })
+    return connections
+
+def make_survey(rng, index):
+    """Genera una encuesta con la misma estructura JSON que envía la aplicación de campo."""
+    def section(tipo=None, material=None):
+        data = {'existe': rng.choice(OPTIONS['existe']), 'estado': rng.choice(OPTIONS['estado']),
+                'diagnostico': rng.choice(OPTIONS['diagnostico'])}
+        if tipo:
+            data['tipo'] = rng.choice(tipo)
+        if material:
+            data['material'] = rng.choice(material)
+        return data
+
+    cilindro = section(material=OPTIONS['cilindro_material'])
+    cilindro['cual'] = ''
+    return {
+        'fecha': (date(2024, 1, 1) + timedelta(days=index % 365)).isoformat(),
+        'consecutivo': index + 1,
+        'pozo_numero': f"PZ{index + 1:05d}",
+        'direccion': f"Calle {rng.randint(1, 200)} # {rng.randint(1, 99)}-{rng.randint(1, 99)}",
+        'levanto': rng.choice(['Cuadrilla A', 'Cuadrilla B', 'Cuadrilla C']),
+        'tipo_sistema': rng.choice(OPTIONS['tipo_sistema']),
+        'tipo_pozo': rng.choice(OPTIONS['tipo_pozo']),
+        'tapa': section(tipo=OPTIONS['tapa_tipo']),
+        'cargue': section(),
+        'cono': section(),
+        'cilindro': cilindro,
+        'canuela': section(),
+        'escalones': section(tipo=OPTIONS['escalones_tipo']),
+        'estado_general_pozo': rng.choice(OPTIONS['estado_general_pozo']),
+        'observaciones': rng.choice(['', 'Sin novedad', 'Requiere limpieza urgente del cilindro y la cañuela']),
+        'conexiones': make_connections(rng),
+    }
+
+def survey_to_sheet_row(survey, header, status):
+    """Aplana una encuesta según la cabecera de la hoja ('tapa_estado' -> survey['tapa']['estado'])."""
+    row = []
+    for column in header:
+        if column.lower() == 'estado':
+            value = status
+        elif column == 'conexiones':
+            value = json.dumps(survey.get('conexiones', []))
+        elif column in survey:
+            value = survey[column]
+        elif '_' in column and isinstance(survey.get(column.split('_', 1)[0]), dict):
+            section, field = column.split('_', 1)
+            value = survey[section].get(field)
+        else:
+            value = ''
+        row.append('' if value is None else value)
+    return row
+
+def make_photo(rng, width=640, height=480, quality=85):
+    """Genera una foto JPEG con ruido, para que su tamaño comprimido se parezca al de una foto real."""
+    image = Image.effect_noise((width, height), rng.uniform(40, 80)).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def make_rng(seed=1234):
+    return random.Random(seed)
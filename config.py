@@ -12,21 +12,120 @@ GOOGLE_CREDENTIALS_JSON_BASE64 = os.getenv("GOOGLE_CREDENTIALS_JSON_BASE64")
 # --- Configuracin de Google Sheets ---
 SPREADSHEET_ID = os.environ.get('SHEET_ID')
 WORKSHEET_NAME = "Tabla Maestra"
+# Archivo donde se guarda la ultima fila ya generada, para escanear solo las filas nuevas.
+PENDING_SCAN_CURSOR_FILE = os.getenv('PENDING_SCAN_CURSOR_FILE', 'pending_scan_cursor.json')
 
 # --- Configuracin de Google Drive ---
 MASTER_REPORT_ID = os.getenv("MASTER_REPORT_ID")
 DRIVE_FOLDER_ID = os.getenv("DRIVE_FOLDER_ID")
 REPORTS_FOLDER_ID = os.getenv('REPORTS_FOLDER_ID')
+# Particion del reporte: 'off' (un solo maestro), 'month' (un libro por mes) o 'size'.
+# En ambos modos se abre un libro nuevo en REPORTS_FOLDER_ID al superar el maximo de hojas o bytes.
+REPORT_SHARD_MODE = os.getenv('REPORT_SHARD_MODE', 'off')
+REPORT_SHARD_MAX_SHEETS = int(os.getenv('REPORT_SHARD_MAX_SHEETS', '200'))
+REPORT_SHARD_MAX_BYTES = int(os.getenv('REPORT_SHARD_MAX_BYTES', str(50 * 1024 * 1024)))
+REPORT_SHARD_MANIFEST_NAME = os.getenv('REPORT_SHARD_MANIFEST_NAME', 'reportes_manifest.json')
+
+# Refresco del token OAuth en segundo plano: cuantos segundos antes del vencimiento se refresca
+# y espera inicial (se duplica en cada fallo, hasta 5 minutos) antes de reintentar.
+CREDENTIALS_REFRESH_MARGIN_SECONDS = int(os.getenv('CREDENTIALS_REFRESH_MARGIN_SECONDS', '600'))
+CREDENTIALS_REFRESH_RETRY_SECONDS = int(os.getenv('CREDENTIALS_REFRESH_RETRY_SECONDS', '30'))
+
+# Limites de las APIs de Google (api_scheduler.py). Cuotas por minuto y por usuario publicadas por Google:
+# Sheets 60 lecturas y 60 escrituras, Drive 12000 consultas. Con 0 no se limita esa cuota.
+GOOGLE_SHEETS_READS_PER_MINUTE = int(os.getenv('GOOGLE_SHEETS_READS_PER_MINUTE', '60'))
+GOOGLE_SHEETS_WRITES_PER_MINUTE = int(os.getenv('GOOGLE_SHEETS_WRITES_PER_MINUTE', '60'))
+GOOGLE_DRIVE_REQUESTS_PER_MINUTE = int(os.getenv('GOOGLE_DRIVE_REQUESTS_PER_MINUTE', '12000'))
+# Segundos de cuota que se pueden gastar de golpe y peticiones simultaneas por API (0 = sin limite).
+GOOGLE_API_BURST_SECONDS = float(os.getenv('GOOGLE_API_BURST_SECONDS', '10'))
+GOOGLE_API_MAX_CONCURRENCY = int(os.getenv('GOOGLE_API_MAX_CONCURRENCY', '8'))
+# Fraccion de cada cuota que puede usar el trabajo por lotes (generador de reportes), para dejar margen a la ingesta.
+GOOGLE_API_BATCH_SHARE = float(os.getenv('GOOGLE_API_BATCH_SHARE', '0.5'))
+# Reintentos ante 429/5xx: espera exponencial con jitter desde GOOGLE_API_BACKOFF_SECONDS, o la de Retry-After.
+GOOGLE_API_MAX_RETRIES = int(os.getenv('GOOGLE_API_MAX_RETRIES', '5'))
+GOOGLE_API_BACKOFF_SECONDS = float(os.getenv('GOOGLE_API_BACKOFF_SECONDS', '1'))
+GOOGLE_API_MAX_BACKOFF_SECONDS = float(os.getenv('GOOGLE_API_MAX_BACKOFF_SECONDS', '64'))
 
 # --- Configuracin de Reportes ---
 TEMPLATE_SHEET_NAME = "PZ14"
 TEMPLATE_PATH = 'ejemplo1.xltx'
+# Tamano de cada fragmento al subir el reporte desde disco (multiplo de 256 KB).
+REPORT_UPLOAD_CHUNK_SIZE = int(os.getenv('REPORT_UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))
+# Fotos de los pozos en el reporte: '1' las inserta (reducidas al tamano de su recuadro), '0' no.
+REPORT_PHOTOS = os.getenv('REPORT_PHOTOS', '1') == '1'
+# Miniaturas ya reducidas, indexadas por id de archivo de Drive y fecha de modificacion.
+PHOTO_CACHE_DIR = os.getenv('PHOTO_CACHE_DIR', 'photo_cache')
+# Indice local (SQLite) de las fotos de DRIVE_FOLDER_ID por pozo, actualizado con el registro de cambios de Drive.
+PHOTO_INDEX_FILE = os.getenv('PHOTO_INDEX_FILE', 'photo_index.db')
+PHOTO_PREFETCH_WORKERS = int(os.getenv('PHOTO_PREFETCH_WORKERS', '4'))
+PHOTO_JPEG_QUALITY = int(os.getenv('PHOTO_JPEG_QUALITY', '80'))
+# Copia local (SQLite) de WORKSHEET_NAME: '1' hace que la ingesta escriba en ella y que el generador
+# consulte pendientes y cambie estados localmente, sincronizando la hoja por lotes. El archivo debe persistir
+# entre ejecuciones y ser el mismo para la ingesta y el generador; no sirve en un runner efimero.
+SHEET_MIRROR = os.getenv('SHEET_MIRROR', '0') == '1'
+SHEET_MIRROR_FILE = os.getenv('SHEET_MIRROR_FILE', 'sheet_mirror.db')
+# Registros por lote: cada lote se sube y marca como 'Generado' antes de seguir (0 = todos en un lote).
+REPORT_CHUNK_SIZE = int(os.getenv('REPORT_CHUNK_SIZE', '50'))
+# Lote en curso (filas y hojas subidas), para retomar una ejecucion interrumpida sin duplicar hojas.
+# Se guarda en Drive, en REPORTS_FOLDER_ID, porque el generador corre en un runner efimero.
+REPORT_CHECKPOINT_NAME = os.getenv('REPORT_CHECKPOINT_NAME', 'reporte_checkpoint.json')
+# Motor para agregar hojas: 'openpyxl' (carga y reescribe todo el libro) o 'zip'
+# (escribe solo las hojas nuevas en el .xlsx, copiando las existentes byte a byte).
+REPORT_APPEND_ENGINE = os.getenv('REPORT_APPEND_ENGINE', 'openpyxl')
+# Con el motor zip, comprobar con openpyxl que el libro generado se puede leer antes de subirlo.
+REPORT_APPEND_VERIFY = os.getenv('REPORT_APPEND_VERIFY', '1') == '1'
+# Procesos que calculan en paralelo el contenido de las hojas (0 = uno por CPU, 1 = en serie).
+REPORT_RENDER_WORKERS = int(os.getenv('REPORT_RENDER_WORKERS', '0'))
+# Fuente de las tablas de conexiones: ruta explicita o familia a buscar con fontconfig (fc-match).
+REPORT_FONT_PATH = os.getenv('REPORT_FONT_PATH')
+REPORT_FONT_FAMILY = os.getenv('REPORT_FONT_FAMILY', 'Calibri')
+# Numero de tablas de conexiones ya dibujadas que se guardan en memoria.
+TABLE_IMAGE_CACHE_SIZE = int(os.getenv('TABLE_IMAGE_CACHE_SIZE', '256'))
+# Copia local del ultimo reporte descargado o subido, indexada por la revision de Drive.
+REPORT_CACHE_DIR = os.getenv('REPORT_CACHE_DIR', 'report_cache')
+# Consultas a Drive (y segundos entre ellas) para confirmar que una revision nueva ya es visible.
+REPORT_REVISION_CHECKS = int(os.getenv('REPORT_REVISION_CHECKS', '5'))
+REPORT_REVISION_CHECK_DELAY = float(os.getenv('REPORT_REVISION_CHECK_DELAY', '1'))
+# Carpeta donde cada ejecucion del generador deja su resumen de tiempos por etapa (JSON).
+METRICS_SUMMARY_DIR = os.getenv('METRICS_SUMMARY_DIR', 'run_summaries')
+
+# --- Configuracin de Ingesta ---
+# 'sync' procesa la encuesta dentro de la solicitud; 'spool' la guarda en una cola local
+# y la procesa en segundo plano, respondiendo 202 con un ticket.
+INGESTION_MODE = os.getenv('INGESTION_MODE', 'sync')
+SPOOL_DIR = os.getenv('SPOOL_DIR', 'spool')
+SPOOL_WORKERS = int(os.getenv('SPOOL_WORKERS', '2'))
+SPOOL_MAX_RETRIES = int(os.getenv('SPOOL_MAX_RETRIES', '5'))
+# Un ticket 'procesando' cuyo trabajador no renueva la reserva en este tiempo (proceso caido) vuelve a tomarse.
+SPOOL_LEASE_SECONDS = int(os.getenv('SPOOL_LEASE_SECONDS', '600'))
+# Hilos compartidos por todas las solicitudes de ingesta para escribir en Sheets y subir fotos a la vez,
+# y bytes por fragmento de cada foto (en bloques de 256 KB). Los reintentos los hace api_scheduler.py.
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '8'))
+PHOTO_UPLOAD_CHUNK_SIZE = int(os.getenv('PHOTO_UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+# Compresion de fotos antes de subirlas: 'off', 'jpeg' o 'webp'. Se reducen a PHOTO_MAX_DIMENSION
+# pixeles por lado con la calidad PHOTO_QUALITY, en PHOTO_COMPRESSION_WORKERS procesos (0 = uno por CPU).
+PHOTO_COMPRESSION = os.getenv('PHOTO_COMPRESSION', 'off')
+PHOTO_MAX_DIMENSION = int(os.getenv('PHOTO_MAX_DIMENSION', '2048'))
+PHOTO_QUALITY = int(os.getenv('PHOTO_QUALITY', '82'))
+PHOTO_COMPRESSION_WORKERS = int(os.getenv('PHOTO_COMPRESSION_WORKERS', '0'))
+# Con '1' tambien se sube la foto original ('<pozo>-<n>-original') a PHOTO_ORIGINALS_FOLDER_ID.
+PHOTO_KEEP_ORIGINAL = os.getenv('PHOTO_KEEP_ORIGINAL', '0') == '1'
+PHOTO_ORIGINALS_FOLDER_ID = os.getenv('PHOTO_ORIGINALS_FOLDER_ID') or DRIVE_FOLDER_ID
+# Agrupacion de escrituras en Sheets: ventana en segundos (0 desactiva) y maximo de filas por llamada.
+SHEETS_BATCH_WINDOW_SECONDS = float(os.getenv('SHEETS_BATCH_WINDOW_SECONDS', '0'))
+SHEETS_BATCH_MAX_ROWS = int(os.getenv('SHEETS_BATCH_MAX_ROWS', '50'))
+# Maximo de encuestas aceptadas en una sola solicitud de sincronizacion masiva (/ingestar-encuestas).
+BULK_MAX_SURVEYS = int(os.getenv('BULK_MAX_SURVEYS', '500'))
 
 # --- Constantes de Estado ---
 PENDING_STATUS = "Pendiente"
+# Fila escrita cuyas fotos todavia no terminaron de subir; el generador no la toma.
+INCOMPLETE_STATUS = "Incompleto"
 GENERATED_STATUS = "Generado"
 
 # --- Cabeceras de la Hoja de Clculo ---
+# Deben coincidir con la fila 1 de la hoja: la ingesta arma cada fila en este orden y el
+# generador de reportes busca la columna 'Estado' con mayuscula.
 SHEET_HEADERS = [
     "fecha", "consecutivo", "pozo_numero", "direccion", "levanto",
     "tipo_sistema", "tipo_pozo", "tapa_existe", "tapa_tipo", "tapa_estado",
@@ -35,5 +134,5 @@ SHEET_HEADERS = [
     "cilindro_cual", "cilindro_estado", "cilindro_diagnostico", "canuela_estado",
     "canuela_diagnostico", "escalones_existe", "escalones_tipo", "escalones_estado",
     "escalones_diagnostico", "estado_general_pozo", "observaciones", "conexiones",
-    "foto_url", "estado"
+    "foto_url", "Estado"
 ]
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import threading
+from datetime import datetime, timezone
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from config import CREDENTIALS_REFRESH_MARGIN_SECONDS, CREDENTIALS_REFRESH_RETRY_SECONDS
+from metrics import timed, increment
+
+class CredentialManager:
+    """
+    Mantiene las credenciales OAuth del usuario y las refresca antes de que expiren, en un hilo
+    en segundo plano. Solo un refresco corre a la vez: quien lo necesite mientras otro está en curso
+    espera y usa el resultado, sin repetir la llamada a Google ni reescribir el archivo del token.
+    """
+
+    def __init__(self, token_file, scopes):
+        self.token_file = token_file
+        self.scopes = scopes
+        self._credentials = None
+        self._token_mtime = None
+        # Protege la carga y el refresco; las credenciales solo se cambian con este lock tomado.
+        self._lock = threading.RLock()
+        # Cuenta los refrescos exitosos: quien esperaba el lock sabe si otro refrescó mientras tanto.
+        self._generation = 0
+        self._last_error = None
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def get(self):
+        """
+        Devuelve las credenciales vigentes, o None si no hay un token válido. Normalmente no hace
+        ninguna llamada de red: el hilo de fondo ya refrescó el token antes de que expirara.
+        """
+        credentials = self._current()
+        if credentials is None:
+            return None
+        if not credentials.valid:
+            # El hilo de fondo no alcanzó a refrescarlo (por ejemplo, el proceso estuvo suspendido).
+            if not credentials.refresh_token or not self.refresh(trigger='on_demand'):
+                return None
+            credentials = self._credentials
+        self._ensure_thread()
+        return credentials
+
+    def store(self, credentials):
+        """Adopta unas credenciales nuevas (tras la autenticación) y las guarda en el archivo del token."""
+        with self._lock:
+            self._adopt(credentials)
+            self._write_token(credentials)
+            self._generation += 1
+            self._last_error = None
+        self._wakeup.set()
+        self._ensure_thread()
+
+    def refresh(self, trigger='on_demand'):
+        """
+        Refresca el token de acceso. Si otro hilo ya lo refrescó mientras este esperaba el lock,
+        no se repite la llamada. Devuelve True si al terminar hay un token válido.
+        Un fallo no borra el archivo del token: el refresh token puede seguir sirviendo en el próximo intento.
+        """
+        generation = self._generation
+        with self._lock:
+            credentials = self._credentials
+            if credentials is None or not credentials.refresh_token:
+                return False
+            # Otro hilo lo refrescó mientras este esperaba, o quien lo pide solo necesita un token vigente.
+            if credentials.valid and (self._generation != generation or trigger == 'on_demand'):
+                return True
+            print("Refrescando token de acceso...")
+            try:
+                with timed('credentials.refresh'):
+                    self._original_refresh(credentials)(Request())
+                self._write_token(credentials)
+            except Exception as e:
+                self._last_error = str(e)
+                increment('credentials_refresh_total', trigger=trigger, result='error')
+                print(f"Error al refrescar el token: {e}")
+                return False
+            self._generation += 1
+            self._last_error = None
+            increment('credentials_refresh_total', trigger=trigger, result='ok')
+            print(f"Token refrescado exitosamente (vence {credentials.expiry} UTC).")
+        self._wakeup.set()
+        return True
+
+    def status(self):
+        """Estado del token para diagnóstico: vencimiento, refrescos hechos y último error."""
+        credentials = self._credentials
+        return {
+            'valid': bool(credentials and credentials.valid),
+            'expiry': credentials.expiry.isoformat() if credentials and credentials.expiry else None,
+            'refreshes': self._generation,
+            'last_error': self._last_error,
+        }
+
+    # --- Internos ---
+
+    def _current(self):
+        """Devuelve las credenciales en memoria, recargándolas si el archivo del token cambió o no se ha leído."""
+        try:
+            mtime = os.path.getmtime(self.token_file)
+        except OSError:
+            mtime = None
+        if self._credentials is not None and (mtime is None or mtime == self._token_mtime):
+            return self._credentials
+        with self._lock:
+            if mtime is None:
+                return self._credentials
+            if mtime != self._token_mtime:
+                # Otro proceso (o la autenticación) escribió un token nuevo.
+                self._adopt(Credentials.from_authorized_user_file(self.token_file, self.scopes))
+                self._token_mtime = mtime
+            return self._credentials
+
+    def _adopt(self, credentials):
+        """
+        Empieza a usar 'credentials'. Su método refresh pasa por este administrador, así que también
+        los refrescos que dispara el transporte HTTP (por ejemplo, ante un 401) son de uno en uno.
+        """
+        if not hasattr(credentials, '_unmanaged_refresh'):
+            credentials._unmanaged_refresh = credentials.refresh
+        credentials.refresh = lambda request: self._refresh_from_transport(credentials)
+        self._credentials = credentials
+
+    @staticmethod
+    def _original_refresh(credentials):
+        return getattr(credentials, '_unmanaged_refresh', credentials.refresh)
+
+    def _refresh_from_transport(self, credentials):
+        if credentials is not self._credentials:
+            # Credenciales reemplazadas que todavía usa un cliente viejo: se refrescan por su cuenta.
+            return self._original_refresh(credentials)(Request())
+        if not self.refresh(trigger='transport'):
+            raise RuntimeError(f"No se pudo refrescar el token de acceso: {self._last_error}")
+
+    def _write_token(self, credentials):
+        """Escribe el archivo del token de forma atómica (un archivo temporal y luego os.replace)."""
+        temp_path = f"{self.token_file}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as token:
+            token.write(credentials.to_json())
+        os.replace(temp_path, self.token_file)
+        self._token_mtime = os.path.getmtime(self.token_file)
+
+    def _seconds_until_refresh(self):
+        credentials = self._credentials
+        if credentials is None or not credentials.refresh_token:
+            return None
+        if credentials.expiry is None:
+            return None
+        # google-auth guarda 'expiry' como fecha UTC sin zona horaria.
+        expiry = credentials.expiry.replace(tzinfo=timezone.utc)
+        return (expiry - datetime.now(timezone.utc)).total_seconds() - CREDENTIALS_REFRESH_MARGIN_SECONDS
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="credential-refresher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Hilo de fondo: duerme hasta poco antes del vencimiento y refresca; ante un error reintenta con espera creciente."""
+        failures = 0
+        while True:
+            wait = self._seconds_until_refresh()
+            if wait is None:
+                # Sin token o sin refresh token: se espera a que llegue uno nuevo con store().
+                self._wakeup.wait()
+            elif wait > 0:
+                self._wakeup.wait(timeout=wait)
+            else:
+                if self.refresh(trigger='background'):
+                    failures = 0
+                else:
+                    failures += 1
+                    retry = min(CREDENTIALS_REFRESH_RETRY_SECONDS * 2 ** (failures - 1), 300)
+                    self._wakeup.wait(timeout=retry)
+            self._wakeup.clear()
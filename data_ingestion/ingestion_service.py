@@ -1,80 +1,268 @@
 import json
-import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.http import MediaIoBaseUpload
 
-from google_clients import get_sheets_client, get_drive_client
-from config import SPREADSHEET_ID, WORKSHEET_NAME, DRIVE_FOLDER_ID
+from google_clients import get_drive_client
+from api_scheduler import set_thread_priority, INTERACTIVE
+from metrics import timed, increment
+from sheet_mirror import mirror_enabled, record_rows
+from config import (
+    DRIVE_FOLDER_ID, PHOTO_ORIGINALS_FOLDER_ID, PENDING_STATUS, INCOMPLETE_STATUS,
+    INGEST_WORKERS, PHOTO_UPLOAD_CHUNK_SIZE
+)
+from .sheets_batcher import append_row, append_rows, set_rows_status
+from .row_flattener import flatten_survey
+from .photo_compressor import compression_enabled, compress_photo
 
-def ingest_survey(data_str, files):
+# Un solo grupo de hilos para todas las solicitudes: la escritura en Sheets y las subidas a Drive
+# de una encuesta arrancan a la vez en él, así que la latencia se acerca a la de la llamada más lenta.
+# Todas las llamadas a Google pasan por estos hilos, que duran lo que el proceso: cada uno arma sus
+# clientes una sola vez, en lugar de uno nuevo por cada hilo de solicitud del servidor.
+_executor = None
+_executor_lock = threading.Lock()
+
+class IncompleteIngestionError(Exception):
     """
-    Procesa los datos de la encuesta, los guarda en Google Sheets y sube las fotos a Drive.
+    La encuesta quedó a medias: falló la escritura de la fila, alguna foto o la marca final.
+    'fila' es el número de fila (None si no se escribió) y 'uploaded' los números de foto que sí
+    se subieron, para que un reintento continúe sin duplicar la fila ni las fotos.
     """
-    service_sheets = get_sheets_client()
-    service_drive = get_drive_client()
 
+    def __init__(self, message, fila=None, uploaded=()):
+        super().__init__(message)
+        self.fila = fila
+        self.uploaded = sorted(uploaded)
+
+    def progress(self):
+        return {'fila': self.fila, 'fotos_subidas': self.uploaded}
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # La ingesta tiene prioridad ante las cuotas de Google aunque el generador corra en este proceso.
+            _executor = ThreadPoolExecutor(
+                max_workers=max(2, INGEST_WORKERS), thread_name_prefix='ingest',
+                initializer=set_thread_priority, initargs=(INTERACTIVE,)
+            )
+        return _executor
+
+def _timed_call(stage, func, *args):
+    """Ejecuta func(*args) en un hilo del grupo, midiendo su duración como la etapa 'stage'."""
+    with timed(stage):
+        return func(*args)
+
+def ingest_survey(data_str, files, resume=None):
+    """
+    Procesa los datos de la encuesta, los guarda en Google Sheets y sube las fotos a Drive.
+    La fila y las fotos se envían a la vez. Si hay fotos, la fila se escribe como 'Incompleto' y
+    pasa a 'Pendiente' solo cuando todas se subieron, para que el generador no la tome antes.
+    'resume' es el progreso de un intento anterior ({'fila', 'fotos_subidas'}), si lo hubo.
+    Devuelve el número de fila; si algo falla lanza IncompleteIngestionError con el progreso.
+    """
+    resume = resume or {}
     # 1. Procesar y aplanar los datos JSON
-    datos = json.loads(data_str)
+    with timed('ingest.decode_json'):
+        datos = json.loads(data_str)
     print("Paso 2: Datos JSON decodificados.")
 
-    fila_para_sheets = _prepare_row_for_sheets(datos)
+    with timed('ingest.prepare_row'):
+        fila_para_sheets = flatten_survey(datos, estado=INCOMPLETE_STATUS if files else PENDING_STATUS)
     print("Paso 3: Fila de datos preparada para Google Sheets.")
 
-    # 2. Escribir en Google Sheets
-    service_sheets.spreadsheets().values().append(
-        spreadsheetId=SPREADSHEET_ID,
-        range=f"{WORKSHEET_NAME}!A:Z",
-        valueInputOption='USER_ENTERED',
-        body={'values': [fila_para_sheets]}
-    ).execute()
-    print("Paso 4: Datos escritos en Google Sheets.")
-
-    # 3. Procesar y subir imágenes
+    # 2. Escribir en Google Sheets y subir las imágenes al mismo tiempo
     pozo_numero = datos.get('pozo_numero', 'SIN_ID')
+    executor = _get_executor()
+    fila = resume.get('fila')
+    append_future = None
+    if fila is None:
+        append_future = executor.submit(_timed_call, 'ingest.sheets_append', append_row, fila_para_sheets)
+    else:
+        print(f"Paso 4: La fila {fila} ya se escribió en un intento anterior.")
+
+    uploads = {}
     if files:
         print(f"Paso 5: Procesando {len(files)} imágenes para el pozo {pozo_numero}.")
-        _upload_photos(service_drive, files, pozo_numero)
-        print("Paso 6: Imágenes subidas a Google Drive.")
+        uploads = _start_photo_uploads(files, pozo_numero, executor, done=resume.get('fotos_subidas', ()))
     else:
         print("Paso 5 y 6: No se enviaron imágenes.")
 
-def _prepare_row_for_sheets(datos):
-    """Prepara una lista de valores a partir del JSON para insertar en la hoja de cálculo."""
-    return [
-        datos.get('fecha'),
-        datos.get('consecutivo'),
-        datos.get('direccion'),
-        datos.get('levanto'),
-        datos.get('pozo_numero'),
-        datos.get('tipo_sistema'),
-        datos.get('tipo_pozo'),
-        datos.get('tapa', {}).get('existe'),
-        datos.get('tapa', {}).get('tipo'),
-        datos.get('tapa', {}).get('estado'),
-        datos.get('tapa', {}).get('diagnostico'),
-        datos.get('cargue', {}).get('existe'),
-        datos.get('cargue', {}).get('estado'),
-        datos.get('cargue', {}).get('diagnostico'),
-        datos.get('cilindro', {}).get('material'),
-        datos.get('cilindro', {}).get('estado'),
-        datos.get('cilindro', {}).get('diagnostico'),
-        datos.get('canuela', {}).get('estado'),
-        datos.get('canuela', {}).get('diagnostico'),
-        datos.get('escalones', {}).get('existe'),
-        datos.get('escalones', {}).get('tipo'),
-        datos.get('escalones', {}).get('estado'),
-        datos.get('escalones', {}).get('diagnostico'),
-        datos.get('estado_general_pozo'),
-        datos.get('observaciones'),
-        json.dumps(datos.get('conexiones', [])), # Convertir a string JSON
-        'Pendiente' # Estado inicial
+    error = None
+    if append_future is not None:
+        try:
+            fila = append_future.result()
+            print(f"Paso 4: Datos escritos en Google Sheets (fila {fila}).")
+            if mirror_enabled():
+                record_rows([(fila, fila_para_sheets)])
+        except Exception as e:
+            error = f"No se pudo escribir en Google Sheets: {e}"
+
+    uploaded, photo_errors = _wait_photo_uploads(uploads, resume.get('fotos_subidas', ()))
+    if photo_errors:
+        error = '; '.join(([error] if error else []) + photo_errors)
+    if error:
+        print(f"Ingesta incompleta del pozo {pozo_numero}: {error}")
+        raise IncompleteIngestionError(error, fila, uploaded)
+    if files:
+        print("Paso 6: Imágenes subidas a Google Drive.")
+
+    # 3. Con todas las fotos en Drive, la fila queda lista para el generador de reportes
+    if files:
+        try:
+            executor.submit(_timed_call, 'ingest.finalize', set_rows_status, [fila], PENDING_STATUS).result()
+        except Exception as e:
+            raise IncompleteIngestionError(f"No se pudo marcar la fila {fila} como completa: {e}", fila, uploaded)
+        if mirror_enabled():
+            record_rows([(fila, flatten_survey(datos))])
+        print(f"Paso 7: Fila {fila} marcada como '{PENDING_STATUS}'.")
+
+    return fila
+
+def ingest_batch(lines, files_by_index):
+    """
+    Procesa un lote de encuestas sincronizadas de una vez (una encuesta JSON por línea, como en NDJSON).
+    'files_by_index' asocia el número de línea (desde 0) con las fotos de esa encuesta.
+    Todas las filas se escriben con una sola llamada a Sheets mientras se suben las fotos de todas las
+    encuestas; las filas con fotos se marcan como 'Pendiente' juntas, en otra llamada, cuando sus fotos terminan.
+    Devuelve un resultado por línea: {'indice', 'pozo_numero', 'fila', 'estado' ('ok', 'incompleto' o 'error'), 'mensaje'}.
+    Las encuestas decodificadas que no terminaron traen además 'fotos_subidas', para retomarlas sin duplicar nada.
+    """
+    results = []
+    valid = []
+    for index, line in enumerate(lines):
+        result = {'indice': index, 'pozo_numero': None, 'fila': None, 'estado': 'ok', 'mensaje': None}
+        results.append(result)
+        try:
+            with timed('ingest.decode_json'):
+                datos = json.loads(line)
+            if not isinstance(datos, dict):
+                raise ValueError("se esperaba un objeto JSON")
+        except ValueError as e:
+            result.update(estado='error', mensaje=f"JSON inválido: {e}")
+            continue
+        result['pozo_numero'] = datos.get('pozo_numero')
+        valid.append((result, datos))
+    print(f"Lote: {len(valid)} de {len(lines)} encuestas decodificadas.")
+    if not valid:
+        return results
+
+    with timed('ingest.prepare_row'):
+        rows = [
+            flatten_survey(datos, estado=INCOMPLETE_STATUS if files_by_index.get(result['indice']) else PENDING_STATUS)
+            for result, datos in valid
+        ]
+
+    executor = _get_executor()
+    append_future = executor.submit(_timed_call, 'ingest.sheets_append_batch', append_rows, rows)
+    uploads = [
+        _start_photo_uploads(files_by_index[result['indice']], datos.get('pozo_numero', 'SIN_ID'), executor)
+        if files_by_index.get(result['indice']) else {}
+        for result, datos in valid
     ]
 
-def _upload_photos(service_drive, files, pozo_numero):
-    """Sube una lista de archivos a una carpeta de Google Drive."""
-    for i, foto in enumerate(files, 1):
-        file_metadata = {
-            'name': f"{pozo_numero}-{i}",
-            'parents': [DRIVE_FOLDER_ID]
-        }
-        media = MediaIoBaseUpload(io.BytesIO(foto.read()), mimetype=foto.mimetype)
-        service_drive.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    try:
+        row_numbers = append_future.result()
+        print(f"Lote: {len(rows)} filas escritas en Google Sheets con una sola llamada.")
+        if mirror_enabled():
+            record_rows(zip(row_numbers, rows))
+    except Exception as e:
+        print(f"Lote: error al escribir {len(rows)} filas en Google Sheets: {e}")
+        row_numbers = None
+        for result, _ in valid:
+            result.update(estado='error', mensaje=f"No se pudo escribir en Google Sheets: {e}")
+
+    complete = []
+    for (result, datos), photo_uploads, row_number in zip(valid, uploads, row_numbers or [None] * len(valid)):
+        result['fila'] = row_number
+        uploaded, photo_errors = _wait_photo_uploads(photo_uploads)
+        result['fotos_subidas'] = sorted(uploaded)
+        if row_number is None:
+            continue
+        if photo_errors:
+            # La fila queda 'Incompleto': el generador no la toma hasta que sus fotos estén en Drive.
+            print(f"Lote: error subiendo las fotos del pozo {result['pozo_numero']}: {'; '.join(photo_errors)}")
+            result.update(estado='incompleto', mensaje=f"Fila escrita, pero falló la subida de fotos: {'; '.join(photo_errors)}")
+        elif photo_uploads:
+            complete.append((result, datos))
+
+    if complete:
+        try:
+            executor.submit(
+                _timed_call, 'ingest.finalize', set_rows_status, [result['fila'] for result, _ in complete], PENDING_STATUS
+            ).result()
+            if mirror_enabled():
+                record_rows((result['fila'], flatten_survey(datos)) for result, datos in complete)
+        except Exception as e:
+            for result, _ in complete:
+                result.update(estado='incompleto', mensaje=f"No se pudo marcar la fila como completa: {e}")
+    return results
+
+def _start_photo_uploads(files, pozo_numero, executor, done=()):
+    """
+    Lanza en el grupo de hilos la compresión (si está activada) y la subida a Drive de cada foto, sin esperarlas.
+    Las fotos cuyo número está en 'done' ya se subieron en un intento anterior y se omiten.
+    Devuelve {número de foto: [futures]}.
+    """
+    done = set(done)
+    return {
+        i: [executor.submit(_process_photo, foto, pozo_numero, i)]
+        for i, foto in enumerate(files, 1) if i not in done
+    }
+
+def _process_photo(foto, pozo_numero, i):
+    """
+    Comprime la foto si está activado y la sube como '<pozo>-<n>'. Cada foto se comprime dentro de su
+    propia subida, así que solo están en memoria las que se están subiendo. Si la compresión guardó la
+    original, esta se sube también como '<pozo>-<n>-original' a PHOTO_ORIGINALS_FOLDER_ID. Esa copia es
+    opcional: si falla, la foto cuenta como subida, porque un reintento volvería a subir '<pozo>-<n>'.
+    """
+    if compression_enabled():
+        with timed('ingest.photo_compress'):
+            foto = compress_photo(foto)
+    _upload_photo(foto, f"{pozo_numero}-{i}", DRIVE_FOLDER_ID)
+    if getattr(foto, 'original', None) is not None:
+        try:
+            with timed('ingest.photo_original_upload'):
+                _upload_photo(foto.original, f"{pozo_numero}-{i}-original", PHOTO_ORIGINALS_FOLDER_ID)
+        except Exception as e:
+            print(f"  - Advertencia: no se pudo subir la original de la foto {i} del pozo {pozo_numero}: {e}")
+
+def _wait_photo_uploads(uploads, done=()):
+    """Espera todas las subidas. Devuelve (números de foto subidos, incluidos los de 'done'; mensajes de error)."""
+    uploaded = set(done)
+    errors = []
+    with timed('ingest.photos'):
+        for i, futures in uploads.items():
+            failed = False
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    failed = True
+                    errors.append(f"foto {i}: {e}")
+            if not failed:
+                uploaded.add(i)
+    return uploaded, errors
+
+def _upload_photo(foto, name, folder_id=DRIVE_FOLDER_ID):
+    """
+    Sube una foto a Drive en fragmentos. Los reintentos (429/5xx y cortes de red en cada fragmento)
+    los hace api_scheduler.py en el transporte; aquí no se repite nada más.
+    """
+    # Los clientes de googleapiclient no son seguros entre hilos: cada hilo usa el suyo del pool.
+    service_drive = get_drive_client()
+    file_metadata = {
+        'name': name,
+        'parents': [folder_id]
+    }
+    # Leemos directamente del stream de la foto, sin copiarla completa a memoria.
+    media = MediaIoBaseUpload(foto.stream, mimetype=foto.mimetype, chunksize=PHOTO_UPLOAD_CHUNK_SIZE, resumable=True)
+    request = service_drive.files().create(body=file_metadata, media_body=media, fields='id')
+
+    response = None
+    with timed('ingest.photo_upload'):
+        while response is None:
+            _, response = request.next_chunk()
+    increment('bytes_total', media.size(), stage='ingest.photo_upload')
+    return response
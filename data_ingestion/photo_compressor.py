@@ -0,0 +1,113 @@
+import io
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+
+from config import PHOTO_COMPRESSION, PHOTO_MAX_DIMENSION, PHOTO_QUALITY, PHOTO_COMPRESSION_WORKERS, PHOTO_KEEP_ORIGINAL
+from metrics import observe, increment
+
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class ProcessedPhoto:
+    """Foto en memoria con la interfaz que usa la subida a Drive (stream y mimetype, como FileStorage)."""
+
+    def __init__(self, data, mimetype, filename, original=None):
+        self.stream = io.BytesIO(data)
+        self.mimetype = mimetype
+        self.filename = filename
+        # Foto original, para subirla también si PHOTO_KEEP_ORIGINAL está activo.
+        self.original = original
+
+def compression_enabled():
+    return PHOTO_COMPRESSION in FORMATS
+
+def compress_image(data, fmt=PHOTO_COMPRESSION, max_dimension=PHOTO_MAX_DIMENSION, quality=PHOTO_QUALITY):
+    """
+    Decodifica la foto, aplica su orientación EXIF, la reduce para que ningún lado supere 'max_dimension'
+    y la vuelve a codificar en 'fmt' ('jpeg' o 'webp'). Devuelve (bytes, segundos de codificación).
+    Se ejecuta en los procesos del grupo, así que no depende de nada del proceso principal.
+    """
+    start = time.perf_counter()
+    pil_format, _ = FORMATS[fmt]
+    with Image.open(io.BytesIO(data)) as img:
+        # Con JPEG, draft decodifica directamente a una escala cercana al tamaño final.
+        img.draft('RGB', (max_dimension, max_dimension))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        if pil_format == 'JPEG':
+            img.save(buffer, format=pil_format, quality=quality, optimize=True, progressive=True)
+        else:
+            img.save(buffer, format=pil_format, quality=quality, method=4)
+    return buffer.getvalue(), time.perf_counter() - start
+
+def _get_pool():
+    """
+    Grupo de procesos compartido por todas las solicitudes, creado la primera vez que se necesita.
+    Los procesos se arrancan con 'spawn': el servidor tiene varios hilos (Flask, el grupo de ingesta,
+    la cola) y un fork copiaría locks tomados por otros hilos.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PHOTO_COMPRESSION_WORKERS or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+def compress_photo(foto):
+    """
+    Comprime una foto (FileStorage o similar) en el grupo de procesos y devuelve una ProcessedPhoto.
+    Se llama desde cada subida, de a una foto, así que en memoria solo están las fotos que se están subiendo.
+    Si la foto no se puede decodificar, o la versión comprimida no es más pequeña, se sube la original.
+    Registra en las métricas el tiempo de codificación y los bytes antes y después.
+    """
+    data, original_mimetype, filename = foto.stream.read(), foto.mimetype, foto.filename
+    original = ProcessedPhoto(data, original_mimetype, filename) if PHOTO_KEEP_ORIGINAL else None
+    try:
+        future = _get_pool().submit(compress_image, data)
+    except (OSError, BrokenProcessPool, RuntimeError) as e:
+        print(f"  - Advertencia: no se pudo usar el grupo de procesos ({e}); se comprime en este hilo.")
+        _reset_pool()
+        future = None
+
+    try:
+        compressed, seconds = future.result() if future is not None else compress_image(data)
+    except BrokenProcessPool as e:
+        _reset_pool()
+        print(f"  - Advertencia: el grupo de procesos falló ({e}); se sube '{filename}' sin comprimir.")
+        return ProcessedPhoto(data, original_mimetype, filename)
+    except Exception as e:
+        print(f"  - Advertencia: no se pudo comprimir '{filename}' ({e}); se sube la original.")
+        return ProcessedPhoto(data, original_mimetype, filename)
+
+    observe('stage_duration_seconds', seconds, stage='ingest.photo_encode')
+    increment('bytes_total', len(data), stage='ingest.photo_original')
+    if len(compressed) >= len(data):
+        increment('bytes_total', len(data), stage='ingest.photo_compressed')
+        print(f"  - '{filename}': la versión comprimida no es más pequeña; se sube la original.")
+        return ProcessedPhoto(data, original_mimetype, filename)
+
+    increment('bytes_total', len(compressed), stage='ingest.photo_compressed')
+    print(f"  - '{filename}' comprimida: {len(data) / 1024:.0f} KB -> {len(compressed) / 1024:.0f} KB"
+          f" ({len(compressed) / len(data):.0%}) en {seconds * 1000:.0f} ms.")
+    _, mimetype = FORMATS[PHOTO_COMPRESSION]
+    return ProcessedPhoto(compressed, mimetype, filename, original)
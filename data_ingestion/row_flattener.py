@@ -0,0 +1,60 @@
+import json
+
+from config import SHEET_HEADERS, PENDING_STATUS
+
+# Secciones anidadas de la encuesta: la columna 'tapa_estado' sale de datos['tapa']['estado'].
+# El resto de columnas ('pozo_numero', 'tipo_sistema', 'estado_general_pozo', ...) son claves de primer nivel.
+SURVEY_SECTIONS = ('tapa', 'cargue', 'cono', 'cilindro', 'canuela', 'escalones')
+
+# Columnas que no se copian tal cual de la encuesta.
+STATUS_COLUMN = 'estado'
+CONNECTIONS_COLUMN = 'conexiones'
+PHOTO_URL_COLUMN = 'foto_url'
+
+def compile_row_flattener(headers=SHEET_HEADERS):
+    """
+    Traduce una vez la cabecera de la hoja a la ruta de cada columna dentro del JSON de la encuesta
+    y devuelve una función flatten(datos, foto_url='', estado=PENDING_STATUS) que arma la fila en el orden de 'headers'.
+    Así la fila nunca se desalinea de la cabecera, y cada encuesta solo hace búsquedas directas en diccionarios.
+    """
+    plan = []
+    for column in headers:
+        name = column.lower()
+        if name == STATUS_COLUMN:
+            plan.append(('status', None, None))
+        elif name == CONNECTIONS_COLUMN:
+            plan.append(('connections', None, None))
+        elif name == PHOTO_URL_COLUMN:
+            plan.append(('photo_url', None, None))
+        else:
+            section, _, field = name.partition('_')
+            if section in SURVEY_SECTIONS and field:
+                plan.append(('section', section, field))
+            else:
+                plan.append(('field', name, None))
+    plan = tuple(plan)
+
+    def flatten(datos, foto_url='', estado=PENDING_STATUS):
+        row = []
+        sections = {}
+        for kind, key, field in plan:
+            if kind == 'field':
+                value = datos.get(key)
+            elif kind == 'section':
+                section = sections.get(key)
+                if section is None:
+                    section = sections[key] = datos.get(key) or {}
+                value = section.get(field)
+            elif kind == 'connections':
+                value = json.dumps(datos.get('conexiones', []))
+            elif kind == 'photo_url':
+                value = foto_url
+            else:
+                value = estado
+            row.append('' if value is None else value)
+        return row
+
+    return flatten
+
+# Aplanador de la cabecera configurada, compilado al importar el módulo.
+flatten_survey = compile_row_flattener()
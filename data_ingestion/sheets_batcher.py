@@ -0,0 +1,117 @@
+import re
+import time
+import queue
+import threading
+from gspread.utils import rowcol_to_a1
+
+from google_clients import get_sheets_values
+from config import SPREADSHEET_ID, WORKSHEET_NAME, SHEET_HEADERS, SHEETS_BATCH_WINDOW_SECONDS, SHEETS_BATCH_MAX_ROWS
+
+_UPDATED_RANGE_RE = re.compile(r"![A-Z]+(\d+)")
+
+def append_rows(rows):
+    """Agrega varias filas a la hoja en una sola llamada y devuelve el número de fila de cada una."""
+    response = get_sheets_values().append(
+        spreadsheetId=SPREADSHEET_ID,
+        range=f"{WORKSHEET_NAME}!A:Z",
+        valueInputOption='USER_ENTERED',
+        body={'values': rows}
+    ).execute()
+
+    # 'updatedRange' tiene la forma "'Tabla Maestra'!A10:AF14": las filas quedan consecutivas desde la 10.
+    updated_range = response.get('updates', {}).get('updatedRange', '')
+    match = _UPDATED_RANGE_RE.search(updated_range)
+    if not match:
+        return [None] * len(rows)
+    first_row = int(match.group(1))
+    return [first_row + i for i in range(len(rows))]
+
+def set_rows_status(row_numbers, status):
+    """Escribe 'status' en la columna 'Estado' de las filas indicadas, con una sola llamada."""
+    col_index = [h.lower() for h in SHEET_HEADERS].index('estado') + 1
+    data = [
+        {'range': f"'{WORKSHEET_NAME}'!{rowcol_to_a1(row_number, col_index)}", 'values': [[status]]}
+        for row_number in row_numbers
+    ]
+    get_sheets_values().batchUpdate(
+        spreadsheetId=SPREADSHEET_ID,
+        body={'valueInputOption': 'USER_ENTERED', 'data': data}
+    ).execute()
+
+class _PendingRow:
+    """Fila en espera de ser escrita por el agrupador."""
+
+    def __init__(self, row):
+        self.row = row
+        self.row_number = None
+        self.error = None
+        self.done = threading.Event()
+
+class SheetsAppendBatcher:
+    """
+    Agrupa las filas que llegan durante una ventana corta (o hasta un máximo de filas)
+    y las escribe en Google Sheets con una única llamada 'append'.
+    """
+
+    def __init__(self, window_seconds, max_rows):
+        self.window_seconds = window_seconds
+        self.max_rows = max(1, max_rows)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sheets-batcher", daemon=True)
+        self._thread.start()
+
+    def append(self, row):
+        """Encola una fila, espera a que se escriba y devuelve el número de fila donde quedó."""
+        pending = _PendingRow(row)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.row_number
+
+    def _collect_batch(self):
+        """Espera la primera fila y reúne las que lleguen dentro de la ventana."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                row_numbers = append_rows([p.row for p in batch])
+                print(f"Agrupador de Sheets: {len(batch)} filas escritas en una sola llamada.")
+                for pending, row_number in zip(batch, row_numbers):
+                    pending.row_number = row_number
+            except Exception as e:
+                print(f"Agrupador de Sheets: error al escribir {len(batch)} filas: {e}")
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def append_row(row):
+    """
+    Escribe una fila en la hoja y devuelve su número de fila.
+    Si SHEETS_BATCH_WINDOW_SECONDS es mayor que 0, la fila se agrupa con otras solicitudes concurrentes.
+    """
+    global _batcher
+    if SHEETS_BATCH_WINDOW_SECONDS <= 0:
+        return append_rows([row])[0]
+
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = SheetsAppendBatcher(SHEETS_BATCH_WINDOW_SECONDS, SHEETS_BATCH_MAX_ROWS)
+    return _batcher.append(row)
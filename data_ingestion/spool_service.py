@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import threading
+
+from config import SPOOL_DIR, SPOOL_WORKERS, SPOOL_MAX_RETRIES, SPOOL_LEASE_SECONDS
+from .ingestion_service import ingest_survey, IncompleteIngestionError
+
+# --- Estados de un ticket en la cola local ---
+STATUS_QUEUED = "en_cola"
+STATUS_PROCESSING = "procesando"
+STATUS_DONE = "completado"
+STATUS_FAILED = "error"
+
+DB_PATH = os.path.join(SPOOL_DIR, 'spool.db')
+
+_wakeup = threading.Event()
+_workers = []
+
+class SpooledPhoto:
+    """Foto guardada en disco que se comporta como el FileStorage de Werkzeug para el servicio de ingesta."""
+
+    def __init__(self, path, mimetype, filename):
+        self.path = path
+        self.mimetype = mimetype
+        self.filename = filename
+        self.stream = open(path, 'rb')
+
+    def read(self, *args):
+        return self.stream.read(*args)
+
+    def close(self):
+        self.stream.close()
+
+def _connect():
+    """Abre una conexión a la base de datos de la cola, creando el esquema si no existe."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tickets ("
+        " id TEXT PRIMARY KEY, estado TEXT NOT NULL, datos TEXT NOT NULL, fotos TEXT NOT NULL,"
+        " intentos INTEGER NOT NULL DEFAULT 0, error TEXT, disponible_en REAL NOT NULL,"
+        " creado REAL NOT NULL, actualizado REAL NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_estado ON tickets (estado, disponible_en)")
+    # 'progreso' guarda la fila escrita y las fotos subidas de un intento incompleto (colas anteriores no la tienen).
+    if 'progreso' not in {row['name'] for row in conn.execute("PRAGMA table_info(tickets)")}:
+        conn.execute("ALTER TABLE tickets ADD COLUMN progreso TEXT")
+    # 'reclamado_en' es la reserva del trabajador que procesa el ticket; la renueva mientras trabaja.
+    if 'reclamado_en' not in {row['name'] for row in conn.execute("PRAGMA table_info(tickets)")}:
+        conn.execute("ALTER TABLE tickets ADD COLUMN reclamado_en REAL")
+    return conn
+
+def enqueue_survey(data_str, files, progress=None):
+    """
+    Guarda la encuesta y sus fotos en la cola local y devuelve el ticket asignado.
+    'progress' es el progreso de un intento que ya falló ({'fila', 'fotos_subidas'}): el trabajador
+    continúa desde ahí, sin volver a escribir la fila ni a subir las fotos que ya están en Drive.
+    """
+    ticket = uuid.uuid4().hex
+    ticket_dir = os.path.join(SPOOL_DIR, ticket)
+    os.makedirs(ticket_dir, exist_ok=True)
+
+    fotos = []
+    for i, foto in enumerate(files, 1):
+        path = os.path.join(ticket_dir, str(i))
+        # Tras un intento fallido el stream de la foto ya se leyó.
+        foto.stream.seek(0)
+        foto.save(path)
+        fotos.append({'path': path, 'mimetype': foto.mimetype, 'filename': foto.filename})
+
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO tickets (id, estado, datos, fotos, disponible_en, creado, actualizado, progreso)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (ticket, STATUS_QUEUED, data_str, json.dumps(fotos), now, now, now,
+                 json.dumps(progress) if progress else None)
+            )
+    finally:
+        conn.close()
+
+    _wakeup.set()
+    print(f"Encuesta encolada con el ticket {ticket} ({len(fotos)} fotos).")
+    return ticket
+
+def get_ticket_status(ticket):
+    """Devuelve el estado de un ticket o None si no existe."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT id, estado, intentos, error, creado, actualizado FROM tickets WHERE id = ?", (ticket,)
+        ).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    return {
+        'ticket': row['id'],
+        'estado': row['estado'],
+        'intentos': row['intentos'],
+        'error': row['error'],
+        'creado': row['creado'],
+        'actualizado': row['actualizado'],
+    }
+
+def _claim_next():
+    """
+    Toma el siguiente ticket disponible y lo marca como en proceso. Además de los que están en cola,
+    toma los 'procesando' cuya reserva venció (su proceso se cayó). La marca solo se aplica si el ticket
+    sigue como se leyó, así que dos trabajadores, aunque sean de procesos distintos, nunca toman el mismo.
+    """
+    conn = _connect()
+    try:
+        while True:
+            now = time.time()
+            with conn:
+                row = conn.execute(
+                    "SELECT id, estado, datos, fotos, intentos, progreso, reclamado_en FROM tickets"
+                    " WHERE (estado = ? AND disponible_en <= ?) OR (estado = ? AND COALESCE(reclamado_en, 0) <= ?)"
+                    " ORDER BY creado LIMIT 1",
+                    (STATUS_QUEUED, now, STATUS_PROCESSING, now - SPOOL_LEASE_SECONDS)
+                ).fetchone()
+                if row is None:
+                    return None
+                claimed = conn.execute(
+                    "UPDATE tickets SET estado = ?, reclamado_en = ?, actualizado = ?"
+                    " WHERE id = ? AND estado = ? AND COALESCE(reclamado_en, 0) = COALESCE(?, 0)",
+                    (STATUS_PROCESSING, now, now, row['id'], row['estado'], row['reclamado_en'])
+                ).rowcount
+            if claimed:
+                if row['estado'] == STATUS_PROCESSING:
+                    print(f"Ticket {row['id']}: la reserva de otro trabajador venció; se retoma.")
+                return dict(row)
+            # Otro trabajador lo tomó entre la lectura y la marca: se busca el siguiente.
+    finally:
+        conn.close()
+
+def _keep_lease(ticket, stop):
+    """Renueva la reserva del ticket hasta que se active 'stop', para que nadie lo tome mientras se procesa."""
+    while not stop.wait(max(1, SPOOL_LEASE_SECONDS / 3)):
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "UPDATE tickets SET reclamado_en = ? WHERE id = ? AND estado = ?",
+                    (time.time(), ticket, STATUS_PROCESSING)
+                )
+        except sqlite3.Error as e:
+            print(f"Ticket {ticket}: no se pudo renovar la reserva: {e}")
+        finally:
+            conn.close()
+
+def _finish(ticket, estado, intentos, error=None, delay=0, progreso=None):
+    """Registra el resultado de un intento de procesamiento."""
+    now = time.time()
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE tickets SET estado = ?, intentos = ?, error = ?, disponible_en = ?, actualizado = ?,"
+                " progreso = COALESCE(?, progreso) WHERE id = ?",
+                (estado, intentos, error, now + delay, now, progreso, ticket)
+            )
+    finally:
+        conn.close()
+
+def _process(entry):
+    """Envía un ticket al servicio de ingesta, reintentando con espera exponencial si falla."""
+    ticket = entry['id']
+    fotos = [SpooledPhoto(**f) for f in json.loads(entry['fotos'])]
+    intentos = entry['intentos'] + 1
+    resume = json.loads(entry['progreso']) if entry.get('progreso') else None
+    stop = threading.Event()
+    threading.Thread(target=_keep_lease, args=(ticket, stop), daemon=True).start()
+    try:
+        ingest_survey(entry['datos'], fotos, resume=resume)
+    except Exception as e:
+        # Si la fila o alguna foto ya llegaron a Google, el próximo intento sigue desde ahí.
+        progreso = json.dumps(e.progress()) if isinstance(e, IncompleteIngestionError) else None
+        if intentos >= SPOOL_MAX_RETRIES:
+            print(f"Ticket {ticket}: error definitivo tras {intentos} intentos: {e}")
+            _finish(ticket, STATUS_FAILED, intentos, str(e), progreso=progreso)
+        else:
+            delay = min(300, 5 * 2 ** (intentos - 1))
+            print(f"Ticket {ticket}: error en el intento {intentos}, reintentando en {delay}s: {e}")
+            _finish(ticket, STATUS_QUEUED, intentos, str(e), delay, progreso=progreso)
+        return
+    finally:
+        stop.set()
+        for foto in fotos:
+            foto.close()
+
+    _finish(ticket, STATUS_DONE, intentos)
+    shutil.rmtree(os.path.join(SPOOL_DIR, ticket), ignore_errors=True)
+    print(f"Ticket {ticket}: encuesta ingerida correctamente.")
+
+def _worker_loop():
+    """Bucle de un trabajador: vacía la cola y espera nuevas encuestas."""
+    while True:
+        entry = _claim_next()
+        if entry is None:
+            _wakeup.wait(timeout=5)
+            _wakeup.clear()
+            continue
+        try:
+            _process(entry)
+        except Exception as e:
+            print(f"Error inesperado en el trabajador de la cola: {e}")
+
+def start_workers():
+    """
+    Arranca los trabajadores en segundo plano. Los tickets que quedaron 'procesando' por un reinicio
+    se retoman cuando vence su reserva (ver _claim_next), no al arrancar: otro proceso que comparta
+    SPOOL_DIR puede estar trabajando en ellos.
+    """
+    if _workers:
+        return
+
+    for i in range(max(1, SPOOL_WORKERS)):
+        worker = threading.Thread(target=_worker_loop, name=f"spool-worker-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+    print(f"Cola de ingesta iniciada con {len(_workers)} trabajadores en '{SPOOL_DIR}'.")
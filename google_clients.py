@@ -1,11 +1,15 @@
-import os
 import json
-from google.oauth2.credentials import Credentials
+import threading
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 import gspread
 
 from config import GOOGLE_CREDENTIALS_JSON, SCOPES
+from metrics import instrument_transport, increment
+from api_scheduler import schedule_transport
+from credential_manager import CredentialManager
 
 # --- Constantes ---
 # El archivo 'client_secret.json' que descargas de Google Cloud Console.
@@ -14,41 +18,41 @@ CLIENT_SECRETS_DICT = json.loads(GOOGLE_CREDENTIALS_JSON)
 # Archivo para almacenar los tokens del usuario.
 TOKEN_FILE = 'token.json' 
 
-_credentials = None
+# Refresca el token antes de que venza, en segundo plano y de a un refresco a la vez.
+_credential_manager = CredentialManager(TOKEN_FILE, SCOPES)
+
+# Pool de clientes: un juego de clientes por hilo, porque httplib2 no es seguro entre hilos.
+# Cada construcción y cada reutilización se cuentan en google_client_pool_total (ruta /metrics).
+_thread_clients = threading.local()
+
+# Backend alternativo (por ejemplo, las APIs simuladas de benchmarks/). None usa las APIs reales de Google.
+_client_backend = None
+
+def set_client_backend(backend):
+    """
+    Sustituye el transporte de los clientes de Google por el de 'backend', que debe ofrecer 'credentials',
+    'http()' (objeto compatible con httplib2) y 'session()' (compatible con requests, para gspread).
+    Con None se vuelve a las APIs reales. Los clientes del pool se reconstruyen porque cambian las credenciales.
+    """
+    global _client_backend
+    _client_backend = backend
 
 def get_credentials():
     """
-    Carga las credenciales del usuario desde el archivo token.json.
-    Si el token ha expirado, lo refresca si es posible.
-    Devuelve None si no hay un token válido.
+    Devuelve las credenciales del usuario guardadas en token.json, o None si no hay un token válido.
+    El token se refresca en segundo plano antes de vencer, así que las solicitudes no esperan al refresco.
     """
-    global _credentials
-    if _credentials and _credentials.valid:
-        return _credentials
-
-    if os.path.exists(TOKEN_FILE):
-        _credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
-        # Si las credenciales existen pero no son válidas (expiraron) y tenemos un refresh token
-        if _credentials and not _credentials.valid and _credentials.refresh_token:
-            try:
-                print("Refrescando token de acceso expirado...")
-                _credentials.refresh(Request())
-                print("Token refrescado exitosamente.")
-                # Guardamos las credenciales actualizadas (con el nuevo access token)
-                save_credentials(_credentials)
-            except Exception as e:
-                print(f"Error al refrescar el token: {e}")
-                # Si falla el refresh, es como no tener credenciales.
-                # Forzamos una nueva autenticación eliminando el token corrupto.
-                os.remove(TOKEN_FILE)
-                return None
-        return _credentials
-    return None
+    if _client_backend is not None:
+        return _client_backend.credentials
+    return _credential_manager.get()
+
+def get_credentials_status():
+    """Devuelve el vencimiento del token, los refrescos hechos y el último error de refresco."""
+    return _credential_manager.status()
 
 def save_credentials(credentials):
-    """Guarda las credenciales del usuario en el archivo token.json."""
-    with open(TOKEN_FILE, 'w') as token:
-        token.write(credentials.to_json())
+    """Guarda las credenciales del usuario en token.json (de forma atómica) y empieza a usarlas."""
+    _credential_manager.store(credentials)
 
 def get_auth_flow(redirect_uri):
     """Crea y devuelve un objeto Flow para la autenticación."""
@@ -58,23 +62,62 @@ def get_auth_flow(redirect_uri):
         redirect_uri=redirect_uri
     )
 
-def get_sheets_client():
-    """Devuelve un cliente de Google Sheets autenticado."""
+def _get_pooled_client(name, factory):
+    """
+    Devuelve el cliente 'name' del hilo actual, construyéndolo solo la primera vez
+    o cuando cambian las credenciales (por ejemplo, tras una nueva autenticación).
+    """
     credentials = get_credentials()
     if not credentials:
         raise Exception("Autenticación requerida. No se encontraron credenciales válidas.")
-    return build('sheets', 'v4', credentials=credentials)
+
+    clients = getattr(_thread_clients, 'clients', None)
+    if clients is None:
+        clients = _thread_clients.clients = {}
+
+    cached = clients.get(name)
+    if cached and cached[0] is credentials:
+        increment('google_client_pool_total', client=name, result='hit')
+        return cached[1]
+
+    client = factory(credentials)
+    clients[name] = (credentials, client)
+    increment('google_client_pool_total', client=name, result='build')
+    return client
+
+def _build_service(api, version, credentials):
+    """Construye un servicio desde el documento de descubrimiento local, con conexión HTTP persistente."""
+    # El AuthorizedHttp refresca el token sobre el mismo objeto de credenciales, sin reconstruir el cliente.
+    http = AuthorizedHttp(credentials, http=_client_backend.http() if _client_backend else httplib2.Http())
+    # Cada petición pasa por el planificador (cuotas, concurrencia, reintentos) y cada intento queda medido.
+    schedule_transport(instrument_transport(http, api), api)
+    return build(api, version, http=http, static_discovery=True, cache_discovery=False)
+
+def get_sheets_client():
+    """Devuelve un cliente de Google Sheets autenticado."""
+    return _get_pooled_client('sheets', lambda credentials: _build_service('sheets', 'v4', credentials))
+
+def get_sheets_values():
+    """
+    Devuelve el recurso spreadsheets().values() del cliente de Sheets del hilo actual.
+    googleapiclient arma la documentación de todos los métodos cada vez que se pide un recurso
+    (decenas de milisegundos de CPU con el esquema de Sheets), así que se construye una sola vez por hilo.
+    """
+    return _get_pooled_client('sheets.values', lambda credentials: get_sheets_client().spreadsheets().values())
 
 def get_drive_client():
     """Devuelve un cliente de Google Drive autenticado."""
-    credentials = get_credentials()
-    if not credentials:
-        raise Exception("Autenticación requerida. No se encontraron credenciales válidas.")
-    return build('drive', 'v3', credentials=credentials)
+    return _get_pooled_client('drive', lambda credentials: _build_service('drive', 'v3', credentials))
+
+def _build_gspread_client(credentials):
+    """Construye un cliente de gspread cuyas peticiones pasan por el planificador y quedan registradas en las métricas."""
+    if _client_backend is not None:
+        client = gspread.authorize(credentials, session=_client_backend.session())
+    else:
+        client = gspread.authorize(credentials)
+    schedule_transport(instrument_transport(client.http_client.session, 'sheets'), 'sheets')
+    return client
 
 def get_gspread_client():
     """Devuelve un cliente de gspread autenticado."""
-    credentials = get_credentials()
-    if not credentials:
-        raise Exception("Autenticación requerida. No se encontraron credenciales válidas.")
-    return gspread.authorize(credentials)
\ No newline at end of file
+    return _get_pooled_client('gspread', _build_gspread_client)
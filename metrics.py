@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import METRICS_SUMMARY_DIR
+
+# Métricas en memoria del proceso: histogramas de latencia por etapa, contadores de bytes
+# y de llamadas a las APIs de Google. Se exponen en formato Prometheus (ruta /metrics de app.py)
+# y cada ejecución del generador de reportes las resume en un JSON.
+
+PREFIX = 'acueducto'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Códigos de respuesta que api_scheduler.py vuelve a intentar.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+HELP = {
+    'stage_duration_seconds': 'Duración de cada etapa de la ingesta y del generador de reportes.',
+    'stage_errors_total': 'Etapas que terminaron con una excepción.',
+    'bytes_total': 'Bytes procesados por etapa (fotos subidas, reportes descargados y subidos).',
+    'google_api_requests_total': 'Peticiones HTTP a las APIs de Google, por API y código de respuesta.',
+    'google_api_request_duration_seconds': 'Latencia de las peticiones HTTP a las APIs de Google.',
+    'google_api_retries_total': 'Peticiones a las APIs de Google que se volvieron a enviar, por motivo (código de respuesta o error de red).',
+    'google_api_throttled_total': 'Peticiones a las APIs de Google demoradas por cuota, concurrencia, prioridad o un 429.',
+    'google_api_wait_seconds': 'Espera de las peticiones demoradas antes de salir hacia Google, por API y prioridad.',
+    'google_client_pool_total': 'Pedidos de clientes de Google por hilo, por cliente y resultado (build = construido, hit = reutilizado).',
+    'credentials_refresh_total': 'Refrescos del token OAuth, por origen (background, on_demand, transport) y resultado.',
+}
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_run = None
+# Evita contar dos veces cuando el transporte se llama a sí mismo (p. ej. al reintentar tras refrescar el token).
+_in_request = threading.local()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def observe(name, value, **labels):
+    """Registra una observación (en segundos) en el histograma 'name'."""
+    with _lock:
+        histogram = _histograms.get(_key(name, labels))
+        if histogram is None:
+            histogram = _histograms[_key(name, labels)] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+def increment(name, value=1, **labels):
+    """Suma 'value' al contador 'name'."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def timed(stage):
+    """Mide la duración del bloque como la etapa 'stage', contando también si terminó con error."""
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_duration_seconds', elapsed, stage=stage)
+        if failed:
+            increment('stage_errors_total', stage=stage)
+        with _lock:
+            if _run is not None:
+                entry = _run['stages'].setdefault(stage, {'count': 0, 'total_s': 0.0, 'max_s': 0.0, 'errors': 0})
+                entry['count'] += 1
+                entry['total_s'] += elapsed
+                entry['max_s'] = max(entry['max_s'], elapsed)
+                entry['errors'] += failed
+
+def instrument_transport(transport, api):
+    """
+    Envuelve el método request de un transporte HTTP (httplib2 para googleapiclient o una sesión
+    de requests para gspread) para medir la latencia y contar las respuestas de la API 'api'.
+    Los reintentos los cuenta api_scheduler.py, que es quien decide si una respuesta se reintenta.
+    """
+    request = transport.request
+
+    def instrumented_request(*args, **kwargs):
+        if getattr(_in_request, 'active', False):
+            return request(*args, **kwargs)
+        _in_request.active = True
+        start = time.perf_counter()
+        try:
+            response = request(*args, **kwargs)
+        except Exception:
+            increment('google_api_requests_total', api=api, status='error')
+            raise
+        finally:
+            _in_request.active = False
+            observe('google_api_request_duration_seconds', time.perf_counter() - start, api=api)
+        # httplib2 devuelve (respuesta, contenido); requests devuelve la respuesta.
+        resp = response[0] if isinstance(response, tuple) else response
+        status = getattr(resp, 'status', None) or getattr(resp, 'status_code', 0)
+        increment('google_api_requests_total', api=api, status=str(status))
+        return response
+
+    transport.request = instrumented_request
+    return transport
+
+def _escape_label(value):
+    """Escapa un valor de etiqueta como pide el formato de texto de Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+def render_prometheus():
+    """Devuelve todas las métricas en el formato de texto de Prometheus."""
+    with _lock:
+        histograms = {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']} for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        full_name = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, histogram['buckets']):
+                lines.append(f"{full_name}_bucket{_labels_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{full_name}_bucket{_labels_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{full_name}_sum{_labels_text(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{full_name}_count{_labels_text(labels)} {histogram['count']}")
+    for name in sorted({name for name, _ in counters}):
+        full_name = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_labels_text(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+# --- Resumen por ejecución ---
+
+def begin_run(name, **info):
+    """Empieza a acumular el resumen de una ejecución (por ejemplo, una corrida del generador)."""
+    global _run
+    with _lock:
+        _run = {
+            'name': name, 'info': dict(info), 'stages': {},
+            'started_at': datetime.now(), 'start': time.perf_counter(), 'counters': dict(_counters),
+        }
+
+def annotate_run(**info):
+    """Añade datos descriptivos (registros procesados, motor usado, etc.) al resumen en curso."""
+    with _lock:
+        if _run is not None:
+            _run['info'].update(info)
+
+def write_run_summary(directory=METRICS_SUMMARY_DIR):
+    """
+    Escribe el resumen de la ejecución en curso como JSON en 'directory' y lo cierra.
+    Devuelve la ruta del archivo, o None si no había una ejecución abierta.
+    """
+    global _run
+    with _lock:
+        run, _run = _run, None
+        counters = dict(_counters)
+    if run is None:
+        return None
+
+    duration = time.perf_counter() - run['start']
+    summary = {
+        'run': run['name'],
+        'started_at': run['started_at'].isoformat(timespec='seconds'),
+        'duration_s': round(duration, 4),
+        'info': run['info'],
+        'stages': {
+            stage: {**entry, 'total_s': round(entry['total_s'], 4), 'max_s': round(entry['max_s'], 4),
+                    'mean_s': round(entry['total_s'] / entry['count'], 4)}
+            for stage, entry in run['stages'].items()
+        },
+        # Solo lo que cambió durante esta ejecución.
+        'counters': {
+            name + _labels_text(labels): value - run['counters'].get((name, labels), 0)
+            for (name, labels), value in sorted(counters.items())
+            if value != run['counters'].get((name, labels), 0)
+        },
+    }
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{run['name']}_{run['started_at']:%Y%m%d-%H%M%S}.json")
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return path
@@ -0,0 +1,36 @@
+from config import REPORT_CHECKPOINT_NAME, SPREADSHEET_ID, WORKSHEET_NAME
+from .drive_handler import read_json_file, write_json_file
+
+# El punto de control se guarda en Drive, en la carpeta de reportes junto al manifiesto de particiones:
+# el generador corre en un runner efímero, donde un archivo local se perdería con la ejecución fallida.
+# Id del archivo en Drive, para no buscarlo por nombre en cada escritura.
+_checkpoint_id = None
+
+def load_checkpoint():
+    """
+    Devuelve el lote que quedó a medias en una ejecución anterior, o None.
+    Solo vale para la misma hoja de cálculo y pestaña, como el cursor de escaneo.
+    """
+    global _checkpoint_id
+    try:
+        checkpoint, _checkpoint_id = read_json_file(REPORT_CHECKPOINT_NAME)
+    except ValueError as e:
+        print(f"  - Advertencia: no se pudo leer el punto de control '{REPORT_CHECKPOINT_NAME}': {e}")
+        return None
+    # Un punto de control vacío es el que dejó clear_checkpoint.
+    if not checkpoint or not checkpoint.get('rows'):
+        return None
+    if checkpoint.get('spreadsheet_id') != SPREADSHEET_ID or checkpoint.get('worksheet') != WORKSHEET_NAME:
+        return None
+    return checkpoint
+
+def save_checkpoint(checkpoint):
+    """Guarda el lote en curso en Drive, sobrescribiendo el punto de control anterior."""
+    global _checkpoint_id
+    data = dict(checkpoint, spreadsheet_id=SPREADSHEET_ID, worksheet=WORKSHEET_NAME)
+    _checkpoint_id = write_json_file(REPORT_CHECKPOINT_NAME, data, _checkpoint_id)
+
+def clear_checkpoint():
+    """Vacía el punto de control una vez que el lote quedó marcado en la hoja."""
+    if _checkpoint_id is not None:
+        write_json_file(REPORT_CHECKPOINT_NAME, {}, _checkpoint_id)
@@ -1,15 +1,24 @@
 import io
+import json
 import tempfile
 from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
 
 from google_clients import get_drive_client
-from config import MASTER_REPORT_ID, DRIVE_FOLDER_ID
+from config import MASTER_REPORT_ID, DRIVE_FOLDER_ID, REPORTS_FOLDER_ID, REPORT_UPLOAD_CHUNK_SIZE
 
-def download_master_report():
-    """Descarga el reporte maestro, lo guarda en un archivo temporal y devuelve la ruta."""
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+REVISION_FIELDS = 'id, headRevisionId, md5Checksum, modifiedTime, size'
+
+def get_report_revision(file_id=MASTER_REPORT_ID):
+    """Devuelve los metadatos de revisión del reporte (headRevisionId, md5Checksum, modifiedTime, size) sin descargarlo."""
+    service = get_drive_client()
+    return service.files().get(fileId=file_id, fields=REVISION_FIELDS).execute()
+
+def download_master_report(file_id=MASTER_REPORT_ID):
+    """Descarga el reporte maestro (o la partición indicada), lo guarda en un archivo temporal y devuelve la ruta."""
     print("Descargando reporte maestro desde Google Drive...")
     service = get_drive_client()
-    request = service.files().get_media(fileId=MASTER_REPORT_ID)
+    request = service.files().get_media(fileId=file_id)
     # Crear un archivo temporal que no se borre al cerrar
     try:
         temp_f = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
@@ -28,35 +37,100 @@ def download_master_report():
     print(f"Reporte maestro guardado temporalmente en: {temp_file_path}")
     return temp_file_path
 
-def download_photo(pozo_numero):
-    """Descarga la primera foto encontrada para un número de pozo específico."""
-    print(f"  - Buscando foto para el pozo {pozo_numero} en Drive...")
+def list_folder_files(folder_id=DRIVE_FOLDER_ID, fields='id, name, modifiedTime'):
+    """Lista los archivos (no eliminados) de una carpeta de Drive, recorriendo todas las páginas."""
     service = get_drive_client()
-    query = f"'{DRIVE_FOLDER_ID}' in parents and name starts with '{pozo_numero}-'"
-    response = service.files().list(q=query, fields="files(id, name)").execute()
-    files = response.get('files', [])
-    
-    if not files:
-        print(f"  - Advertencia: No se encontró una foto para el pozo {pozo_numero}.")
-        return None
-
-    foto_id = files[0].get('id')
-    print(f"  - Descargando foto '{files[0].get('name')}'...")
-    request = service.files().get_media(fileId=foto_id)
-    buffer_foto = io.BytesIO()
-    downloader = MediaIoBaseDownload(buffer_foto, request)
-    
+    query = f"'{folder_id}' in parents and trashed = false"
+    files = []
+    page_token = None
+    while True:
+        response = service.files().list(
+            q=query, fields=f"nextPageToken, files({fields})", pageSize=1000, pageToken=page_token
+        ).execute()
+        files.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return files
+
+def download_file(file_id):
+    """Descarga un archivo de Drive a memoria y devuelve sus bytes."""
+    service = get_drive_client()
+    request = service.files().get_media(fileId=file_id)
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, request)
+
     done = False
     while not done:
         _, done = downloader.next_chunk()
-        
-    buffer_foto.seek(0)
-    return buffer_foto
+    return buffer.getvalue()
+
+def get_changes_start_token():
+    """Devuelve el token que marca el punto actual del registro de cambios de Drive."""
+    service = get_drive_client()
+    return service.changes().getStartPageToken().execute()['startPageToken']
 
-def update_master_report(file_buffer):
-    """Actualiza el archivo de reporte maestro en Google Drive con el contenido del buffer."""
+def list_changes(page_token, fields='id, name, parents, trashed, modifiedTime'):
+    """
+    Recorre el registro de cambios de Drive desde 'page_token', con todas sus páginas.
+    Devuelve (cambios, token desde el que continuar la próxima vez).
+    """
+    service = get_drive_client()
+    changes = []
+    while True:
+        response = service.changes().list(
+            pageToken=page_token, pageSize=1000, spaces='drive',
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({fields}))"
+        ).execute()
+        changes.extend(response.get('changes', []))
+        if 'newStartPageToken' in response:
+            return changes, response['newStartPageToken']
+        page_token = response['nextPageToken']
+
+def update_master_report(file_buffer, file_id=MASTER_REPORT_ID):
+    """
+    Actualiza el archivo de reporte maestro (o la partición indicada) en Google Drive con el contenido del archivo.
+    La subida es reanudable y lee el archivo por fragmentos de REPORT_UPLOAD_CHUNK_SIZE, sin cargarlo entero en memoria.
+    Devuelve los metadatos de la nueva revisión.
+    """
     print(f"Actualizando el archivo maestro en Google Drive...")
     service = get_drive_client()
-    media = MediaIoBaseUpload(file_buffer, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    service.files().update(fileId=MASTER_REPORT_ID, media_body=media).execute()
+    media = MediaIoBaseUpload(file_buffer, mimetype=XLSX_MIMETYPE, chunksize=REPORT_UPLOAD_CHUNK_SIZE, resumable=True)
+    request = service.files().update(fileId=file_id, media_body=media, fields=REVISION_FIELDS)
+    revision = None
+    while revision is None:
+        # Los reintentos de cada fragmento los hace api_scheduler.py en el transporte.
+        status, revision = request.next_chunk()
+        if status:
+            print(f"Subida: {int(status.progress() * 100)}%.")
     print("¡Archivo maestro actualizado con éxito!")
+    return revision
+
+def copy_report(name, source_id=MASTER_REPORT_ID, folder_id=REPORTS_FOLDER_ID):
+    """Crea una copia del reporte indicado en la carpeta de reportes y devuelve el id del nuevo archivo."""
+    print(f"Creando el archivo '{name}' en Google Drive a partir del reporte maestro...")
+    service = get_drive_client()
+    body = {'name': name, 'parents': [folder_id]}
+    new_file = service.files().copy(fileId=source_id, body=body, fields='id').execute()
+    return new_file['id']
+
+def read_json_file(name, folder_id=REPORTS_FOLDER_ID):
+    """Busca un archivo JSON por nombre en la carpeta indicada. Devuelve (datos, id) o (None, None) si no existe."""
+    service = get_drive_client()
+    query = f"'{folder_id}' in parents and name = '{name}' and trashed = false"
+    files = service.files().list(q=query, fields="files(id)").execute().get('files', [])
+    if not files:
+        return None, None
+
+    file_id = files[0]['id']
+    content = service.files().get_media(fileId=file_id).execute()
+    return json.loads(content), file_id
+
+def write_json_file(name, data, file_id=None, folder_id=REPORTS_FOLDER_ID):
+    """Crea o sobrescribe un archivo JSON en la carpeta indicada y devuelve su id."""
+    service = get_drive_client()
+    media = MediaIoBaseUpload(io.BytesIO(json.dumps(data, ensure_ascii=False).encode('utf-8')), mimetype='application/json')
+    if file_id:
+        service.files().update(fileId=file_id, media_body=media).execute()
+        return file_id
+    body = {'name': name, 'parents': [folder_id]}
+    return service.files().create(body=body, media_body=media, fields='id').execute()['id']
@@ -1,8 +1,15 @@
+import io
 import json
 import os
+from copy import deepcopy
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from openpyxl.drawing.image import Image as OpenpyxlImage
-from openpyxl.styles import PatternFill, Border, Side, Font
+from openpyxl.styles import PatternFill, Side
 
+from config import REPORT_RENDER_WORKERS
 from .image_generator import create_connections_table_image
 
 # --- LA "RECETA" MAESTRA DEL REPORTE ---
@@ -38,9 +45,70 @@ CELL_MAPPING = {
     'estado_general_pozo': {'type': 'options', 'values': {'Infiltracion': 'D79', 'Represado': 'F79', 'Con basura': 'H79', 'Raices': 'D80', 'Fuera de Servicio': 'F80', 'Lleno de tierra': 'H80'}}
 }
 
-def fill_sheet(sheet, record):
-    """Rellena una hoja de cálculo con los datos de un registro."""
-    print(f"  - Rellenando hoja para el pozo '{record.get('pozo_numero')}'...")
+# --- Marco y fondo del reporte ---
+FRAME_LAST_ROW = 82
+FRAME_LAST_COL = 14
+BACKGROUND_COLOR = "ADADAD"
+FRAME_COLOR = "0000FF"
+
+TABLE_ANCHOR = 'M56'
+TABLE_WIDTH_PX = 338
+PLACEHOLDER_ANCHOR = 'M2'
+# Recuadro de la foto del pozo (celdas combinadas M30:M52 de la plantilla) y su tamaño en píxeles.
+PHOTO_ANCHOR = 'M30'
+PHOTO_BOX_PX = (300, 274)
+
+def unique_sheet_title(base_name, existing_names):
+    """Devuelve un nombre de hoja que no choque con los existentes: '12', '12(2)', '12(3)'..."""
+    sheet_title = base_name
+    counter = 2
+    while sheet_title in existing_names:
+        sheet_title = f"{base_name}({counter})"
+        counter += 1
+    return sheet_title
+
+@lru_cache(maxsize=1)
+def _load_placeholder():
+    """Lee la imagen placeholder del esquema; se guarda en memoria para el resto de la ejecución."""
+    try:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        project_root = os.path.dirname(script_dir)
+        placeholder_path = os.path.join(project_root, 'esquema_placeholder.png')
+
+        if os.path.exists(placeholder_path):
+            with open(placeholder_path, 'rb') as f:
+                return f.read()
+        print(f"  - ¡ERROR CRÍTICO! No se encontró el archivo placeholder en la ruta esperada: '{placeholder_path}'.")
+
+    except Exception as e:
+        print(f"  - Error al procesar la imagen del esquema: {e}")
+    return None
+
+def load_template_images(sheet):
+    """Lee una sola vez las imágenes de la hoja plantilla. Devuelve [(bytes, ancla, ancho, alto)]."""
+    template_images = []
+    for img in getattr(sheet, '_images', []):
+        # Image._data() cierra el buffer de la imagen, así que se lee directamente si está en memoria.
+        image_bytes = img.ref.getvalue() if hasattr(img.ref, 'getvalue') else img._data()
+        template_images.append((image_bytes, img.anchor, img.width, img.height))
+    return template_images
+
+def add_template_images(sheet, template_images):
+    """Agrega a una copia de la plantilla sus imágenes, compartiendo los bytes leídos por load_template_images."""
+    for image_bytes, anchor, width, height in template_images:
+        img = OpenpyxlImage(io.BytesIO(image_bytes))
+        img.width, img.height = width, height
+        sheet.add_image(img, deepcopy(anchor))
+
+def build_sheet_payload(record, photo=None):
+    """
+    Calcula el contenido de la hoja de un registro sin tocar ningún libro:
+    valores por celda, celdas subrayadas e imágenes (bytes y celda de anclaje).
+    'photo' es la foto del pozo ya reducida a PHOTO_BOX_PX (ver photo_handler.prefetch_photos).
+    """
+    values = {}
+    underline = []
+    images = []
 
     # 1. Relleno de celdas
     for field, mapping in CELL_MAPPING.items():
@@ -55,70 +123,125 @@ def fill_sheet(sheet, record):
             else:
                 processed_text = text.ljust(44, '_')
 
-            cell = sheet[cell_coord]
-            cell.value = processed_text
-            cell.font = cell.font.copy(underline='single')
+            values[cell_coord] = processed_text
+            underline.append(cell_coord)
 
         elif value is not None and value != '':
             if mapping['type'] == 'direct':
-                sheet[mapping['cell']] = value
+                values[mapping['cell']] = value
             elif mapping['type'] == 'options':
                 cell_to_mark = mapping['values'].get(str(value))
                 if cell_to_mark:
-                    sheet[cell_to_mark] = 'X'
+                    values[cell_to_mark] = 'X'
 
     # 2. Lógica de conexiones para crear imagen
     try:
         connections_json = record.get('conexiones', '[]')
         connections = json.loads(connections_json)
         if connections:
-            sheet['D7'] = connections[0].get('cota_razante')
-            
-            width_px = 338
+            values['D7'] = connections[0].get('cota_razante')
 
-            table_img_buffer = create_connections_table_image(connections, target_width_px=width_px)
-            img_tabla = OpenpyxlImage(table_img_buffer)
-            sheet.add_image(img_tabla, 'M56')
+            table_img_buffer = create_connections_table_image(connections, target_width_px=TABLE_WIDTH_PX)
+            images.append((table_img_buffer.getvalue(), TABLE_ANCHOR))
     except Exception as e:
         print(f"  - Advertencia al procesar conexiones: {e}")
 
-    # 3. Lógica para la imagen del esquema
+    # 3. Lógica para la imagen del esquema (leída de disco una sola vez por ejecución)
+    placeholder = _load_placeholder()
+    if placeholder is not None:
+        images.append((placeholder, PLACEHOLDER_ANCHOR))
+        print("  - Insertando placeholder para el esquema del pozo.")
+
+    # 4. Foto del pozo en su recuadro (se borra el texto que la plantilla tiene en esa celda)
+    if photo is not None:
+        values[PHOTO_ANCHOR] = None
+        images.append((photo, PHOTO_ANCHOR))
+
+    return {'values': values, 'underline': underline, 'images': images}
+
+def iter_sheet_payloads(records, workers=REPORT_RENDER_WORKERS, photos=None):
+    """
+    Genera el payload de cada registro conservando el orden, a medida que se van necesitando.
+    'photos' es una lista paralela a 'records' con la foto de cada pozo (o None).
+    Con más de un trabajador usa un grupo de procesos (0 = uno por CPU) con a lo sumo dos payloads
+    por trabajador en curso o esperando, así que la memoria no crece con el tamaño del lote. Con uno,
+    o si el grupo no se puede iniciar o se rompe, sigue en serie en este proceso desde el registro pendiente.
+    """
+    records = list(records)
+    photos = list(photos) if photos is not None else [None] * len(records)
+    workers = min(workers or os.cpu_count() or 1, len(records))
+    done = 0
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Ventana deslizante: se envía el siguiente registro solo cuando se entrega uno.
+                # executor.map enviaría todos de una vez y guardaría cada resultado hasta consumirlo.
+                window = deque()
+                submitted = 0
+                while done < len(records):
+                    while submitted < len(records) and len(window) < 2 * workers:
+                        window.append(executor.submit(build_sheet_payload, records[submitted], photos[submitted]))
+                        submitted += 1
+                    payload = window.popleft().result()
+                    yield payload
+                    done += 1
+            return
+        except (OSError, BrokenProcessPool) as e:
+            print(f"  - Advertencia: no se pudo calcular en paralelo ({e}); se continúa en serie.")
+    for record, photo in zip(records[done:], photos[done:]):
+        yield build_sheet_payload(record, photo)
+
+def apply_sheet_payload(sheet, payload):
+    """Escribe en una hoja de openpyxl el contenido calculado por build_sheet_payload."""
+    for cell_coord, value in payload['values'].items():
+        sheet[cell_coord] = value
+    for cell_coord in payload['underline']:
+        cell = sheet[cell_coord]
+        cell.font = cell.font.copy(underline='single')
+    for image_bytes, anchor in payload['images']:
+        sheet.add_image(OpenpyxlImage(io.BytesIO(image_bytes)), anchor)
+
+def compile_template(sheet):
+    """
+    Aplica una sola vez los estilos que comparten todos los pozos: fondo gris fuera del marco, bordes azules
+    del marco y sin cuadrícula. Modifica la hoja recibida, así que debe ser una copia de trabajo de la plantilla
+    (la plantilla se sube con el libro); las hojas nuevas se copian de ella y solo reciben los valores.
+    """
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        project_root = os.path.dirname(script_dir)
-        placeholder_path = os.path.join(project_root, 'esquema_placeholder.png')
-
-        if os.path.exists(placeholder_path):
-            img_placeholder = OpenpyxlImage(placeholder_path)
-            sheet.add_image(img_placeholder, 'M2')
-            print("  - Insertando placeholder para el esquema del pozo.")
-        else:
-            print(f"  - ¡ERROR CRÍTICO! No se encontró el archivo placeholder en la ruta esperada: '{placeholder_path}'.")
-
-    except Exception as e:
-        print(f"  - Error al procesar la imagen del esquema: {e}")
-
-    # 4. Aplicar estilos de marco y fondo
-    try:
-        gray_fill = PatternFill(start_color="ADADAD", end_color="ADADAD", fill_type="solid")
-        for row in sheet.iter_rows():
-            for cell in row:
-                if cell.row > 82 or cell.column > 14:
-                    cell.fill = gray_fill
-        print("  - Aplicando color de fondo por defecto.")
-
-        blue_medium_side = Side(border_style="medium", color="0000FF")
-        
-        for row_idx in range(1, 83):
-            cell = sheet.cell(row=row_idx, column=14)
+        # Fondo: estilos de columna y de fila, más las celdas ya existentes fuera del marco (sin crear celdas nuevas).
+        gray_fill = PatternFill(start_color=BACKGROUND_COLOR, end_color=BACKGROUND_COLOR, fill_type="solid")
+        for dimension in sheet.column_dimensions.values():
+            if dimension.min and dimension.min > FRAME_LAST_COL:
+                dimension.fill = gray_fill
+        for row_idx, dimension in sheet.row_dimensions.items():
+            if row_idx > FRAME_LAST_ROW:
+                dimension.fill = gray_fill
+        for (row_idx, col_idx), cell in sheet._cells.items():
+            if row_idx > FRAME_LAST_ROW or col_idx > FRAME_LAST_COL:
+                cell.fill = gray_fill
+        print("  - Aplicando color de fondo por defecto a la plantilla.")
+
+        blue_medium_side = Side(border_style="medium", color=FRAME_COLOR)
+
+        for row_idx in range(1, FRAME_LAST_ROW + 1):
+            cell = sheet.cell(row=row_idx, column=FRAME_LAST_COL)
             cell.border = cell.border.copy(right=blue_medium_side)
 
-        for col_idx in range(1, 15):
-            cell = sheet.cell(row=82, column=col_idx)
+        for col_idx in range(1, FRAME_LAST_COL + 1):
+            cell = sheet.cell(row=FRAME_LAST_ROW, column=col_idx)
             cell.border = cell.border.copy(bottom=blue_medium_side)
-        print("  - Aplicando bordes al marco.")
+        print("  - Aplicando bordes al marco de la plantilla.")
 
     except Exception as e:
         print(f"  - Error al aplicar estilos de marco y fondo: {e}")
 
+    sheet.sheet_view.showGridLines = False
+
+def fill_sheet(sheet, record, photo=None):
+    """
+    Rellena una hoja de cálculo (copia de una plantilla ya compilada) con los datos de un registro
+    y, si se indica, la foto del pozo ya reducida (ver photo_handler.prefetch_photos).
+    """
+    print(f"  - Rellenando hoja para el pozo '{record.get('pozo_numero')}'...")
+    apply_sheet_payload(sheet, build_sheet_payload(record, photo))
     print(f"  - Hoja para el pozo '{record.get('pozo_numero')}' rellenada.")
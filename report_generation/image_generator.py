@@ -1,9 +1,25 @@
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
 import io
 import json
+import math
+import os
+import shutil
+import subprocess
+import threading
+
+from config import REPORT_FONT_PATH, REPORT_FONT_FAMILY, TABLE_IMAGE_CACHE_SIZE
 
 # Constantes para la apariencia de la tabla
 FONT_PATH = "C:\\Windows\\Fonts\\calibri.ttf"
+# Alternativas habituales en Linux (Carlito tiene las mismas métricas que Calibri).
+FALLBACK_FONT_PATHS = [
+    "/usr/share/fonts/truetype/crosextra/Carlito-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+]
 FONT_SIZE = 16
 HEADER_FONT_SIZE = 18
 PADDING = 10
@@ -15,84 +31,149 @@ TEXT_COLOR = "black"
 HEADER_COLOR = "black"
 LINE_COLOR = "black"
 
-def create_connections_table_image(conexiones, target_width_px=None):
-    """Crea una imagen PNG que representa una tabla con los datos de las conexiones."""
-    
-    headers = ["Diámetro (pulg)", "Profundidad (m)", "Material"]
-    
-    data_for_table = [headers]
+HEADERS = ["Diámetro (pulg)", "Profundidad (m)", "Material"]
+
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def resolve_font_path():
+    """
+    Busca el archivo de fuente para las tablas: REPORT_FONT_PATH, luego fontconfig (fc-match) con
+    REPORT_FONT_FAMILY, la ruta de Windows y algunas fuentes comunes de Linux. Devuelve None si no hay ninguna.
+    """
+    if REPORT_FONT_PATH and os.path.exists(REPORT_FONT_PATH):
+        return REPORT_FONT_PATH
+
+    if shutil.which('fc-match'):
+        try:
+            result = subprocess.run(
+                ['fc-match', '-f', '%{file}', REPORT_FONT_FAMILY], capture_output=True, text=True, timeout=5
+            )
+            if result.returncode == 0 and os.path.exists(result.stdout.strip()):
+                return result.stdout.strip()
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"  - Advertencia: fc-match no pudo resolver la fuente '{REPORT_FONT_FAMILY}': {e}")
+
+    for path in [FONT_PATH] + FALLBACK_FONT_PATHS:
+        if os.path.exists(path):
+            return path
+
+    print("  - Advertencia: no se encontró ninguna fuente TrueType; se usará la fuente por defecto.")
+    return None
+
+@lru_cache(maxsize=32)
+def get_font(size):
+    """Devuelve la fuente del tamaño pedido, cargándola una sola vez por tamaño."""
+    font_path = resolve_font_path()
+    if font_path:
+        try:
+            return ImageFont.truetype(font_path, size)
+        except IOError:
+            pass
+    return ImageFont.load_default()
+
+def _text_width(font, text):
+    return font.getbbox(str(text))[2]
+
+def _text_height(font):
+    bbox = font.getbbox('A')
+    return bbox[3] - bbox[1]
+
+def _table_rows(conexiones):
+    """Convierte las conexiones en las filas de texto de la tabla."""
+    rows = []
     for c in conexiones:
         try:
             profundidad = round(float(c.get('cota_razante', 0)) - float(c.get('cota_clave', 0)), 2)
         except (ValueError, TypeError):
             profundidad = "N/A"
-        data_for_table.append([
-            c.get('diametro_pulgadas', ''),
-            profundidad,
-            c.get('material', '')
-        ])
-
-    try:
-        font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
-        header_font = ImageFont.truetype(FONT_PATH, HEADER_FONT_SIZE)
-    except IOError:
-        font = ImageFont.load_default()
-        header_font = ImageFont.load_default()
+        rows.append([str(c.get('diametro_pulgadas', '')), str(profundidad), str(c.get('material', ''))])
+    return rows
 
+def _layout(rows, target_width_px):
+    """
+    Calcula en una sola pasada las fuentes, el relleno y el ancho de cada columna.
+    Los textos se miden una vez al tamaño base; si hay que reducir la tabla, los anchos se escalan
+    en proporción al nuevo tamaño de fuente en lugar de volver a medir cada celda.
+    """
+    font, header_font = get_font(FONT_SIZE), get_font(HEADER_FONT_SIZE)
+    header_widths = [_text_width(header_font, header) for header in HEADERS]
+    cell_widths = [max((_text_width(font, row[i]) for row in rows), default=0) for i in range(len(HEADERS))]
     padding = PADDING
-    
-    original_col_widths = [
-        max(header_font.getbbox(str(header))[2], max(font.getbbox(str(item))[2] for item in col)) 
-        for header, col in zip(headers, zip(*data_for_table))
-    ]
-    original_img_width = sum(original_col_widths) + (len(original_col_widths) + 1) * padding
 
+    original_img_width = sum(map(max, header_widths, cell_widths)) + (len(HEADERS) + 1) * padding
     if target_width_px and original_img_width > target_width_px:
         scale_factor = target_width_px / original_img_width
-        
+
         new_font_size = max(MIN_FONT_SIZE, int(FONT_SIZE * scale_factor))
         new_header_font_size = max(MIN_HEADER_FONT_SIZE, int(HEADER_FONT_SIZE * scale_factor))
         padding = max(MIN_PADDING, int(PADDING * scale_factor))
-        
-        try:
-            font = ImageFont.truetype(FONT_PATH, new_font_size)
-            header_font = ImageFont.truetype(FONT_PATH, new_header_font_size)
-        except IOError:
-            font = ImageFont.load_default()
-            header_font = ImageFont.load_default()
 
-    col_widths = [
-        max(header_font.getbbox(str(header))[2], max(font.getbbox(str(item))[2] for item in col)) 
-        for header, col in zip(headers, zip(*data_for_table))
-    ]
+        scaled_font, scaled_header_font = get_font(new_font_size), get_font(new_header_font_size)
+        # La fuente de mapa de bits por defecto no cambia de tamaño: sus anchos se mantienen.
+        if isinstance(scaled_font, ImageFont.FreeTypeFont):
+            cell_widths = [math.ceil(w * new_font_size / FONT_SIZE) for w in cell_widths]
+        if isinstance(scaled_header_font, ImageFont.FreeTypeFont):
+            header_widths = [math.ceil(w * new_header_font_size / HEADER_FONT_SIZE) for w in header_widths]
+        font, header_font = scaled_font, scaled_header_font
+
+    col_widths = [max(h, c) for h, c in zip(header_widths, cell_widths)]
+    return font, header_font, padding, col_widths
+
+def _render_png(rows, target_width_px):
+    """Dibuja la tabla y devuelve los bytes PNG."""
+    font, header_font, padding, col_widths = _layout(rows, target_width_px)
     img_width = int(sum(col_widths) + (len(col_widths) + 1) * padding)
-    
-    row_height = font.getbbox('A')[3] - font.getbbox('A')[1] + padding
-    header_height = header_font.getbbox('A')[3] - header_font.getbbox('A')[1] + padding
-    img_height = header_height + len(conexiones) * row_height
+
+    row_height = _text_height(font) + padding
+    header_height = _text_height(header_font) + padding
+    img_height = header_height + len(rows) * row_height
 
     image = Image.new('RGB', (img_width, int(img_height)), BACKGROUND_COLOR)
     draw = ImageDraw.Draw(image)
 
     y_offset = 0
     x_offset = padding
-    for i, header in enumerate(headers):
+    for i, header in enumerate(HEADERS):
         draw.text((x_offset, y_offset + padding // 2), header, font=header_font, fill=HEADER_COLOR)
         x_offset += col_widths[i] + padding
     y_offset += header_height
     draw.line([(0, y_offset), (img_width, y_offset)], fill=LINE_COLOR, width=2)
 
-    for row_values in data_for_table[1:]:
+    for row_values in rows:
         x_offset = padding
         for i, cell_value in enumerate(row_values):
-            draw.text((x_offset, y_offset + padding // 2), str(cell_value), font=font, fill=TEXT_COLOR)
+            draw.text((x_offset, y_offset + padding // 2), cell_value, font=font, fill=TEXT_COLOR)
             x_offset += col_widths[i] + padding
         y_offset += row_height
         draw.line([(0, y_offset), (img_width, y_offset)], fill=LINE_COLOR, width=1)
 
     img_buffer = io.BytesIO()
     image.save(img_buffer, format='PNG')
-    img_buffer.seek(0)
+    return img_buffer.getvalue()
+
+def create_connections_table_image(conexiones, target_width_px=None):
+    """
+    Crea una imagen PNG que representa una tabla con los datos de las conexiones.
+    Las tablas ya dibujadas se guardan en memoria por el hash de sus filas y el ancho pedido.
+    """
+    rows = _table_rows(conexiones)
+    key = hashlib.sha1(json.dumps([rows, target_width_px], ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    with _render_cache_lock:
+        png_bytes = _render_cache.get(key)
+        if png_bytes is not None:
+            _render_cache.move_to_end(key)
+
+    if png_bytes is None:
+        png_bytes = _render_png(rows, target_width_px)
+        with _render_cache_lock:
+            _render_cache[key] = png_bytes
+            while len(_render_cache) > max(0, TABLE_IMAGE_CACHE_SIZE):
+                _render_cache.popitem(last=False)
+        print("  - Imagen de la tabla de conexiones creada.")
+    else:
+        print("  - Imagen de la tabla de conexiones reutilizada.")
 
-    print("  - Imagen de la tabla de conexiones creada.")
-    return img_buffer
+    return io.BytesIO(png_bytes)
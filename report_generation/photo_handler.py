@@ -0,0 +1,68 @@
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+
+from config import PHOTO_CACHE_DIR, PHOTO_PREFETCH_WORKERS, PHOTO_JPEG_QUALITY
+from .drive_handler import download_file
+from .excel_handler import PHOTO_BOX_PX
+from .photo_index import refresh_photo_index, first_photos
+
+def make_thumbnail(image_bytes, box=PHOTO_BOX_PX, quality=PHOTO_JPEG_QUALITY):
+    """Reduce la foto para que quepa en 'box' (ancho, alto en píxeles), respetando la orientación EXIF, y la devuelve en JPEG."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        # Con JPEG, draft decodifica directamente a una escala menor: mucho más rápido que abrir la foto completa.
+        side = max(box)
+        img.draft('RGB', (side, side))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(box, Image.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getvalue()
+
+def _cache_path(file, box, quality):
+    modified = re.sub(r'[^0-9A-Za-z]', '', file.get('modifiedTime', ''))
+    return os.path.join(PHOTO_CACHE_DIR, f"{file['id']}_{modified}_{box[0]}x{box[1]}_q{quality}.jpg")
+
+def _load_photo(file, box, quality):
+    """Devuelve (miniatura, venía de la caché). Ante un error devuelve (None, False) y el reporte sigue sin la foto."""
+    path = _cache_path(file, box, quality)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read(), True
+    try:
+        thumbnail = make_thumbnail(download_file(file['id']), box, quality)
+    except Exception as e:
+        print(f"  - Advertencia: no se pudo obtener la foto '{file.get('name')}': {e}")
+        return None, False
+
+    os.makedirs(PHOTO_CACHE_DIR, exist_ok=True)
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(thumbnail)
+    os.replace(f"{path}.tmp", path)
+    return thumbnail, False
+
+def prefetch_photos(pozo_numeros, box=PHOTO_BOX_PX, quality=PHOTO_JPEG_QUALITY):
+    """
+    Obtiene de una vez las fotos de varios pozos: pone al día el índice local de fotos (solo los cambios
+    de Drive), descarga en paralelo las que no estén en la caché local y las reduce al tamaño de su recuadro.
+    Devuelve {pozo_numero (texto): bytes JPEG}; los pozos sin foto no aparecen.
+    """
+    wanted = {str(p) for p in pozo_numeros}
+    refresh_photo_index()
+    targets = first_photos(wanted)
+    if not targets:
+        print(f"Fotos: ninguno de los {len(wanted)} pozos tiene fotos en Drive.")
+        return {}
+
+    workers = max(1, min(PHOTO_PREFETCH_WORKERS, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(targets, executor.map(lambda f: _load_photo(f, box, quality), targets.values())))
+
+    photos = {pozo: thumbnail for pozo, (thumbnail, _) in results.items() if thumbnail is not None}
+    cached = sum(1 for thumbnail, from_cache in results.values() if from_cache)
+    print(f"Fotos: {cached} desde la caché, {len(photos) - cached} descargadas, {len(wanted) - len(photos)} pozos sin foto.")
+    return photos
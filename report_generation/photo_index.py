@@ -0,0 +1,129 @@
+import os
+import re
+import sqlite3
+from googleapiclient.errors import HttpError
+
+from config import PHOTO_INDEX_FILE, DRIVE_FOLDER_ID
+from .drive_handler import list_folder_files, get_changes_start_token, list_changes
+
+# La ingesta nombra las fotos '<pozo>-<n>' (n empieza en 1); se acepta también una extensión.
+# El número de pozo se compara completo, así que '12-1' nunca se confunde con una foto del pozo '1'.
+PHOTO_NAME_RE = re.compile(r'^(?P<pozo>.+)-(?P<index>\d+)(?:\.\w+)?$')
+PHOTO_FIELDS = 'id, name, modifiedTime, md5Checksum, size'
+
+def parse_photo_name(name):
+    """Devuelve (pozo_numero, número de foto) a partir del nombre del archivo, o None si no sigue el formato."""
+    match = PHOTO_NAME_RE.match(name or '')
+    if not match:
+        return None
+    return match.group('pozo'), int(match.group('index'))
+
+def _connect():
+    """Abre el índice de fotos, creando el esquema si no existe."""
+    directory = os.path.dirname(PHOTO_INDEX_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(PHOTO_INDEX_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS fotos ("
+        " id TEXT PRIMARY KEY, pozo TEXT NOT NULL, indice INTEGER NOT NULL, nombre TEXT NOT NULL,"
+        " modificado TEXT, md5 TEXT, tamano INTEGER)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fotos_pozo ON fotos (pozo, indice)")
+    conn.execute("CREATE TABLE IF NOT EXISTS estado (clave TEXT PRIMARY KEY, valor TEXT)")
+    return conn
+
+def _get_state(conn, key):
+    row = conn.execute("SELECT valor FROM estado WHERE clave = ?", (key,)).fetchone()
+    return row['valor'] if row else None
+
+def _set_state(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO estado (clave, valor) VALUES (?, ?)", (key, value))
+
+def _upsert(conn, file):
+    """Guarda o actualiza una foto en el índice; los archivos que no siguen el formato de nombre se quitan."""
+    parsed = parse_photo_name(file.get('name'))
+    if parsed is None:
+        conn.execute("DELETE FROM fotos WHERE id = ?", (file['id'],))
+        return
+    pozo, index = parsed
+    conn.execute(
+        "INSERT OR REPLACE INTO fotos (id, pozo, indice, nombre, modificado, md5, tamano) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (file['id'], pozo, index, file['name'], file.get('modifiedTime'), file.get('md5Checksum'),
+         int(file['size']) if file.get('size') else None)
+    )
+
+def rebuild_photo_index():
+    """Reconstruye el índice completo con un solo listado paginado de la carpeta de fotos."""
+    # El token se pide antes de listar: un cambio ocurrido durante el listado se vuelve a aplicar, no se pierde.
+    page_token = get_changes_start_token()
+    files = list_folder_files(DRIVE_FOLDER_ID, PHOTO_FIELDS)
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM fotos")
+            for file in files:
+                _upsert(conn, file)
+            _set_state(conn, 'carpeta', DRIVE_FOLDER_ID)
+            _set_state(conn, 'page_token', page_token)
+        count = conn.execute("SELECT COUNT(*) FROM fotos").fetchone()[0]
+    finally:
+        conn.close()
+    print(f"Índice de fotos reconstruido: {count} fotos de {len(files)} archivos.")
+
+def refresh_photo_index():
+    """
+    Pone al día el índice de fotos. Si ya existe, solo trae del registro de cambios de Drive lo ocurrido
+    desde la última consulta; si no existe, es de otra carpeta o el token ya no es válido, lo reconstruye.
+    """
+    conn = _connect()
+    try:
+        page_token = _get_state(conn, 'page_token')
+        same_folder = _get_state(conn, 'carpeta') == DRIVE_FOLDER_ID
+    finally:
+        conn.close()
+    if not page_token or not same_folder:
+        return rebuild_photo_index()
+
+    try:
+        changes, new_token = list_changes(page_token, PHOTO_FIELDS + ', parents, trashed')
+    except HttpError as e:
+        print(f"  - Advertencia: no se pudo leer el registro de cambios de Drive ({e}); se reconstruye el índice.")
+        return rebuild_photo_index()
+
+    conn = _connect()
+    try:
+        with conn:
+            for change in changes:
+                file = change.get('file')
+                if change.get('removed') or not file or file.get('trashed') or DRIVE_FOLDER_ID not in file.get('parents', []):
+                    conn.execute("DELETE FROM fotos WHERE id = ?", (change['fileId'],))
+                else:
+                    _upsert(conn, file)
+            _set_state(conn, 'page_token', new_token)
+    finally:
+        conn.close()
+    print(f"Índice de fotos actualizado: {len(changes)} cambios en Drive desde la última consulta.")
+
+def _photo_dict(row):
+    return {'id': row['id'], 'name': row['nombre'], 'index': row['indice'], 'modifiedTime': row['modificado'],
+            'md5Checksum': row['md5'], 'size': row['tamano']}
+
+def first_photos(pozo_numeros):
+    """Devuelve {pozo_numero (texto): primera foto} para los pozos indicados que tengan fotos."""
+    pozos = sorted({str(p) for p in pozo_numeros})
+    result = {}
+    conn = _connect()
+    try:
+        # Por tramos, para no superar el límite de parámetros de SQLite.
+        for start in range(0, len(pozos), 500):
+            batch = pozos[start:start + 500]
+            rows = conn.execute(
+                f"SELECT * FROM fotos WHERE pozo IN ({', '.join('?' * len(batch))}) ORDER BY pozo, indice, nombre", batch
+            ).fetchall()
+            for row in rows:
+                result.setdefault(row['pozo'], _photo_dict(row))
+    finally:
+        conn.close()
+    return result
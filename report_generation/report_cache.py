@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from config import REPORT_CACHE_DIR, REPORT_REVISION_CHECKS, REPORT_REVISION_CHECK_DELAY
+from .drive_handler import get_report_revision, download_master_report
+
+def _revision_key(revision):
+    """Identificador de la revisión: headRevisionId si Drive lo da; si no, el md5 o la fecha de modificación."""
+    return revision.get('headRevisionId') or revision.get('md5Checksum') or revision.get('modifiedTime')
+
+def _cache_paths(file_id):
+    return (os.path.join(REPORT_CACHE_DIR, f"{file_id}.xlsx"),
+            os.path.join(REPORT_CACHE_DIR, f"{file_id}.json"))
+
+def _file_md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _matches_checksum(path, revision):
+    """Comprueba el archivo contra el md5Checksum de Drive (si Drive no lo da, se acepta)."""
+    expected = revision.get('md5Checksum')
+    return not expected or _file_md5(path) == expected
+
+def _load_entry(file_id):
+    """Devuelve la revisión guardada en la caché para el archivo, o None."""
+    data_path, meta_path = _cache_paths(file_id)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def store_report(file_id, file_obj, revision):
+    """Guarda una copia del reporte en la caché local asociada a su revisión, de forma atómica."""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    data_path, meta_path = _cache_paths(file_id)
+
+    # Se invalida primero la entrada anterior para no dejar datos nuevos con metadatos viejos.
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    file_obj.seek(0)
+    with open(f"{data_path}.tmp", 'wb') as f:
+        shutil.copyfileobj(file_obj, f)
+    os.replace(f"{data_path}.tmp", data_path)
+    file_obj.seek(0)
+
+    with open(f"{meta_path}.tmp", 'w') as f:
+        json.dump(revision, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+def fetch_report(file_id):
+    """
+    Devuelve la ruta de una copia temporal del reporte en su revisión actual.
+    Si la caché local ya tiene esa revisión se omite la descarga; si no, se descarga y se comprueba
+    contra el md5Checksum de Drive, repitiendo la descarga si llega una versión anterior.
+    """
+    revision = get_report_revision(file_id)
+    key = _revision_key(revision)
+    data_path, _ = _cache_paths(file_id)
+
+    entry = _load_entry(file_id)
+    if entry is not None and _revision_key(entry) == key and _matches_checksum(data_path, revision):
+        print(f"Reporte en caché local (revisión {key}); se omite la descarga.")
+        with open(data_path, 'rb') as src, tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as dst:
+            shutil.copyfileobj(src, dst)
+        return dst.name
+
+    for attempt in range(1, max(1, REPORT_REVISION_CHECKS) + 1):
+        temp_file_path = download_master_report(file_id)
+        if _matches_checksum(temp_file_path, revision):
+            break
+        os.remove(temp_file_path)
+        if attempt == max(1, REPORT_REVISION_CHECKS):
+            raise RuntimeError(f"La descarga del reporte no coincide con la revisión {key} tras {attempt} intentos.")
+        print(f"La descarga no coincide con la revisión {key}; reintentando...")
+        time.sleep(REPORT_REVISION_CHECK_DELAY)
+        revision = get_report_revision(file_id)
+        key = _revision_key(revision)
+
+    with open(temp_file_path, 'rb') as f:
+        store_report(file_id, f, revision)
+    return temp_file_path
+
+def confirm_revision(file_id, revision):
+    """
+    Espera a que Drive muestre la revisión recién subida. Devuelve True si se confirmó.
+    Sustituye a la espera fija que se hacía antes de cada descarga.
+    """
+    key = _revision_key(revision)
+    for attempt in range(max(1, REPORT_REVISION_CHECKS)):
+        if attempt:
+            time.sleep(REPORT_REVISION_CHECK_DELAY)
+        if _revision_key(get_report_revision(file_id)) == key:
+            print(f"Revisión {key} confirmada en Google Drive.")
+            return True
+    print(f"Advertencia: Google Drive todavía no muestra la revisión {key}.")
+    return False
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from config import (
+    REPORT_SHARD_MODE, REPORT_SHARD_MAX_SHEETS, REPORT_SHARD_MAX_BYTES, REPORT_SHARD_MANIFEST_NAME
+)
+from .drive_handler import copy_report, read_json_file, write_json_file
+
+def sharding_enabled():
+    """Indica si el reporte se reparte en varios libros en lugar de un único maestro."""
+    return REPORT_SHARD_MODE in ('month', 'size')
+
+def load_manifest():
+    """Descarga el manifiesto de particiones desde Drive. Devuelve (manifiesto, id del archivo)."""
+    manifest, manifest_id = read_json_file(REPORT_SHARD_MANIFEST_NAME)
+    if manifest is None:
+        print("No existe manifiesto de particiones; se creará uno nuevo.")
+        manifest = {'shards': [], 'pozos': {}}
+    # Manifiestos anteriores guardaban una sola hoja por pozo: se pasan a la lista de hojas.
+    for pozo_numero, entries in manifest['pozos'].items():
+        if isinstance(entries, dict):
+            manifest['pozos'][pozo_numero] = [entries]
+    return manifest, manifest_id
+
+def _current_period():
+    return datetime.now().strftime('%Y-%m') if REPORT_SHARD_MODE == 'month' else 'general'
+
+def _needs_rollover(shard, new_sheets):
+    """Decide si la partición actual ya no admite más hojas."""
+    if shard['period'] != _current_period():
+        return True
+    if shard['sheets'] and shard['sheets'] + new_sheets > REPORT_SHARD_MAX_SHEETS:
+        return True
+    return shard['bytes'] >= REPORT_SHARD_MAX_BYTES
+
+def select_shard(manifest, manifest_id, new_sheets):
+    """
+    Devuelve (partición, id del manifiesto) para las nuevas hojas, creando una partición nueva
+    (copia del reporte maestro usado como plantilla) si la actual está llena o es de otro mes.
+    """
+    shards = manifest['shards']
+    if shards and not _needs_rollover(shards[-1], new_sheets):
+        shard = shards[-1]
+        print(f"Usando la partición '{shard['name']}' ({shard['sheets']} hojas).")
+        return shard, manifest_id
+
+    period = _current_period()
+    sequence = sum(1 for s in shards if s['period'] == period) + 1
+    name = f"Reporte {period} ({sequence})"
+    shard = {'id': copy_report(name), 'name': name, 'period': period, 'sheets': 0, 'bytes': 0}
+    shards.append(shard)
+    print(f"Nueva partición creada: '{name}'.")
+    # Se registra de inmediato para no crear otra copia si esta ejecución falla.
+    manifest_id = write_json_file(REPORT_SHARD_MANIFEST_NAME, manifest, manifest_id)
+    return shard, manifest_id
+
+def record_shard_sheets(manifest, manifest_id, shard, sheets_by_pozo, size_bytes):
+    """
+    Registra en el manifiesto las hojas agregadas a la partición y lo guarda en Drive. Cada pozo guarda
+    la lista de sus hojas ({'shard', 'sheet'}), de la más antigua a la más reciente: si se regenera en
+    otra partición, la hoja anterior sigue existiendo y sigue apareciendo en el manifiesto.
+    """
+    for pozo_numero, sheet_title in sheets_by_pozo:
+        entries = manifest['pozos'].setdefault(str(pozo_numero), [])
+        entry = {'shard': shard['id'], 'sheet': sheet_title}
+        if entry not in entries:
+            entries.append(entry)
+    shard['sheets'] += len(sheets_by_pozo)
+    shard['bytes'] = size_bytes
+    return write_json_file(REPORT_SHARD_MANIFEST_NAME, manifest, manifest_id)
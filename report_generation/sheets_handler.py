@@ -1,32 +1,215 @@
+import os
+import json
+from gspread.utils import rowcol_to_a1, numericise_all
+
 from google_clients import get_gspread_client
-from config import SPREADSHEET_ID, WORKSHEET_NAME
+from sheet_mirror import (
+    POZO_COLUMN, mirror_enabled, prepare_sync, store_sheet_rows, rows_to_refresh, refresh_rows, get_rows_by_status,
+    set_status, unsynced_statuses, mark_synced
+)
+from config import (
+    SPREADSHEET_ID, WORKSHEET_NAME, PENDING_STATUS, INCOMPLETE_STATUS, GENERATED_STATUS, PENDING_SCAN_CURSOR_FILE
+)
+
+def _contiguous_ranges(row_numbers):
+    """Agrupa una lista de filas en tramos consecutivos: [2, 3, 4, 9] -> [(2, 4), (9, 9)]."""
+    ranges = []
+    for row_num in sorted(set(row_numbers)):
+        if ranges and row_num == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], row_num)
+        else:
+            ranges.append((row_num, row_num))
+    return ranges
+
+def _load_scan_cursor():
+    """Lee la última fila procesada por completo en escaneos anteriores (1 = solo la cabecera)."""
+    if not os.path.exists(PENDING_SCAN_CURSOR_FILE):
+        return 1
+    try:
+        with open(PENDING_SCAN_CURSOR_FILE) as f:
+            cursor = json.load(f)
+    except (OSError, ValueError):
+        return 1
+    # El cursor solo vale para la misma hoja de cálculo y pestaña.
+    if cursor.get('spreadsheet_id') != SPREADSHEET_ID or cursor.get('worksheet') != WORKSHEET_NAME:
+        return 1
+    return max(1, int(cursor.get('row', 1)))
+
+def _save_scan_cursor(row):
+    """Guarda el cursor de escaneo de forma atómica."""
+    temp_path = f"{PENDING_SCAN_CURSOR_FILE}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'spreadsheet_id': SPREADSHEET_ID, 'worksheet': WORKSHEET_NAME, 'row': row}, f)
+    os.replace(temp_path, PENDING_SCAN_CURSOR_FILE)
+
+def _record_from_row(header, row):
+    """
+    Arma el diccionario de un registro a partir de los valores de su fila, convirtiendo los números.
+    'pozo_numero' queda como texto: '007' debe seguir coincidiendo con el nombre de sus fotos en Drive.
+    """
+    row = row + [''] * (len(header) - len(row))
+    keep_text = [header.index(POZO_COLUMN) + 1] if POZO_COLUMN in header else []
+    return dict(zip(header, numericise_all(row, ignore=keep_text)))
+
+def _column_letter(col_index):
+    """Convierte un índice de columna (1 = A) en su letra."""
+    return rowcol_to_a1(1, col_index)[:-1]
 
-def get_pending_records():
-    """Obtiene todos los registros de la hoja de cálculo que están marcados como 'Pendiente'."""
+def get_pending_records(full_scan=False):
+    """
+    Obtiene los registros de la hoja de cálculo que están marcados como 'Pendiente'.
+    Solo lee la columna 'Estado' a partir del cursor guardado; con full_scan=True recorre toda la hoja.
+    Con la copia local activa (SHEET_MIRROR) solo se leen las filas nuevas y los pendientes se consultan en ella.
+    """
     print("Accediendo a Google Sheets para buscar registros pendientes...")
     gc = get_gspread_client()
     worksheet = gc.open_by_key(SPREADSHEET_ID).worksheet(WORKSHEET_NAME)
-    
-    all_records = worksheet.get_all_records()
+
     header = worksheet.row_values(1)
-    
-    pending_records = []
-    for i, record in enumerate(all_records):
-        if record.get('Estado') == 'Pendiente':
-            pending_records.append((i + 2, record)) # Guardamos el número de fila y los datos
-            
+    if mirror_enabled():
+        pending_records = _pending_from_mirror(worksheet, header, full_scan)
+    else:
+        pending_records = _scan_pending(worksheet, header, full_scan)
+
     if pending_records:
         print(f"Se encontraron {len(pending_records)} registros pendientes.")
     else:
         print("No hay registros pendientes para procesar.")
-        
+
     return worksheet, pending_records, header
 
-def update_record_status(worksheet, row_numbers):
-    """Actualiza el estado de una lista de filas a 'Generado'."""
-    print("\nActualizando estados en Google Sheets...")
-    col_index = worksheet.find('Estado').col
+def _scan_pending(worksheet, header, full_scan):
+    """Busca los pendientes leyendo la columna 'Estado' desde el cursor de escaneo."""
+    status_col = _column_letter(header.index('Estado') + 1)
+    cursor = 1 if full_scan else _load_scan_cursor()
+    print(f"Escaneando la columna 'Estado' desde la fila {cursor + 1}{' (escaneo completo)' if full_scan else ''}.")
+    # Más allá del tamaño de la hoja no hay filas, y la API rechaza el rango: no hay nada nuevo.
+    if cursor + 1 > worksheet.row_count:
+        return []
+
+    # 1. Leer solo la columna 'Estado' de las filas posteriores al cursor.
+    status_values = worksheet.get(f"{status_col}{cursor + 1}:{status_col}")
+    pending_rows = []
+    new_cursor = None
+    for offset, cell in enumerate(status_values):
+        row_num = cursor + 1 + offset
+        status = cell[0] if cell else ''
+        if status == PENDING_STATUS:
+            pending_rows.append(row_num)
+        # El cursor se detiene en la primera fila que aún puede generarse ('Pendiente', o 'Incompleto' mientras
+        # la ingesta termina de subir sus fotos); las de estado final o desconocido no lo frenan.
+        if new_cursor is None and status in (PENDING_STATUS, INCOMPLETE_STATUS):
+            new_cursor = row_num - 1
+    if new_cursor is None:
+        new_cursor = cursor + len(status_values)
+
+    # 2. Traer solo las filas pendientes, en una sola llamada.
+    pending_records = []
+    if pending_rows:
+        last_col = _column_letter(len(header))
+        ranges = _contiguous_ranges(pending_rows)
+        value_ranges = worksheet.batch_get([f"A{first}:{last_col}{last}" for first, last in ranges])
+        for (first_row, last_row), values in zip(ranges, value_ranges):
+            for offset in range(last_row - first_row + 1):
+                row = values[offset] if offset < len(values) else []
+                pending_records.append((first_row + offset, _record_from_row(header, row))) # Guardamos el número de fila y los datos
+
+    _save_scan_cursor(new_cursor)
+    return pending_records
+
+def _pending_from_mirror(worksheet, header, full_scan):
+    """
+    Sincroniza la copia local con la hoja y consulta en ella los pendientes. Primero se escriben en la
+    hoja los cambios de estado locales que hayan quedado sin publicar; después se leen, en una sola
+    llamada, las filas posteriores a la última sincronizada (todas con full_scan=True) junto con las ya
+    sincronizadas cuyo estado aún no es final, para ver los cambios hechos en la hoja (por ejemplo,
+    'Incompleto' -> 'Pendiente' cuando la ingesta termina de subir las fotos).
+    """
+    try:
+        _push_statuses(worksheet)
+    except Exception as e:
+        # Siguen marcados en la copia local; se reintentan al cambiar el próximo estado o en la próxima ejecución.
+        print(f" - Advertencia: no se pudieron publicar los estados pendientes en Google Sheets ({e}).")
+    first_row = prepare_sync(header, full_scan)
+    last_col = _column_letter(len(header))
+    refresh = _contiguous_ranges(rows_to_refresh(first_row)) if first_row > 2 else []
+    ranges = [f"A{first}:{last_col}{last}" for first, last in refresh]
+    # Más allá del tamaño de la hoja no hay filas, y la API rechaza el rango.
+    if first_row <= worksheet.row_count:
+        ranges.append(f"A{first_row}:{last_col}")
+    value_ranges = worksheet.batch_get(ranges) if ranges else []
+
+    refreshed = [
+        (first, [list(row) for row in values] + [[]] * (last - first + 1 - len(values)))
+        for (first, last), values in zip(refresh, value_ranges)
+    ]
+    refresh_rows(refreshed, header)
+    rows = [list(row) for row in value_ranges[len(refresh)]] if len(value_ranges) > len(refresh) else []
+    store_sheet_rows(first_row, rows, header, complete=first_row == 2)
+    print(f"Copia local sincronizada: {len(rows)} filas nuevas leídas desde la fila {first_row}"
+          f" y {sum(len(r) for _, r in refreshed)} filas releídas por no tener un estado final.")
+
+    status_index = header.index('Estado')
+    pending_records = []
+    for row_number, values in get_rows_by_status(PENDING_STATUS):
+        values = values + [''] * (len(header) - len(values))
+        # El estado de la copia local manda sobre el de la hoja mientras no se haya publicado.
+        values[status_index] = PENDING_STATUS
+        pending_records.append((row_number, _record_from_row(header, values)))
+    return pending_records
+
+def _status_updates(row_numbers, col_index, status):
+    """Arma los rangos de batch_update que ponen 'status' en la columna 'col_index' de las filas dadas."""
+    updates = []
+    for first_row, last_row in _contiguous_ranges(row_numbers):
+        cell_range = f"{rowcol_to_a1(first_row, col_index)}:{rowcol_to_a1(last_row, col_index)}"
+        updates.append({'range': cell_range, 'values': [[status]] * (last_row - first_row + 1)})
+    return updates
+
+def _push_statuses(worksheet, header=None):
+    """
+    Publica en la hoja, con una sola llamada, los cambios de estado de la copia local pendientes de sincronizar.
+    Si la llamada falla, los cambios siguen marcados para la próxima sincronización y el error se propaga:
+    la hoja es la copia publicada, y quien marcó las filas no debe darlas por actualizadas.
+    """
+    statuses = unsynced_statuses()
+    if not statuses:
+        return
+    if header is None:
+        header = worksheet.row_values(1)
+    col_index = header.index('Estado') + 1
+    updates = []
+    for status, row_numbers in statuses.items():
+        updates.extend(_status_updates(row_numbers, col_index, status))
+    total = sum(len(rows) for rows in statuses.values())
+    worksheet.batch_update(updates)
+    mark_synced(statuses)
+    print(f" - {total} estados publicados en Google Sheets en {len(updates)} rangos.")
+
+def update_record_status(worksheet, row_numbers, header=None, status=GENERATED_STATUS):
+    """
+    Actualiza el estado de una lista de filas (por defecto a 'Generado') en una sola llamada.
+    Con la copia local activa, el estado se cambia primero en ella y después se publica en la hoja;
+    si la publicación falla se lanza el error, para que el generador conserve su punto de control.
+    """
+    print(f"\nActualizando estados en Google Sheets a '{status}'...")
+    if not row_numbers:
+        print(" - No hay filas para actualizar.")
+        return
+
+    if mirror_enabled():
+        missing = set_status(row_numbers, status)
+        _push_statuses(worksheet, header)
+        if not missing:
+            return
+        # Las filas que la copia local aún no tiene se actualizan directamente en la hoja.
+        row_numbers = missing
+
+    # La columna sale de la cabecera que ya devolvió get_pending_records, sin buscar en toda la hoja.
+    if header is None:
+        header = worksheet.row_values(1)
+    col_index = header.index('Estado') + 1
 
-    for row_num in row_numbers:
-        worksheet.update_cell(row_num, col_index, 'Generado')
-        print(f" - Fila {row_num} actualizada a 'Generado'.")
+    updates = _status_updates(row_numbers, col_index, status)
+    worksheet.batch_update(updates)
+    print(f" - {len(row_numbers)} filas actualizadas a '{status}' en {len(updates)} rangos.")
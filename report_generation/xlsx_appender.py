@@ -0,0 +1,696 @@
+import io
+import re
+import time
+import struct
+import zlib
+import hashlib
+import zipfile
+import posixpath
+from xml.sax.saxutils import escape, quoteattr
+
+import openpyxl
+from PIL import Image
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string, get_column_letter
+
+from .excel_handler import FRAME_LAST_ROW, FRAME_LAST_COL, BACKGROUND_COLOR, FRAME_COLOR
+
+# --- Tipos y espacios de nombres de Open XML ---
+NS_RELATIONSHIPS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_DRAWING = 'http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing'
+NS_DRAWINGML = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+REL_OFFICE_DOCUMENT = NS_RELATIONSHIPS + '/officeDocument'
+REL_WORKSHEET = NS_RELATIONSHIPS + '/worksheet'
+REL_STYLES = NS_RELATIONSHIPS + '/styles'
+REL_DRAWING = NS_RELATIONSHIPS + '/drawing'
+REL_IMAGE = NS_RELATIONSHIPS + '/image'
+CT_WORKSHEET = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+CT_DRAWING = 'application/vnd.openxmlformats-officedocument.drawing+xml'
+IMAGE_TYPES = {'PNG': ('png', 'image/png'), 'JPEG': ('jpeg', 'image/jpeg')}
+EMU_PER_PIXEL = 9525
+
+# Valor de un atributo: XML admite comillas dobles o simples, y espacios alrededor del '='.
+_ATTR_VALUE = r"""(?:"[^"]*"|'[^']*')"""
+_ATTR_RE = re.compile(rf'([\w:]+)\s*=\s*({_ATTR_VALUE})')
+_RELATIONSHIP_RE = re.compile(r'<Relationship\b[^>]*?/>')
+_ROW_RE = re.compile(r'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+_CELL_RE = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+_ILLEGAL_XML_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SHEET_TAIL_DROP_RE = re.compile(
+    r'<(drawing|legacyDrawing|legacyDrawingHF|drawingHF|picture|tableParts|hyperlinks|oleObjects|controls)\b'
+    r'[^>]*?(?:/>|>.*?</\1>)', re.S
+)
+_BORDER_SIDES = ['start', 'left', 'end', 'right', 'top', 'bottom', 'diagonal', 'vertical', 'horizontal']
+
+# --- Utilidades de XML ---
+
+def _attrs(tag):
+    """Devuelve los atributos de la etiqueta de apertura de un elemento."""
+    return {name: value[1:-1] for name, value in _ATTR_RE.findall(tag[:tag.index('>') + 1])}
+
+def _attr_re(name):
+    """Expresión que encuentra el atributo 'name' (con el espacio que lo precede), con cualquier tipo de comillas."""
+    return rf'\s{re.escape(name)}\s*=\s*{_ATTR_VALUE}'
+
+def _set_attr(element, name, value):
+    """Asigna un atributo en la etiqueta de apertura de un elemento."""
+    end = element.index('>')
+    if element[end - 1] == '/':
+        end -= 1
+    opening, rest = element[:end], element[end:]
+    pattern = re.compile(_attr_re(name))
+    if pattern.search(opening):
+        opening = pattern.sub(f' {name}="{value}"', opening, count=1)
+    else:
+        opening = f'{opening} {name}="{value}"'
+    return opening + rest
+
+def _remove_attr(element, name):
+    end = element.index('>')
+    return re.sub(_attr_re(name), '', element[:end], count=1) + element[end:]
+
+def _open_element(element, tag):
+    """Convierte '<tag .../>' en '<tag ...></tag>' para poder agregarle hijos."""
+    if element.rstrip().endswith('/>') and element.count('<') == 1:
+        return element.rstrip()[:-2] + f'></{tag}>'
+    return element
+
+def _rels(xml):
+    """Lista las relaciones de un archivo .rels como diccionarios de atributos."""
+    return [_attrs(rel) for rel in _RELATIONSHIP_RE.findall(xml)]
+
+def _resolve(base_part, target):
+    """Resuelve el destino de una relación respecto de la parte que la declara."""
+    if target.startswith('/'):
+        return target[1:]
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+def _rels_path(part):
+    return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+def _next_rel_id(rels):
+    used = {int(r['Id'][3:]) for r in rels if r.get('Id', '').startswith('rId') and r['Id'][3:].isdigit()}
+    return f"rId{max(used, default=0) + 1}"
+
+def _relationship(rel_id, rel_type, target):
+    return f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{escape(target)}"/>'
+
+def _insert_before_close(xml, tag, content):
+    close = xml.rindex(f'</{tag}>')
+    return xml[:close] + content + xml[close:]
+
+# --- Escritor zip con copia en crudo ---
+
+class _ZipWriter:
+    """
+    Escritor zip mínimo: copia entradas de otro zip tal cual están comprimidas
+    (sin descomprimir ni recomprimir) y agrega entradas nuevas comprimidas con deflate.
+    """
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.entries = []
+
+    def copy_entry(self, src_fp, info):
+        src_fp.seek(info.header_offset)
+        header = src_fp.read(30)
+        fields = struct.unpack('<4s2B4HL2L2H', header)
+        _, _, _, flag_bits, _, dos_time, dos_date, _, _, _, name_len, extra_len = fields
+        name = src_fp.read(name_len)
+        extra = src_fp.read(extra_len)
+
+        offset = self.fp.tell()
+        self.fp.write(header + name + extra)
+        remaining = info.compress_size
+        while remaining:
+            chunk = src_fp.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ValueError(f"Entrada truncada en el zip de origen: {info.filename}")
+            self.fp.write(chunk)
+            remaining -= len(chunk)
+        if flag_bits & 0x08:
+            descriptor = src_fp.read(16)
+            self.fp.write(descriptor[:16 if descriptor[:4] == b'PK\x07\x08' else 12])
+
+        self.entries.append({
+            'name': name, 'flag_bits': info.flag_bits, 'compress_type': info.compress_type,
+            'time': dos_time, 'date': dos_date, 'crc': info.CRC,
+            'compress_size': info.compress_size, 'file_size': info.file_size, 'offset': offset,
+            'extra': info.extra, 'comment': info.comment, 'internal_attr': info.internal_attr,
+            'external_attr': info.external_attr, 'create_system': info.create_system,
+            'create_version': info.create_version, 'extract_version': info.extract_version,
+        })
+
+    def write(self, name, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        crc = zlib.crc32(data)
+        name_bytes = name.encode('utf-8')
+        flag_bits = 0 if name_bytes.isascii() else 0x800
+        dt = time.localtime()[:6]
+        dos_time = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+        dos_date = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
+
+        offset = self.fp.tell()
+        self.fp.write(struct.pack(
+            '<4s2B4HL2L2H', b'PK\x03\x04', 20, 0, flag_bits, zipfile.ZIP_DEFLATED,
+            dos_time, dos_date, crc, len(compressed), len(data), len(name_bytes), 0
+        ))
+        self.fp.write(name_bytes)
+        self.fp.write(compressed)
+        self.entries.append({
+            'name': name_bytes, 'flag_bits': flag_bits, 'compress_type': zipfile.ZIP_DEFLATED,
+            'time': dos_time, 'date': dos_date, 'crc': crc,
+            'compress_size': len(compressed), 'file_size': len(data), 'offset': offset,
+            'extra': b'', 'comment': b'', 'internal_attr': 0, 'external_attr': 0,
+            'create_system': 0, 'create_version': 20, 'extract_version': 20,
+        })
+
+    def close(self):
+        central_dir_offset = self.fp.tell()
+        for e in self.entries:
+            if max(e['offset'], e['compress_size'], e['file_size'], central_dir_offset) >= 0xFFFFFFFF:
+                raise ValueError("El libro supera el tamaño soportado sin ZIP64.")
+            self.fp.write(struct.pack(
+                '<4s4B4HL2L5H2L', b'PK\x01\x02', e['create_version'], e['create_system'],
+                e['extract_version'], 0, e['flag_bits'], e['compress_type'], e['time'], e['date'],
+                e['crc'], e['compress_size'], e['file_size'], len(e['name']), len(e['extra']),
+                len(e['comment']), 0, e['internal_attr'], e['external_attr'], e['offset']
+            ))
+            self.fp.write(e['name'] + e['extra'] + e['comment'])
+        central_dir_size = self.fp.tell() - central_dir_offset
+        self.fp.write(struct.pack(
+            '<4s4H2LH', b'PK\x05\x06', 0, 0, len(self.entries), len(self.entries),
+            central_dir_size, central_dir_offset, 0
+        ))
+
+# --- Estilos ---
+
+class _Styles:
+    """Permite agregar variantes de un estilo de celda (subrayado, relleno, bordes) a styles.xml."""
+
+    _SECTIONS = (('fonts', 'font'), ('fills', 'fill'), ('borders', 'border'), ('cellXfs', 'xf'))
+
+    def __init__(self, xml):
+        self.xml = xml
+        self.sections = {}
+        for section, child in self._SECTIONS:
+            match = re.search(rf'<{section}\b[^>]*?(?:/>|>(.*?)</{section}>)', xml, re.S)
+            if not match:
+                raise ValueError(f"styles.xml no contiene la sección <{section}>.")
+            child_re = re.compile(rf'<{child}(?=[\s/>])[^>]*?(?:/>|>.*?</{child}>)', re.S)
+            self.sections[section] = child_re.findall(match.group(1) or '')
+        self._cache = {}
+
+    def _add(self, section, element):
+        """Agrega un elemento a la sección (o reutiliza uno idéntico) y devuelve su índice."""
+        items = self.sections[section]
+        if element in items:
+            return items.index(element)
+        items.append(element)
+        return len(items) - 1
+
+    def variant(self, base_index, underline=False, fill_rgb=None, border_sides=(), border_rgb=None):
+        """Devuelve el índice de un estilo igual a base_index con los cambios indicados."""
+        key = (base_index, underline, fill_rgb, tuple(sorted(border_sides)), border_rgb)
+        if key in self._cache:
+            return self._cache[key]
+
+        xfs = self.sections['cellXfs']
+        xf = xfs[base_index] if base_index < len(xfs) else xfs[0]
+        attrs = _attrs(xf)
+
+        if underline:
+            font = self.sections['fonts'][int(attrs.get('fontId', 0))]
+            xf = _set_attr(_set_attr(xf, 'fontId', self._add('fonts', _underline_font(font))), 'applyFont', '1')
+        if fill_rgb:
+            fill = (f'<fill><patternFill patternType="solid"><fgColor rgb="00{fill_rgb}"/>'
+                    f'<bgColor rgb="00{fill_rgb}"/></patternFill></fill>')
+            xf = _set_attr(_set_attr(xf, 'fillId', self._add('fills', fill)), 'applyFill', '1')
+        if border_sides:
+            border = self.sections['borders'][int(attrs.get('borderId', 0))]
+            for side in border_sides:
+                border = _border_with_side(border, side, f'<{side} style="medium"><color rgb="00{border_rgb}"/></{side}>')
+            xf = _set_attr(_set_attr(xf, 'borderId', self._add('borders', border)), 'applyBorder', '1')
+
+        index = self._add('cellXfs', xf)
+        self._cache[key] = index
+        return index
+
+    def to_xml(self):
+        xml = self.xml
+        for section, _ in self._SECTIONS:
+            match = re.search(rf'<{section}\b[^>]*?(?:/>|>(.*?)</{section}>)', xml, re.S)
+            opening = re.match(rf'<{section}\b[^>]*?(?=/?>)', match.group(0)).group(0)
+            opening = _set_attr(opening + '>', 'count', len(self.sections[section]))
+            xml = xml[:match.start()] + opening + ''.join(self.sections[section]) + f'</{section}>' + xml[match.end():]
+        return xml
+
+def _underline_font(font):
+    font = _open_element(font, 'font')
+    if re.search(r'<u\b', font):
+        return re.sub(r'<u\b[^>]*?(?:/>|>.*?</u>)', '<u/>', font, count=1, flags=re.S)
+    match = re.search(r'<(vertAlign|sz|color|name|family|charset|scheme)\b', font)
+    position = match.start() if match else font.rindex('</font>')
+    return font[:position] + '<u/>' + font[position:]
+
+def _border_with_side(border, side, side_xml):
+    border = _open_element(border, 'border')
+    opening = border[:border.index('>') + 1]
+    body = border[len(opening):border.rindex('</border>')]
+    children = {}
+    extra = []
+    for match in re.finditer(r'<(\w+)\b[^>]*?(?:/>|>.*?</\1>)', body, re.S):
+        if match.group(1) in _BORDER_SIDES:
+            children[match.group(1)] = match.group(0)
+        else:
+            extra.append(match.group(0))
+    children[side] = side_xml
+    ordered = [children[name] for name in _BORDER_SIDES if name in children]
+    return opening + ''.join(ordered + extra) + '</border>'
+
+# --- Plantilla compilada ---
+
+def _cell_xml(ref, style, value):
+    """Genera el XML de una celda con un valor; los textos se escriben en línea, sin tocar sharedStrings."""
+    style_attr = f' s="{style}"' if style else ''
+    if value is None or value == '':
+        return f'<c r="{ref}"{style_attr}/>'
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"{style_attr}><v>{value!r}</v></c>'
+    text = escape(_ILLEGAL_XML_CHARS_RE.sub('', str(value)))
+    return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+class CompiledTemplate:
+    """
+    Hoja plantilla analizada una sola vez: filas y celdas indexadas, marco y fondo ya aplicados
+    como estilos, y el dibujo de la plantilla listo para reutilizarse en cada hoja nueva.
+    """
+
+    def __init__(self, sheet_xml, styles, drawing_xml=None, drawing_images=None):
+        self.styles = styles
+        self.drawing_xml = drawing_xml
+        # rId del dibujo de la plantilla -> ruta de la imagen dentro del zip
+        self.drawing_images = drawing_images or {}
+
+        match = re.search(r'<sheetData\s*/>|<sheetData>(.*?)</sheetData>', sheet_xml, re.S)
+        self.head = self._compile_head(sheet_xml[:match.start()])
+        self.tail = self._compile_tail(sheet_xml[match.end():])
+
+        # fila -> (etiqueta de apertura, {columna: xml de la celda})
+        self.rows = {}
+        for row_xml in _ROW_RE.findall(match.group(1) or ''):
+            row_num = int(_attrs(row_xml)['r'])
+            opening = re.match(r'<row\b[^>]*?(?=/?>)', row_xml).group(0)
+            body = row_xml[row_xml.index('>') + 1:]
+            # 'spans' es solo una pista de rendimiento y deja de ser válida al agregar celdas.
+            opening = re.sub(_attr_re('spans'), '', opening) + '>'
+            cells = {}
+            for cell_xml in _CELL_RE.findall(body):
+                column, _ = coordinate_from_string(_attrs(cell_xml)['r'])
+                cells[column_index_from_string(column)] = cell_xml
+            self.rows[row_num] = (opening, cells)
+
+        self._apply_frame()
+
+    @staticmethod
+    def _compile_head(head):
+        # Cada hoja nueva sin cuadrícula, no seleccionada y sin el identificador único de la plantilla.
+        head = re.sub(_attr_re('xr:uid'), '', head, count=1)
+        view = re.search(r'<sheetView\b[^>]*?/?>', head)
+        if view:
+            new_view = _set_attr(_remove_attr(view.group(0), 'tabSelected'), 'showGridLines', '0')
+            head = head[:view.start()] + new_view + head[view.end():]
+        return head
+
+    @staticmethod
+    def _compile_tail(tail):
+        # Se quitan las referencias a partes que no se duplican (dibujo, comentarios, tablas, vínculos...).
+        tail = _SHEET_TAIL_DROP_RE.sub('', tail)
+        return re.sub(rf'(<pageSetup\b[^>]*?)\s[\w]+:id\s*=\s*{_ATTR_VALUE}', r'\1', tail)
+
+    def _cell_style(self, row_num, col_num):
+        cell = self.rows.get(row_num, (None, {}))[1].get(col_num)
+        return int(_attrs(cell).get('s', 0)) if cell else 0
+
+    def _set_cell(self, row_num, col_num, cell_xml):
+        opening, cells = self.rows.setdefault(row_num, (f'<row r="{row_num}">', {}))
+        cells[col_num] = cell_xml
+
+    def _apply_frame(self):
+        """Aplica una sola vez el fondo gris fuera del marco y los bordes azules del marco."""
+        # Columnas y filas fuera del marco llevan el fondo como estilo propio, igual que en compile_template.
+        def gray_col(match):
+            col_xml = match.group(0)
+            col_attrs = _attrs(col_xml)
+            if int(col_attrs.get('min', 0)) <= FRAME_LAST_COL:
+                return col_xml
+            style = self.styles.variant(int(col_attrs.get('style', 0)), fill_rgb=BACKGROUND_COLOR)
+            return _set_attr(col_xml, 'style', style)
+        self.head = re.sub(r'<col\b[^>]*?/>', gray_col, self.head)
+
+        for row_num, (opening, cells) in list(self.rows.items()):
+            if row_num > FRAME_LAST_ROW:
+                row_attrs = _attrs(opening)
+                style = self.styles.variant(int(row_attrs.get('s', 0)), fill_rgb=BACKGROUND_COLOR)
+                self.rows[row_num] = (_set_attr(_set_attr(opening, 's', style), 'customFormat', '1'), cells)
+
+        for row_num, (_, cells) in list(self.rows.items()):
+            for col_num, cell_xml in list(cells.items()):
+                if row_num > FRAME_LAST_ROW or col_num > FRAME_LAST_COL:
+                    style = self.styles.variant(self._cell_style(row_num, col_num), fill_rgb=BACKGROUND_COLOR)
+                    cells[col_num] = _set_attr(cell_xml, 's', style)
+
+        sides = {}
+        for row_num in range(1, FRAME_LAST_ROW + 1):
+            sides.setdefault((row_num, FRAME_LAST_COL), []).append('right')
+        for col_num in range(1, FRAME_LAST_COL + 1):
+            sides.setdefault((FRAME_LAST_ROW, col_num), []).append('bottom')
+        for (row_num, col_num), cell_sides in sides.items():
+            style = self.styles.variant(self._cell_style(row_num, col_num), border_sides=cell_sides, border_rgb=FRAME_COLOR)
+            cell_xml = self.rows.get(row_num, (None, {}))[1].get(col_num)
+            if cell_xml is None:
+                cell_xml = f'<c r="{get_column_letter(col_num)}{row_num}"/>'
+            self._set_cell(row_num, col_num, _set_attr(cell_xml, 's', style))
+
+    def render(self, payload, drawing_rel_id=None):
+        """Genera el XML de la hoja para un registro a partir de los valores de su payload."""
+        underline = set(payload.get('underline', []))
+        edits = {}
+        for coord, value in payload['values'].items():
+            column, row_num = coordinate_from_string(coord)
+            edits.setdefault(row_num, {})[column_index_from_string(column)] = (coord, value)
+
+        max_row, max_col = 1, 1
+        rows_xml = []
+        for row_num in sorted(set(self.rows) | set(edits)):
+            opening, cells = self.rows.get(row_num, (f'<row r="{row_num}">', {}))
+            row_edits = edits.get(row_num)
+            if row_edits:
+                cells = dict(cells)
+                for col_num, (coord, value) in row_edits.items():
+                    style = self._cell_style(row_num, col_num)
+                    if coord in underline:
+                        style = self.styles.variant(style, underline=True)
+                    cells[col_num] = _cell_xml(coord, style, value)
+            if cells:
+                max_col = max(max_col, max(cells))
+            max_row = max(max_row, row_num)
+            rows_xml.append(opening + ''.join(cells[c] for c in sorted(cells)) + '</row>')
+
+        head = re.sub(r'<dimension\b[^>]*/>', f'<dimension ref="A1:{get_column_letter(max_col)}{max_row}"/>', self.head, count=1)
+        tail = self.tail
+        if drawing_rel_id:
+            drawing = f'<drawing xmlns:r="{NS_RELATIONSHIPS}" r:id="{drawing_rel_id}"/>'
+            match = re.search(r'<webPublishItems\b|<extLst\b|</worksheet>', tail)
+            tail = tail[:match.start()] + drawing + tail[match.start():]
+        return head + '<sheetData>' + ''.join(rows_xml) + '</sheetData>' + tail
+
+# --- Motor de anexado ---
+
+def _image_anchor(anchor, image_bytes, rel_id, shape_id):
+    """Genera un ancla de una celda para una imagen, con el tamaño real de la imagen en píxeles."""
+    column, row_num = coordinate_from_string(anchor)
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        width, height = img.size
+    return (
+        f'<xdr:oneCellAnchor xmlns:xdr="{NS_DRAWING}" xmlns:a="{NS_DRAWINGML}" xmlns:r="{NS_RELATIONSHIPS}">'
+        f'<xdr:from><xdr:col>{column_index_from_string(column) - 1}</xdr:col><xdr:colOff>0</xdr:colOff>'
+        f'<xdr:row>{row_num - 1}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from>'
+        f'<xdr:ext cx="{width * EMU_PER_PIXEL}" cy="{height * EMU_PER_PIXEL}"/>'
+        f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{shape_id}" name="Image {shape_id}"/>'
+        f'<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+        f'<xdr:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+        f'<xdr:spPr><a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic>'
+        f'<xdr:clientData/></xdr:oneCellAnchor>'
+    )
+
+def list_sheet_names(xlsx_path):
+    """Devuelve los nombres de las hojas de un libro leyendo solo workbook.xml."""
+    with zipfile.ZipFile(xlsx_path) as zf:
+        workbook_part = _workbook_part(zf)
+        workbook_xml = zf.read(workbook_part).decode('utf-8')
+    return [_unescape_attr(_attrs(s)['name']) for s in re.findall(r'<sheet\b[^>]*?/>', workbook_xml)]
+
+def _unescape_attr(value):
+    return (value.replace('&quot;', '"').replace('&apos;', "'").replace('&lt;', '<')
+            .replace('&gt;', '>').replace('&amp;', '&'))
+
+def _workbook_part(zf):
+    root_rels = _rels(zf.read('_rels/.rels').decode('utf-8'))
+    target = next(r['Target'] for r in root_rels if r['Type'] == REL_OFFICE_DOCUMENT)
+    return _resolve('', target)
+
+def _unused_part(names, pattern):
+    index = 1
+    while pattern.format(index) in names:
+        index += 1
+    names.add(pattern.format(index))
+    return pattern.format(index)
+
+def append_sheets(src_path, dst_path, sheets):
+    """
+    Escribe en dst_path una copia de src_path con una hoja nueva por cada (título, payload) de 'sheets',
+    usando la primera hoja como plantilla. Las partes existentes se copian byte a byte;
+    solo se reescriben workbook.xml, sus relaciones, [Content_Types].xml y styles.xml.
+    Devuelve la lista de títulos agregados.
+    """
+    with zipfile.ZipFile(src_path) as zf, open(src_path, 'rb') as src_fp, open(dst_path, 'wb') as dst_fp:
+        names = set(zf.namelist())
+        workbook_part = _workbook_part(zf)
+        workbook_rels_part = _rels_path(workbook_part)
+        workbook_xml = zf.read(workbook_part).decode('utf-8')
+        workbook_rels_xml = zf.read(workbook_rels_part).decode('utf-8')
+        content_types_xml = zf.read('[Content_Types].xml').decode('utf-8')
+        workbook_rels = _rels(workbook_rels_xml)
+
+        # 1. Localizar la hoja plantilla (la primera del libro) y la hoja de estilos.
+        sheet_elements = re.findall(r'<sheet\b[^>]*?/>', workbook_xml)
+        template_rel_id = next(v for k, v in _attrs(sheet_elements[0]).items() if k.endswith(':id'))
+        rels_by_id = {r['Id']: r for r in workbook_rels}
+        template_part = _resolve(workbook_part, rels_by_id[template_rel_id]['Target'])
+        styles_part = _resolve(workbook_part, next(r['Target'] for r in workbook_rels if r['Type'] == REL_STYLES))
+        styles = _Styles(zf.read(styles_part).decode('utf-8'))
+
+        drawing_xml, drawing_images = None, {}
+        template_rels_part = _rels_path(template_part)
+        if template_rels_part in names:
+            for rel in _rels(zf.read(template_rels_part).decode('utf-8')):
+                if rel['Type'] == REL_DRAWING:
+                    drawing_part = _resolve(template_part, rel['Target'])
+                    drawing_xml = zf.read(drawing_part).decode('utf-8')
+                    drawing_rels_part = _rels_path(drawing_part)
+                    if drawing_rels_part in names:
+                        for drawing_rel in _rels(zf.read(drawing_rels_part).decode('utf-8')):
+                            if drawing_rel['Type'] == REL_IMAGE:
+                                drawing_images[drawing_rel['Id']] = _resolve(drawing_part, drawing_rel['Target'])
+        template = CompiledTemplate(zf.read(template_part).decode('utf-8'), styles, drawing_xml, drawing_images)
+        template_anchors = _template_anchors(drawing_xml, drawing_images)
+
+        # 2. Copiar en crudo todas las partes que no cambian.
+        rewritten = {workbook_part, workbook_rels_part, '[Content_Types].xml', styles_part}
+        writer = _ZipWriter(dst_fp)
+        for info in zf.infolist():
+            if info.filename not in rewritten:
+                writer.copy_entry(src_fp, info)
+
+        # 3. Escribir cada hoja nueva con su dibujo e imágenes a medida que se genera.
+        sheet_ids = [int(_attrs(s)['sheetId']) for s in sheet_elements]
+        rel_prefix = next(k for k in _attrs(sheet_elements[0]) if k.endswith(':id'))
+        media_by_hash = {}
+        existing_media = _MediaIndex(zf)
+        new_sheets_xml, new_rels_xml, new_overrides = [], [], []
+        image_defaults = set()
+        titles = []
+        for title, payload in sheets:
+            sheet_part = _unused_part(names, 'xl/worksheets/sheet{}.xml')
+            drawing_rel_id = None
+            if template_anchors or payload['images']:
+                drawing_part = _unused_part(names, 'xl/drawings/drawing{}.xml')
+                drawing_rels = [_relationship(rel_id, REL_IMAGE, '/' + media) for rel_id, media in drawing_images.items()]
+                anchors = list(template_anchors)
+                used_ids = list(drawing_images)
+                for i, (image_bytes, anchor) in enumerate(payload['images']):
+                    digest = hashlib.sha1(image_bytes).hexdigest()
+                    if digest not in media_by_hash:
+                        # Si el libro ya guarda esa imagen (p. ej. el placeholder), se referencia la existente.
+                        media_by_hash[digest] = existing_media.find(image_bytes, digest)
+                    if media_by_hash[digest] is None:
+                        with Image.open(io.BytesIO(image_bytes)) as img:
+                            extension, mimetype = IMAGE_TYPES.get(img.format, IMAGE_TYPES['PNG'])
+                        media_part = _unused_part(names, 'xl/media/image{}.' + extension)
+                        writer.write(media_part, image_bytes)
+                        media_by_hash[digest] = media_part
+                        image_defaults.add((extension, mimetype))
+                    rel_id = _next_rel_id([{'Id': r} for r in used_ids])
+                    used_ids.append(rel_id)
+                    drawing_rels.append(_relationship(rel_id, REL_IMAGE, '/' + media_by_hash[digest]))
+                    anchors.append(_image_anchor(anchor, image_bytes, rel_id, 1000 + i))
+
+                writer.write(drawing_part, _drawing_xml(anchors))
+                writer.write(_rels_path(drawing_part), _rels_xml(drawing_rels))
+                writer.write(_rels_path(sheet_part), _rels_xml([_relationship('rId1', REL_DRAWING, '/' + drawing_part)]))
+                new_overrides.append(f'<Override PartName="/{drawing_part}" ContentType="{CT_DRAWING}"/>')
+                drawing_rel_id = 'rId1'
+
+            writer.write(sheet_part, template.render(payload, drawing_rel_id))
+            new_overrides.append(f'<Override PartName="/{sheet_part}" ContentType="{CT_WORKSHEET}"/>')
+
+            workbook_rel_id = _next_rel_id(workbook_rels)
+            workbook_rels.append({'Id': workbook_rel_id})
+            new_rels_xml.append(_relationship(workbook_rel_id, REL_WORKSHEET, '/' + sheet_part))
+            sheet_ids.append(max(sheet_ids) + 1)
+            new_sheets_xml.append(f'<sheet name={quoteattr(title)} sheetId="{sheet_ids[-1]}" {rel_prefix}="{workbook_rel_id}"/>')
+            titles.append(title)
+
+        # 4. Reescribir las partes de índice del paquete.
+        declared = {_attrs(d).get('Extension', '').lower() for d in re.findall(r'<Default\b[^>]*?/>', content_types_xml)}
+        for extension, mimetype in image_defaults:
+            if extension not in declared:
+                new_overrides.insert(0, f'<Default Extension="{extension}" ContentType="{mimetype}"/>')
+        writer.write('[Content_Types].xml', _insert_before_close(content_types_xml, 'Types', ''.join(new_overrides)))
+        writer.write(workbook_part, _insert_before_close(workbook_xml, 'sheets', ''.join(new_sheets_xml)))
+        writer.write(workbook_rels_part, _insert_before_close(workbook_rels_xml, 'Relationships', ''.join(new_rels_xml)))
+        writer.write(styles_part, styles.to_xml())
+        writer.close()
+
+    return titles
+
+class _MediaIndex:
+    """Índice de las imágenes ya guardadas en un libro; solo calcula el hash de las que tienen el mismo tamaño."""
+
+    def __init__(self, zf):
+        self.zf = zf
+        self.by_size = {}
+        self.hashes = {}
+        for info in zf.infolist():
+            if info.filename.startswith('xl/media/'):
+                self.by_size.setdefault(info.file_size, []).append(info.filename)
+
+    def find(self, data, digest):
+        """Devuelve la parte que contiene exactamente esos bytes, o None."""
+        for name in self.by_size.get(len(data), []):
+            if name not in self.hashes:
+                self.hashes[name] = hashlib.sha1(self.zf.read(name)).hexdigest()
+            if self.hashes[name] == digest:
+                return name
+        return None
+
+def dedupe_media(src_file, dst_file):
+    """
+    Copia el libro de src_file a dst_file guardando una sola vez cada imagen repetida: las relaciones
+    de los dibujos que apuntaban a un duplicado pasan a apuntar a la primera copia.
+    Solo se calcula el hash de las imágenes que comparten tamaño con otra.
+    Acepta rutas o archivos binarios abiertos. Devuelve (imágenes eliminadas, bytes ahorrados).
+    Lo usa el motor openpyxl, que reescribe todas las imágenes del libro; el motor zip no lo necesita
+    porque append_sheets compara cada imagen nueva con las existentes (_MediaIndex).
+    """
+    src_fp = open(src_file, 'rb') if isinstance(src_file, str) else src_file
+    dst_fp = open(dst_file, 'wb') if isinstance(dst_file, str) else dst_file
+    try:
+        with zipfile.ZipFile(src_fp) as zf:
+            infos = zf.infolist()
+            by_size = {}
+            for info in infos:
+                if info.filename.startswith('xl/media/'):
+                    by_size.setdefault(info.file_size, []).append(info)
+            canonical, duplicates = {}, {}
+            for same_size in by_size.values():
+                if len(same_size) < 2:
+                    continue
+                for info in same_size:
+                    digest = hashlib.sha1(zf.read(info)).hexdigest()
+                    if digest in canonical:
+                        duplicates[info.filename] = canonical[digest]
+                    else:
+                        canonical[digest] = info.filename
+
+            rewritten = {}
+            if duplicates:
+                for info in infos:
+                    if not info.filename.endswith('.rels'):
+                        continue
+                    rels_xml = zf.read(info).decode('utf-8')
+                    base_part = _rels_base_part(info.filename)
+
+                    def retarget(match):
+                        rel = match.group(0)
+                        target = _resolve(base_part, _unescape_attr(_attrs(rel).get('Target', '')))
+                        if _attrs(rel).get('TargetMode') != 'External' and target in duplicates:
+                            return _set_attr(rel, 'Target', escape('/' + duplicates[target]))
+                        return rel
+                    new_xml = _RELATIONSHIP_RE.sub(retarget, rels_xml)
+                    if new_xml != rels_xml:
+                        rewritten[info.filename] = new_xml
+
+                content_types_xml = zf.read('[Content_Types].xml').decode('utf-8')
+                rewritten['[Content_Types].xml'] = re.sub(
+                    r'<Override\b[^>]*?/>',
+                    lambda m: '' if _attrs(m.group(0)).get('PartName', '').lstrip('/') in duplicates else m.group(0),
+                    content_types_xml
+                )
+
+            writer = _ZipWriter(dst_fp)
+            saved = 0
+            for info in infos:
+                if info.filename in duplicates:
+                    saved += info.compress_size
+                elif info.filename in rewritten:
+                    writer.write(info.filename, rewritten[info.filename])
+                else:
+                    writer.copy_entry(src_fp, info)
+            writer.close()
+    finally:
+        if isinstance(src_file, str):
+            src_fp.close()
+        if isinstance(dst_file, str):
+            dst_fp.close()
+    return len(duplicates), saved
+
+def _rels_base_part(rels_part):
+    """Parte a la que pertenece un archivo .rels ('xl/_rels/workbook.xml.rels' -> 'xl/workbook.xml')."""
+    directory = posixpath.dirname(posixpath.dirname(rels_part))
+    return posixpath.join(directory, posixpath.basename(rels_part)[:-len('.rels')])
+
+def _template_anchors(drawing_xml, drawing_images):
+    """Extrae las anclas del dibujo de la plantilla que solo dependen de imágenes (o de ninguna relación)."""
+    if not drawing_xml:
+        return []
+    prefix_match = re.search(rf'xmlns:(\w+)\s*=\s*(["\']){re.escape(NS_DRAWING)}\2', drawing_xml)
+    prefix = f"{prefix_match.group(1)}:" if prefix_match else ''
+    root = drawing_xml[:drawing_xml.index('>', drawing_xml.index('wsDr'))]
+    namespaces = ' '.join(re.findall(rf'xmlns(?::\w+)?\s*=\s*{_ATTR_VALUE}', root))
+    anchors = []
+    for match in re.finditer(rf'<{prefix}(twoCellAnchor|oneCellAnchor|absoluteAnchor)\b.*?</{prefix}\1>', drawing_xml, re.S):
+        anchor = match.group(0)
+        rel_ids = [value[1:-1] for value in re.findall(rf'\w+:(?:embed|link|id)\s*=\s*({_ATTR_VALUE})', anchor)]
+        if all(rel_id in drawing_images for rel_id in rel_ids):
+            # Se declaran los espacios de nombres en el ancla para poder moverla a otro documento.
+            tag_end = len(prefix) + len(match.group(1)) + 1
+            anchors.append(anchor[:tag_end] + ' ' + namespaces + anchor[tag_end:])
+    return anchors
+
+def _drawing_xml(anchors):
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<xdr:wsDr xmlns:xdr="{NS_DRAWING}" xmlns:a="{NS_DRAWINGML}">' + ''.join(anchors) + '</xdr:wsDr>')
+
+def _rels_xml(relationships):
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + ''.join(relationships) + '</Relationships>')
+
+def verify_workbook(xlsx_path, expected_titles):
+    """Comprueba que openpyxl puede abrir el libro y leer todas las hojas agregadas."""
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True)
+    try:
+        missing = [title for title in expected_titles if title not in workbook.sheetnames]
+        if missing:
+            raise ValueError(f"Faltan hojas en el libro generado: {missing}")
+        for title in expected_titles:
+            for _ in workbook[title].iter_rows(values_only=True):
+                pass
+    finally:
+        workbook.close()
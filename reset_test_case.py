@@ -1,6 +1,8 @@
 import gspread
 from google_clients import get_gspread_client
 from config import SPREADSHEET_ID, WORKSHEET_NAME, PENDING_STATUS, GENERATED_STATUS
+from report_generation.sheets_handler import update_record_status
+from sheet_mirror import mirror_enabled, find_rows
 from run_report_generator import main as run_generator
 
 TEST_WELL_NAME = "GeminiTest"
@@ -16,20 +18,22 @@ def reset_test_record_status():
         spreadsheet = gspread_client.open_by_key(SPREADSHEET_ID)
         worksheet = spreadsheet.worksheet(WORKSHEET_NAME)
 
-        cell = worksheet.find(TEST_WELL_NAME)
-        if not cell:
-            print(f"No se encontró el registro de prueba '{TEST_WELL_NAME}'.")
-            return False
+        # Con la copia local activa, el pozo se busca en su índice sin recorrer la hoja.
+        rows = find_rows(TEST_WELL_NAME) if mirror_enabled() else []
+        if not rows:
+            cell = worksheet.find(TEST_WELL_NAME)
+            if not cell:
+                print(f"No se encontró el registro de prueba '{TEST_WELL_NAME}'.")
+                return False
+            rows = [cell.row]
 
         headers = worksheet.row_values(1)
-        try:
-            status_col_index = headers.index("Estado") + 1
-        except ValueError:
+        if "Estado" not in headers:
             print("No se encontró la columna 'Estado' en la hoja.")
             return False
 
-        worksheet.update_cell(cell.row, status_col_index, PENDING_STATUS)
-        print(f"Estado del pozo '{TEST_WELL_NAME}' en la fila {cell.row} cambiado a '{PENDING_STATUS}'.")
+        update_record_status(worksheet, rows, headers, PENDING_STATUS)
+        print(f"Estado del pozo '{TEST_WELL_NAME}' en la fila {', '.join(map(str, rows))} cambiado a '{PENDING_STATUS}'.")
         return True
 
     except Exception as e:
@@ -39,4 +43,5 @@ def reset_test_record_status():
 if __name__ == "__main__":
     if reset_test_record_status():
         print("\n--- Ejecutando el generador de reportes automáticamente ---")
-        run_generator()
+        # El registro reseteado puede estar antes del cursor de escaneo: se fuerza un escaneo completo.
+        run_generator(full_scan=True)
@@ -0,0 +1,309 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime
+
+# Mediciones sin red: cada escenario corre en un proceso propio contra los Sheets y Drive simulados
+# de benchmarks/fake_google.py, para que el pico de memoria y las cachés de un escenario no afecten a otro.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ['create_connections_table_image', 'fill_sheet', 'get_pending_records', 'ingest_survey', 'ingest_batch', 'run_report_generator']
+DEFAULT_SIZES = [10, 100, 1000]
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+PHOTOS_PER_SURVEY = 2
+TEMPLATE_FILE = os.path.join(ROOT, 'ejemplo.xltx')
+
+# Identificadores ficticios: el benchmark nunca debe apuntar a la hoja ni a las carpetas reales.
+BENCHMARK_IDS = {
+    'SHEET_ID': 'bench-sheet',
+    'MASTER_REPORT_ID': 'bench-master',
+    'DRIVE_FOLDER_ID': 'bench-photos',
+    'REPORTS_FOLDER_ID': 'bench-reports',
+}
+# Variables de configuración que se copian en el resultado para saber con qué ajustes se midió.
+REPORTED_SETTINGS = [
+    'REPORT_APPEND_ENGINE', 'REPORT_RENDER_WORKERS', 'REPORT_SHARD_MODE', 'SHEETS_BATCH_WINDOW_SECONDS',
+    'INGEST_WORKERS', 'PHOTO_UPLOAD_CHUNK_SIZE', 'PHOTO_COMPRESSION', 'SHEET_MIRROR', 'BENCHMARK_API_LATENCY_MS',
+    'BENCHMARK_API_THROTTLE_EVERY', 'GOOGLE_SHEETS_READS_PER_MINUTE', 'GOOGLE_SHEETS_WRITES_PER_MINUTE',
+    'GOOGLE_API_MAX_CONCURRENCY',
+]
+
+def _prepare_environment(work_dir):
+    """Configura el proceso para trabajar con identificadores ficticios y archivos locales temporales."""
+    os.environ.update(BENCHMARK_IDS)
+    os.environ.setdefault('GOOGLE_CREDENTIALS_JSON', '{"web": {}}')
+    os.environ['PENDING_SCAN_CURSOR_FILE'] = os.path.join(work_dir, 'pending_scan_cursor.json')
+    os.environ['REPORT_CACHE_DIR'] = os.path.join(work_dir, 'report_cache')
+    os.environ['SPOOL_DIR'] = os.path.join(work_dir, 'spool')
+    os.environ['METRICS_SUMMARY_DIR'] = os.path.join(work_dir, 'run_summaries')
+    os.environ['PHOTO_CACHE_DIR'] = os.path.join(work_dir, 'photo_cache')
+    os.environ['PHOTO_INDEX_FILE'] = os.path.join(work_dir, 'photo_index.db')
+    # Sin cuotas por defecto: se mide el código, no la espera por la cuota de Google (se pueden fijar a mano).
+    os.environ.setdefault('GOOGLE_SHEETS_READS_PER_MINUTE', '0')
+    os.environ.setdefault('GOOGLE_SHEETS_WRITES_PER_MINUTE', '0')
+    os.environ.setdefault('GOOGLE_DRIVE_REQUESTS_PER_MINUTE', '0')
+    # Los 429 simulados piden Retry-After: 0; sin espera base, los reintentos no alargan la medición.
+    os.environ.setdefault('GOOGLE_API_BACKOFF_SECONDS', '0')
+
+def _sheet_header():
+    from config import SHEET_HEADERS
+    return list(SHEET_HEADERS)
+
+def _pending_sheet(backend, size, rng):
+    """Crea la hoja simulada con 'size' registros pendientes. Devuelve (cabecera, encuestas)."""
+    from config import SPREADSHEET_ID, WORKSHEET_NAME, PENDING_STATUS
+    from benchmarks.synthetic import make_survey, survey_to_sheet_row
+
+    header = _sheet_header()
+    surveys = [make_survey(rng, i) for i in range(size)]
+    rows = [header] + [survey_to_sheet_row(survey, header, PENDING_STATUS) for survey in surveys]
+    backend.add_spreadsheet(SPREADSHEET_ID, {WORKSHEET_NAME: rows})
+    return header, surveys
+
+def _template_workbook():
+    import openpyxl
+    workbook = openpyxl.load_workbook(TEMPLATE_FILE)
+    workbook.template = False
+    return workbook
+
+# --- Escenarios: preparan los datos y devuelven la función que se mide (que devuelve el tamaño de salida) ---
+
+def _scenario_create_connections_table_image(backend, size, rng):
+    from benchmarks.synthetic import make_connections
+    from report_generation.excel_handler import TABLE_WIDTH_PX
+    from report_generation.image_generator import create_connections_table_image
+
+    tables = [make_connections(rng) for _ in range(size)]
+
+    def run():
+        return sum(len(create_connections_table_image(c, target_width_px=TABLE_WIDTH_PX).getvalue()) for c in tables)
+    return run
+
+def _scenario_fill_sheet(backend, size, rng):
+    from gspread.utils import numericise_all
+    from config import PENDING_STATUS
+    from benchmarks.synthetic import make_survey, survey_to_sheet_row
+    from report_generation.excel_handler import compile_template, load_template_images, add_template_images, fill_sheet
+
+    header = _sheet_header()
+    records = [dict(zip(header, numericise_all(survey_to_sheet_row(make_survey(rng, i), header, PENDING_STATUS))))
+               for i in range(size)]
+
+    def run():
+        workbook = _template_workbook()
+        template = workbook.worksheets[0]
+        compile_template(template)
+        template_images = load_template_images(template)
+        for i, record in enumerate(records):
+            sheet = workbook.copy_worksheet(template)
+            sheet.title = f"{record['pozo_numero']}_{i}"
+            add_template_images(sheet, template_images)
+            fill_sheet(sheet, record)
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        return buffer.tell()
+    return run
+
+def _scenario_get_pending_records(backend, size, rng):
+    from report_generation.sheets_handler import get_pending_records
+
+    _pending_sheet(backend, size, rng)
+
+    def run():
+        _, pending_records, _ = get_pending_records()
+        if len(pending_records) != size:
+            raise AssertionError(f"Se esperaban {size} registros pendientes y se obtuvieron {len(pending_records)}.")
+        return None
+    return run
+
+def _scenario_ingest_survey(backend, size, rng):
+    from werkzeug.datastructures import FileStorage
+    from config import SPREADSHEET_ID, WORKSHEET_NAME
+    from benchmarks.synthetic import make_survey, make_photo
+    from data_ingestion.ingestion_service import ingest_survey
+
+    backend.add_spreadsheet(SPREADSHEET_ID, {WORKSHEET_NAME: [_sheet_header()]})
+    surveys = [json.dumps(make_survey(rng, i)) for i in range(size)]
+    # Se generan pocas fotos distintas y se reutilizan: generar miles de JPEG no es lo que se quiere medir.
+    photos = [make_photo(rng) for _ in range(4)]
+
+    def run():
+        for i, data_str in enumerate(surveys):
+            files = [
+                FileStorage(io.BytesIO(photos[(i + j) % len(photos)]), filename=f"foto{j}.jpg", content_type='image/jpeg')
+                for j in range(PHOTOS_PER_SURVEY)
+            ]
+            ingest_survey(data_str, files)
+        return backend.bytes_uploaded
+    return run
+
+def _scenario_ingest_batch(backend, size, rng):
+    from werkzeug.datastructures import FileStorage
+    from config import SPREADSHEET_ID, WORKSHEET_NAME
+    from benchmarks.synthetic import make_survey, make_photo
+    from data_ingestion.ingestion_service import ingest_batch
+
+    backend.add_spreadsheet(SPREADSHEET_ID, {WORKSHEET_NAME: [_sheet_header()]})
+    lines = [json.dumps(make_survey(rng, i)) for i in range(size)]
+    photos = [make_photo(rng) for _ in range(4)]
+
+    def run():
+        files_by_index = {
+            i: [
+                FileStorage(io.BytesIO(photos[(i + j) % len(photos)]), filename=f"foto{j}.jpg", content_type='image/jpeg')
+                for j in range(PHOTOS_PER_SURVEY)
+            ]
+            for i in range(size)
+        }
+        results = ingest_batch(lines, files_by_index)
+        failed = [r for r in results if r['estado'] != 'ok']
+        if failed:
+            raise AssertionError(f"{len(failed)} encuestas del lote fallaron: {failed[0]['mensaje']}")
+        return backend.bytes_uploaded
+    return run
+
+def _scenario_run_report_generator(backend, size, rng):
+    from config import (
+        MASTER_REPORT_ID, REPORTS_FOLDER_ID, DRIVE_FOLDER_ID, GENERATED_STATUS, SPREADSHEET_ID, WORKSHEET_NAME
+    )
+    from benchmarks.synthetic import make_photo
+    import run_report_generator
+
+    header, surveys = _pending_sheet(backend, size, rng)
+    # Cada pozo tiene sus fotos en Drive, con los mismos nombres que les da la ingesta.
+    photos = [make_photo(rng, 1600, 1200) for _ in range(4)]
+    for i, survey in enumerate(surveys):
+        for j in range(1, PHOTOS_PER_SURVEY + 1):
+            backend.drive.put(name=f"{survey['pozo_numero']}-{j}", parents=[DRIVE_FOLDER_ID],
+                              content=photos[(i + j) % len(photos)], mime_type='image/jpeg')
+    buffer = io.BytesIO()
+    _template_workbook().save(buffer)
+    backend.drive.put(MASTER_REPORT_ID, name='reporte_maestro.xlsx', parents=[REPORTS_FOLDER_ID], content=buffer.getvalue())
+
+    def run():
+        run_report_generator.main(full_scan=True)
+        # main() captura sus propios errores: se comprueba el resultado en la hoja simulada.
+        status_col = header.index('Estado')
+        rows = backend.spreadsheets[SPREADSHEET_ID].sheets[WORKSHEET_NAME][1:]
+        generated = sum(1 for row in rows if len(row) > status_col and row[status_col] == GENERATED_STATUS)
+        if generated != size:
+            raise AssertionError(f"Solo {generated} de {size} registros quedaron como '{GENERATED_STATUS}'.")
+        return len(backend.drive.files[MASTER_REPORT_ID]['content'])
+    return run
+
+# --- Ejecución ---
+
+def _peak_rss_mb(who):
+    # En Linux ru_maxrss viene en KB.
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+def _run_child(scenario, size, seed):
+    """Ejecuta un escenario en este proceso e imprime el resultado como JSON."""
+    work_dir = tempfile.mkdtemp(prefix='benchmark-')
+    result = {'scenario': scenario, 'records': size, 'ok': True, 'error': None}
+    try:
+        _prepare_environment(work_dir)
+        sys.path.insert(0, ROOT)
+        from google_clients import set_client_backend
+        from benchmarks.fake_google import FakeGoogleBackend
+        from benchmarks.synthetic import make_rng
+
+        backend = FakeGoogleBackend(
+            latency=float(os.environ.get('BENCHMARK_API_LATENCY_MS', '0')) / 1000,
+            throttle_every=int(os.environ.get('BENCHMARK_API_THROTTLE_EVERY', '0')),
+        )
+        set_client_backend(backend)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run = globals()[f"_scenario_{scenario}"](backend, size, make_rng(seed))
+            before = backend.stats()
+            start = time.perf_counter()
+            try:
+                output_bytes = run()
+            except Exception as e:
+                result.update(ok=False, error=f"{type(e).__name__}: {e}")
+                output_bytes = None
+            wall_time = time.perf_counter() - start
+        after = backend.stats()
+
+        calls = {name: count - before['calls'].get(name, 0) for name, count in after['calls'].items()}
+        result.update({
+            'wall_time_s': round(wall_time, 4),
+            'per_record_ms': round(wall_time / max(1, size) * 1000, 3),
+            'peak_rss_mb': _peak_rss_mb(resource.RUSAGE_SELF),
+            'peak_rss_children_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            'api_calls': {name: count for name, count in sorted(calls.items()) if count},
+            'total_api_calls': after['total_calls'] - before['total_calls'],
+            'bytes_uploaded': after['bytes_uploaded'] - before['bytes_uploaded'],
+            'bytes_downloaded': after['bytes_downloaded'] - before['bytes_downloaded'],
+            'output_bytes': output_bytes,
+        })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(RESULT_PREFIX + json.dumps(result))
+
+def _run_scenario_process(scenario, size, seed):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', scenario, str(size), '--seed', str(seed)],
+        capture_output=True, text=True, cwd=ROOT
+    )
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {'scenario': scenario, 'records': size, 'ok': False,
+            'error': (completed.stderr.strip().splitlines() or ['sin salida'])[-1]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks sin red con Sheets y Drive simulados.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="Cantidades de registros, separadas por comas.")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Escenarios a ejecutar, separados por comas.")
+    parser.add_argument('--seed', type=int, default=1234, help="Semilla de los datos sintéticos.")
+    parser.add_argument('--output', help="Archivo donde guardar el JSON (por defecto, la salida estándar).")
+    parser.add_argument('--child', nargs=2, metavar=('ESCENARIO', 'REGISTROS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _run_child(args.child[0], int(args.child[1]), args.seed)
+        return
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+
+    results = []
+    for size in sizes:
+        for scenario in scenarios:
+            print(f"Midiendo {scenario} con {size} registros...", file=sys.stderr)
+            result = _run_scenario_process(scenario, size, args.seed)
+            status = f"{result['wall_time_s']}s" if result.get('ok') else f"ERROR: {result['error']}"
+            print(f"  -> {status}", file=sys.stderr)
+            results.append(result)
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {name: os.environ[name] for name in REPORTED_SETTINGS if name in os.environ},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Resultados guardados en {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -1,88 +1,293 @@
 import openpyxl
-import io
 import os
+import sys
 import time
-from copy import deepcopy
+import tempfile
 
+from config import MASTER_REPORT_ID, REPORT_APPEND_ENGINE, REPORT_APPEND_VERIFY, REPORT_CHUNK_SIZE, REPORT_PHOTOS
 from google_clients import get_credentials
+from api_scheduler import process_priority, BATCH
+from metrics import timed, increment, begin_run, annotate_run, write_run_summary
 from report_generation.sheets_handler import get_pending_records, update_record_status
-from report_generation.drive_handler import download_master_report, update_master_report
-from report_generation.excel_handler import fill_sheet
+from report_generation.drive_handler import update_master_report
+from report_generation.report_cache import fetch_report, store_report, confirm_revision
+from report_generation.excel_handler import (
+    compile_template, load_template_images, add_template_images, apply_sheet_payload, iter_sheet_payloads, unique_sheet_title
+)
+from report_generation.shard_handler import sharding_enabled, load_manifest, select_shard, record_shard_sheets
+from report_generation.photo_handler import prefetch_photos
+from report_generation.checkpoint_handler import load_checkpoint, save_checkpoint, clear_checkpoint
+from report_generation.xlsx_appender import append_sheets, dedupe_media, list_sheet_names, verify_workbook
 
-def main():
-    """Función principal que orquesta la generación de reportes."""
-    print("--- Iniciando Proceso de Generación de Reportes (Modular) ---")
-    master_report_path = None  # Inicializar la variable de ruta
-    try:
-        # 1. Verificar credenciales
-        get_credentials()
-        print("Autenticación con Google verificada.")
-
-        # 2. Obtener registros pendientes
-        worksheet, pending_records, _ = get_pending_records()
-        if not pending_records:
-            print("No hay registros pendientes. Finalizando.")
-            return
-
-        # 3. Lógica de espera y descarga del REPORTE MAESTRO
-        print("Esperando 7 segundos para mitigar posible caché de Google Drive...")
-        time.sleep(7)
-        master_report_path = download_master_report()
+def _append_with_openpyxl(master_report_path, pending_records, payloads, only_template):
+    """
+    Agrega las hojas cargando el libro completo con openpyxl. El libro se guarda en disco, no en memoria.
+    Devuelve (filas, hojas por pozo, archivo de salida abierto).
+    """
+    with timed('report.load_workbook'):
         workbook = openpyxl.load_workbook(master_report_path)
-        
-        # 4. Usar la primera hoja del libro de trabajo descargado como plantilla
-        template_sheet = workbook[workbook.sheetnames[0]]
-        print(f"Usando la hoja '{template_sheet.title}' como plantilla.")
-
-        # 5. Procesar cada registro pendiente
-        processed_rows = []
-        for row_number, record in pending_records:
-            base_name = str(record.get('pozo_numero', f"Fila_{row_number}"))
-            
-            # Lógica para nombres de hoja únicos
-            sheet_title = base_name
-            counter = 2
-            while sheet_title in workbook.sheetnames:
-                sheet_title = f"{base_name}({counter})"
-                counter += 1
 
-            print(f"\nProcesando Pozo: {base_name} -> Creando hoja: '{sheet_title}'")
-            
+    # 4. Usar la primera hoja del libro de trabajo descargado como plantilla
+    template_sheet = workbook[workbook.sheetnames[0]]
+    print(f"Usando la hoja '{template_sheet.title}' como plantilla.")
+
+    # Una partición nueva es una copia del maestro: solo conservamos la plantilla.
+    if only_template:
+        for sheet_name in workbook.sheetnames[1:]:
+            del workbook[sheet_name]
+
+    # Fondo, marco y cuadrícula se aplican una vez a una copia de trabajo de la plantilla; las hojas nuevas
+    # se copian de ella y la plantilla se guarda tal cual venía.
+    compiled_template = workbook.copy_worksheet(template_sheet)
+    compile_template(compiled_template)
+    template_images = load_template_images(template_sheet)
+
+    # 5. Armar una hoja por registro, en el mismo orden en que llegaron
+    processed_rows = []
+    sheets_by_pozo = []
+    start = time.perf_counter()
+    for (row_number, record), payload in zip(pending_records, payloads):
+        base_name = str(record.get('pozo_numero', f"Fila_{row_number}"))
+
+        # Lógica para nombres de hoja únicos
+        sheet_title = unique_sheet_title(base_name, workbook.sheetnames)
+
+        print(f"\nProcesando Pozo: {base_name} -> Creando hoja: '{sheet_title}'")
+
+        with timed('report.fill_sheet'):
             # Copiar la hoja de plantilla DENTRO del mismo libro de trabajo
-            new_sheet = workbook.copy_worksheet(template_sheet)
+            new_sheet = workbook.copy_worksheet(compiled_template)
             new_sheet.title = sheet_title
-            new_sheet.sheet_view.showGridLines = False  # Ocultar líneas de cuadrícula
+            new_sheet.sheet_view.showGridLines = False  # copy_worksheet no copia la vista de la hoja
+
+            # Las imágenes de la plantilla se leyeron una sola vez; cada hoja las referencia
+            add_template_images(new_sheet, template_images)
 
-            # Copiar las imágenes una por una con deepcopy
-            if hasattr(template_sheet, '_images') and template_sheet._images:
-                for img in template_sheet._images:
-                    new_img = deepcopy(img)
-                    new_sheet.add_image(new_img, new_img.anchor)
+            apply_sheet_payload(new_sheet, payload)
+
+        processed_rows.append(row_number)
+        sheets_by_pozo.append((base_name, sheet_title))
+
+    elapsed = time.perf_counter() - start
+    print(f"\n{len(processed_rows)} hojas armadas en {elapsed:.2f}s ({elapsed / max(1, len(processed_rows)):.3f}s por hoja).")
+
+    workbook.remove(compiled_template)
+
+    output_file = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    with tempfile.NamedTemporaryFile(suffix='.xlsx') as saved_file:
+        with timed('report.save'):
+            workbook.save(saved_file)
+        saved_file.seek(0)
+
+        # openpyxl guarda una copia de cada imagen por hoja (también de las que ya se habían compactado),
+        # y como reescribe el libro entero, aquí sí se revisan todas; se deja una sola por contenido.
+        with timed('report.dedupe_media'):
+            removed, saved_bytes = dedupe_media(saved_file, output_file)
+    print(f"Imágenes repetidas eliminadas: {removed} ({saved_bytes / 1024:.0f} KB).")
+    output_file.flush()
+    output_file.seek(0)
+    return processed_rows, sheets_by_pozo, output_file
+
+def _append_with_zip_engine(master_report_path, pending_records, payloads):
+    """
+    Agrega las hojas escribiendo directamente en el zip del libro, sin cargarlo con openpyxl.
+    Cada hoja se escribe en el archivo temporal en cuanto su payload está listo, así que en memoria
+    solo hay una hoja a la vez. Devuelve (filas, hojas por pozo, archivo de salida abierto).
+    """
+    existing_names = list_sheet_names(master_report_path)
+    print(f"Usando la hoja '{existing_names[0]}' como plantilla (motor zip).")
+
+    processed_rows = []
+    sheets_by_pozo = []
+
+    def sheets():
+        for (row_number, record), payload in zip(pending_records, payloads):
+            base_name = str(record.get('pozo_numero', f"Fila_{row_number}"))
+            sheet_title = unique_sheet_title(base_name, existing_names)
+            existing_names.append(sheet_title)
+
+            print(f"\nProcesando Pozo: {base_name} -> Creando hoja: '{sheet_title}'")
+            yield sheet_title, payload
 
-            fill_sheet(new_sheet, record)
-            
             processed_rows.append(row_number)
+            sheets_by_pozo.append((base_name, sheet_title))
 
-        # 6. Guardar y Subir
-        output_buffer = io.BytesIO()
-        workbook.save(output_buffer)
-        output_buffer.seek(0)
-        update_master_report(output_buffer)
+    # append_sheets ya guarda una sola vez cada imagen nueva y reutiliza las que el libro tenía, consultando
+    # un índice de las existentes: no hace falta otra pasada sobre todas las imágenes del libro.
+    output_file = tempfile.NamedTemporaryFile(suffix='.xlsx')
+    with timed('report.append_sheets'):
+        titles = append_sheets(master_report_path, output_file.name, sheets())
+    if REPORT_APPEND_VERIFY:
+        with timed('report.verify'):
+            verify_workbook(output_file.name, titles)
+        print("Verificación: openpyxl puede leer el libro generado.")
+    output_file.seek(0)
+    return processed_rows, sheets_by_pozo, output_file
 
-        # 7. Actualizar estado en Sheets
-        update_record_status(worksheet, processed_rows)
+def _resume_checkpoint(worksheet, header, pending_records, sharding):
+    """
+    Termina el lote que una ejecución anterior dejó a medias. Si sus hojas ya están en el reporte
+    (la subida llegó a Drive), solo falta registrarlas y marcar sus filas; si no, el lote se descarta
+    y sus registros, que siguen 'Pendiente', se generan de nuevo. Devuelve los registros que quedan.
+    """
+    checkpoint = load_checkpoint()
+    if checkpoint is None:
+        return pending_records
+
+    rows = checkpoint['rows']
+    print(f"Retomando el lote interrumpido de {len(rows)} registros (reporte {checkpoint['report_id']}).")
+    report_path = fetch_report(checkpoint['report_id'])
+    try:
+        existing_names = set(list_sheet_names(report_path))
+    finally:
+        os.remove(report_path)
+
+    sheets_by_pozo = [tuple(entry) for entry in checkpoint['sheets']]
+    if not all(title in existing_names for _, title in sheets_by_pozo):
+        print("El reporte no contiene las hojas del lote: se generarán de nuevo.")
+        clear_checkpoint()
+        return pending_records
+
+    if sharding is not None and checkpoint.get('shard') and not checkpoint.get('manifest_recorded'):
+        shard = next((s for s in sharding['manifest']['shards'] if s['id'] == checkpoint['report_id']), None)
+        if shard is not None:
+            sharding['manifest_id'] = record_shard_sheets(
+                sharding['manifest'], sharding['manifest_id'], shard, sheets_by_pozo, checkpoint['size']
+            )
+    with timed('report.status_update'):
+        update_record_status(worksheet, rows, header)
+    clear_checkpoint()
+    print(f"Lote interrumpido completado: {len(rows)} filas marcadas sin regenerar sus hojas.")
+
+    done = set(rows)
+    return [(row_number, record) for row_number, record in pending_records if row_number not in done]
+
+def _generate_chunk(chunk, worksheet, header, sharding):
+    """
+    Agrega al reporte las hojas de un lote de registros, lo sube y marca sus filas como 'Generado'.
+    Antes de subir se guarda un punto de control con las filas y hojas del lote, que se borra
+    cuando las filas quedan marcadas. 'sharding' es None o el manifiesto de particiones en uso.
+    """
+    # Elegir el libro de destino: el maestro o la partición actual
+    report_id = MASTER_REPORT_ID
+    shard = None
+    if sharding is not None:
+        shard, sharding['manifest_id'] = select_shard(sharding['manifest'], sharding['manifest_id'], len(chunk))
+        report_id = shard['id']
+
+    master_report_path = None
+    try:
+        # Obtener el REPORTE en su revisión actual (desde la caché local si no ha cambiado,
+        # como ocurre con el reporte que acaba de subir el lote anterior)
+        with timed('report.download'):
+            master_report_path = fetch_report(report_id)
+        increment('bytes_total', os.path.getsize(master_report_path), stage='report.download')
+
+        # Fotos de todos los pozos del lote, descargadas en paralelo (o desde la caché) y ya reducidas
+        photos = {}
+        if REPORT_PHOTOS:
+            with timed('report.photos'):
+                photos = prefetch_photos(record.get('pozo_numero') for _, record in chunk)
+
+        # El contenido de cada hoja (imágenes incluidas) se calcula a medida que se arma, en paralelo
+        # si hay varios procesos, sin guardar todos los payloads a la vez.
+        payloads = iter_sheet_payloads(
+            [record for _, record in chunk], photos=[photos.get(str(record.get('pozo_numero'))) for _, record in chunk]
+        )
+
+        # Agregar una hoja por registro. Una partición nueva hay que recortarla, y eso lo hace openpyxl.
+        new_shard = shard is not None and shard['sheets'] == 0
+        if REPORT_APPEND_ENGINE == 'zip' and not new_shard:
+            processed_rows, sheets_by_pozo, output = _append_with_zip_engine(master_report_path, chunk, payloads)
+        else:
+            processed_rows, sheets_by_pozo, output = _append_with_openpyxl(master_report_path, chunk, payloads, new_shard)
+
+        # Subir
+        with output:
+            output_size = output.seek(0, os.SEEK_END)
+            output.seek(0)
+            checkpoint = {
+                'report_id': report_id, 'rows': processed_rows, 'sheets': sheets_by_pozo, 'size': output_size,
+                'shard': shard is not None, 'manifest_recorded': False,
+            }
+            save_checkpoint(checkpoint)
+            with timed('report.upload'):
+                revision = update_master_report(output, report_id)
+            increment('bytes_total', output_size, stage='report.upload')
+            store_report(report_id, output, revision)
+        with timed('report.confirm_revision'):
+            confirm_revision(report_id, revision)
+        if shard is not None:
+            sharding['manifest_id'] = record_shard_sheets(
+                sharding['manifest'], sharding['manifest_id'], shard, sheets_by_pozo, output_size
+            )
+            checkpoint['manifest_recorded'] = True
+            save_checkpoint(checkpoint)
+
+        # Actualizar estado en Sheets
+        with timed('report.status_update'):
+            update_record_status(worksheet, processed_rows, header)
+        clear_checkpoint()
+        return output_size
 
-    except Exception as e:
-        print(f"--- ¡Ocurrió un error inesperado! ---")
-        print(f"Error: {e}")
-    
     finally:
-        # 8. Limpiar el archivo temporal
+        # Limpiar el archivo temporal
         if master_report_path and os.path.exists(master_report_path):
             os.remove(master_report_path)
             print(f"Archivo temporal eliminado: {master_report_path}")
 
+def main(full_scan=False):
+    """
+    Función principal que orquesta la generación de reportes.
+    Con full_scan=True se recorre toda la hoja en busca de pendientes, ignorando el cursor guardado.
+    Los registros se procesan en lotes de REPORT_CHUNK_SIZE: cada lote se sube y se marca antes
+    de empezar el siguiente, así que un fallo solo afecta al lote en curso.
+    Las llamadas a Google corren con prioridad de lotes (ver api_scheduler.py).
+    """
+    print("--- Iniciando Proceso de Generación de Reportes (Modular) ---")
+    begin_run('report', full_scan=full_scan, engine=REPORT_APPEND_ENGINE, chunk_size=REPORT_CHUNK_SIZE)
+    # Las peticiones a Google del generador ceden el paso a la ingesta y usan solo parte de la cuota.
+    with process_priority(BATCH):
+        try:
+            # 1. Verificar credenciales
+            with timed('report.credentials'):
+                get_credentials()
+            print("Autenticación con Google verificada.")
+
+            # 2. Obtener registros pendientes
+            with timed('report.pending_scan'):
+                worksheet, pending_records, header = get_pending_records(full_scan)
+            annotate_run(records=len(pending_records))
+
+            sharding = None
+            if sharding_enabled():
+                manifest, manifest_id = load_manifest()
+                sharding = {'manifest': manifest, 'manifest_id': manifest_id}
+
+            # 3. Terminar el lote que haya quedado a medias en una ejecución anterior
+            pending_records = _resume_checkpoint(worksheet, header, pending_records, sharding)
+            if not pending_records:
+                print("No hay registros pendientes. Finalizando.")
+                return
+
+            # 4. Procesar por lotes
+            chunk_size = REPORT_CHUNK_SIZE if REPORT_CHUNK_SIZE > 0 else len(pending_records)
+            chunks = [pending_records[i:i + chunk_size] for i in range(0, len(pending_records), chunk_size)]
+            for number, chunk in enumerate(chunks, 1):
+                print(f"\n=== Lote {number}/{len(chunks)}: {len(chunk)} registros ===")
+                output_size = _generate_chunk(chunk, worksheet, header, sharding)
+                annotate_run(chunks_done=number, output_bytes=output_size)
+
+        except Exception as e:
+            print(f"--- ¡Ocurrió un error inesperado! ---")
+            print(f"Error: {e}")
+            annotate_run(error=str(e))
+
+        finally:
+            summary_path = write_run_summary()
+            print(f"Resumen de tiempos guardado en {summary_path}")
+
     print("\n--- Proceso Finalizado ---")
 
 if __name__ == '__main__':
-    main()
+    main(full_scan='--full-scan' in sys.argv)
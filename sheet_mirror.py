@@ -0,0 +1,223 @@
+import os
+import json
+import sqlite3
+
+from config import SHEET_MIRROR, SHEET_MIRROR_FILE, SPREADSHEET_ID, WORKSHEET_NAME, SHEET_HEADERS, GENERATED_STATUS
+
+# Copia local (SQLite) de la pestaña 'Tabla Maestra'. La ingesta escribe en ella cada fila que agrega
+# a la hoja y el generador de reportes consulta en ella los pendientes y cambia los estados; la hoja
+# sigue siendo la copia publicada y se sincroniza por lotes desde report_generation/sheets_handler.py.
+# Solo sirve si el archivo persiste entre ejecuciones y es el mismo para la ingesta y el generador
+# (los dos en el mismo servidor): en un runner efímero cada ejecución empieza vacía y lee la hoja completa.
+
+STATUS_COLUMN = 'Estado'
+POZO_COLUMN = 'pozo_numero'
+
+def mirror_enabled():
+    return SHEET_MIRROR
+
+def _connect():
+    """Abre la copia local, creando el esquema si no existe."""
+    directory = os.path.dirname(SHEET_MIRROR_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(SHEET_MIRROR_FILE, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # 'sincronizada' = 0 indica un cambio de estado local que todavía no se escribió en la hoja.
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS filas ("
+        " fila INTEGER PRIMARY KEY, pozo_numero TEXT, estado TEXT, valores TEXT NOT NULL,"
+        " sincronizada INTEGER NOT NULL DEFAULT 1)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_filas_estado ON filas (estado, fila)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_filas_pozo ON filas (pozo_numero)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_filas_sincronizada ON filas (sincronizada)")
+    conn.execute("CREATE TABLE IF NOT EXISTS metadatos (clave TEXT PRIMARY KEY, valor TEXT)")
+    return conn
+
+def _get_meta(conn, key):
+    row = conn.execute("SELECT valor FROM metadatos WHERE clave = ?", (key,)).fetchone()
+    return row['valor'] if row else None
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO metadatos (clave, valor) VALUES (?, ?)", (key, value))
+
+def _sheet_key():
+    return f"{SPREADSHEET_ID}/{WORKSHEET_NAME}"
+
+def _column(header, name):
+    return header.index(name) if name in header else None
+
+def _upsert_rows(conn, first_row, rows, header, keep_local_status):
+    """
+    Guarda filas consecutivas desde 'first_row'. Con keep_local_status, una fila con un cambio
+    de estado aún sin sincronizar conserva su estado local.
+    """
+    status_col = _column(header, STATUS_COLUMN)
+    pozo_col = _column(header, POZO_COLUMN)
+    for offset, row in enumerate(rows):
+        row_number = first_row + offset
+        if not any(str(value).strip() for value in row):
+            conn.execute("DELETE FROM filas WHERE fila = ?", (row_number,))
+            continue
+        values = [str(value) for value in row] + [''] * (len(header) - len(row))
+        status = values[status_col] if status_col is not None else None
+        pozo = values[pozo_col] if pozo_col is not None else None
+        conn.execute(
+            "INSERT INTO filas (fila, pozo_numero, estado, valores, sincronizada) VALUES (?, ?, ?, ?, 1)"
+            " ON CONFLICT (fila) DO UPDATE SET pozo_numero = excluded.pozo_numero, valores = excluded.valores,"
+            " estado = CASE WHEN ? AND filas.sincronizada = 0 THEN filas.estado ELSE excluded.estado END,"
+            " sincronizada = CASE WHEN ? AND filas.sincronizada = 0 THEN 0 ELSE 1 END",
+            (row_number, pozo, status, json.dumps(values, ensure_ascii=False), keep_local_status, keep_local_status)
+        )
+
+def prepare_sync(header, full=False):
+    """
+    Prepara una sincronización desde la hoja y devuelve la primera fila que hay que leer.
+    Si la copia es de otra hoja, la cabecera cambió o se pide una sincronización completa, se leen todas.
+    """
+    conn = _connect()
+    try:
+        with conn:
+            same_sheet = _get_meta(conn, 'hoja') == _sheet_key()
+            same_header = _get_meta(conn, 'cabecera') == json.dumps(header, ensure_ascii=False)
+            if _get_meta(conn, 'hoja') is None:
+                print(" - Advertencia: la copia local está vacía, se lee la hoja completa. SHEET_MIRROR solo ahorra"
+                      " lecturas si SHEET_MIRROR_FILE persiste entre ejecuciones y lo comparte la ingesta.")
+            if not same_sheet or not same_header:
+                # Los estados locales sin sincronizar de otra hoja o cabecera ya no tienen sentido.
+                conn.execute("DELETE FROM filas")
+                _set_meta(conn, 'hoja', _sheet_key())
+                _set_meta(conn, 'cabecera', json.dumps(header, ensure_ascii=False))
+                _set_meta(conn, 'ultima_fila', '1')
+                return 2
+            if full:
+                return 2
+            return int(_get_meta(conn, 'ultima_fila') or 1) + 1
+    finally:
+        conn.close()
+
+def store_sheet_rows(first_row, rows, header, complete=False):
+    """
+    Guarda las filas leídas de la hoja desde 'first_row' y avanza la marca de lo ya sincronizado.
+    Con complete=True (se leyó hasta el final de la hoja desde la fila 2) se borran las filas locales
+    que ya no existen en la hoja.
+    """
+    last_row = first_row + len(rows) - 1
+    conn = _connect()
+    try:
+        with conn:
+            _upsert_rows(conn, first_row, rows, header, keep_local_status=True)
+            if complete:
+                conn.execute("DELETE FROM filas WHERE fila > ?", (last_row,))
+            _set_meta(conn, 'ultima_fila', str(max(last_row, first_row - 1)))
+    finally:
+        conn.close()
+
+def rows_to_refresh(before_row):
+    """
+    Devuelve las filas anteriores a 'before_row' cuyo estado todavía puede cambiar en la hoja (todas las que no
+    están 'Generado', como 'Incompleto' o 'Pendiente') y que no tienen un cambio local sin publicar.
+    """
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT fila FROM filas WHERE fila < ? AND sincronizada = 1 AND (estado IS NULL OR estado != ?) ORDER BY fila",
+            (before_row, GENERATED_STATUS)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row['fila'] for row in rows]
+
+def refresh_rows(ranges, header):
+    """
+    Guarda filas releídas de la hoja, como [(primera fila, filas)], sin mover la marca de lo ya sincronizado.
+    Los cambios de estado locales sin publicar se conservan.
+    """
+    conn = _connect()
+    try:
+        with conn:
+            for first_row, rows in ranges:
+                _upsert_rows(conn, first_row, rows, header, keep_local_status=True)
+    finally:
+        conn.close()
+
+def record_rows(numbered_rows, header=SHEET_HEADERS):
+    """
+    Escritura directa desde la ingesta: guarda las filas que se acaban de agregar a la hoja,
+    como [(número de fila, valores)], para que estén disponibles sin esperar a la próxima sincronización.
+    """
+    numbered_rows = [(row_number, row) for row_number, row in numbered_rows if row_number is not None]
+    if not numbered_rows:
+        return
+    conn = _connect()
+    try:
+        with conn:
+            # Si la copia aún no se inicializó con esta hoja y cabecera, las filas se leerán en la próxima sincronización.
+            if _get_meta(conn, 'hoja') != _sheet_key() or _get_meta(conn, 'cabecera') != json.dumps(list(header), ensure_ascii=False):
+                return
+            for row_number, row in numbered_rows:
+                _upsert_rows(conn, row_number, [row], header, keep_local_status=False)
+    finally:
+        conn.close()
+
+def get_rows_by_status(status):
+    """Devuelve [(número de fila, valores)] de las filas con el estado 'status', en orden de fila."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT fila, valores FROM filas WHERE estado = ? ORDER BY fila", (status,)).fetchall()
+    finally:
+        conn.close()
+    return [(row['fila'], json.loads(row['valores'])) for row in rows]
+
+def find_rows(pozo_numero):
+    """Devuelve los números de fila del pozo indicado, sin consultar la hoja."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT fila FROM filas WHERE pozo_numero = ? ORDER BY fila", (str(pozo_numero),)).fetchall()
+    finally:
+        conn.close()
+    return [row['fila'] for row in rows]
+
+def set_status(row_numbers, status):
+    """
+    Cambia el estado de las filas en la copia local y las marca para escribirlas en la hoja.
+    Devuelve las filas que no están en la copia (por ejemplo, agregadas después de la última sincronización).
+    """
+    missing = []
+    conn = _connect()
+    try:
+        with conn:
+            for row_number in row_numbers:
+                updated = conn.execute(
+                    "UPDATE filas SET estado = ?, sincronizada = 0 WHERE fila = ?", (status, row_number)
+                ).rowcount
+                if not updated:
+                    missing.append(row_number)
+    finally:
+        conn.close()
+    return missing
+
+def unsynced_statuses():
+    """Devuelve {estado: [filas]} con los cambios de estado que aún no se escribieron en la hoja."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT fila, estado FROM filas WHERE sincronizada = 0 ORDER BY fila").fetchall()
+    finally:
+        conn.close()
+    statuses = {}
+    for row in rows:
+        statuses.setdefault(row['estado'], []).append(row['fila'])
+    return statuses
+
+def mark_synced(statuses):
+    """Marca como sincronizadas las filas escritas en la hoja, salvo las que cambiaron de estado entretanto."""
+    conn = _connect()
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE filas SET sincronizada = 1 WHERE fila = ? AND estado = ?",
+                [(row_number, status) for status, row_numbers in statuses.items() for row_number in row_numbers]
+            )
+    finally:
+        conn.close()